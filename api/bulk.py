@@ -0,0 +1,46 @@
+import csv
+import io
+from typing import Any
+
+from fastapi import HTTPException, UploadFile, status
+from pydantic import BaseModel, ValidationError
+
+from schemas.bulk import BulkError, BulkResult
+from utils.config import get_settings
+
+
+settings = get_settings()
+
+
+def check_bulk_size(rows: list):
+    if len(rows) > settings.app.maximum_bulk_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {settings.app.maximum_bulk_size} rows per request")
+
+
+def validate_rows(rows: list[Any], schema: type[BaseModel]) -> tuple[dict[int, BaseModel], list[BulkError]]:
+    # Rows are validated one by one so a bad row is reported instead of rejecting the whole request
+    check_bulk_size(rows)
+    valid, errors = {}, []
+    for index, row in enumerate(rows):
+        try:
+            valid[index] = schema.model_validate(row)
+        except ValidationError as error:
+            detail = "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+            errors.append(BulkError(row=index, detail=detail))
+    return valid, errors
+
+
+async def read_csv_rows(file: UploadFile) -> list[dict]:
+    try:
+        content = (await file.read()).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="CSV file must be UTF-8 encoded")
+    # Empty cells are treated as missing values
+    return [{key: value for key, value in row.items() if key and value != ''}
+            for row in csv.DictReader(io.StringIO(content))]
+
+
+def merge_errors(result: BulkResult, errors: list[BulkError]) -> BulkResult:
+    result.errors = sorted(result.errors + errors, key=lambda e: e.row)
+    return result
@@ -1,4 +1,6 @@
-from fastapi import Depends, HTTPException, status
+from typing import NamedTuple
+
+from fastapi import Depends, HTTPException, Query, WebSocket, WebSocketException, status
 from fastapi.security import OAuth2PasswordBearer
 from logic.user import UserLogic
 from schemas.user import User
@@ -16,6 +18,14 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 logger = get_logger(__name__)
 
 
+class WebSocketUser(NamedTuple):
+    user: User
+    # Epoch seconds, the connection is closed once the token expires
+    expires_at: float
+
+
+# Users are read from the primary (or the entity cache, see UserLogic): a user deactivated or demoted must not stay
+# authorized while a replica catches up. Write routes share the session of their own get_db
 async def get_current_user(
         token: str = Depends(oauth2_scheme),
         db: Session = Depends(get_db)
@@ -69,3 +79,21 @@ async def is_super_user_or_is_admin(current_active_user: User = Depends(get_acti
     if not (current_active_user.isSuperUser or has_role(UserRoles.ADMIN, current_active_user.roles)):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized User")
     return True
+
+
+async def get_websocket_user(websocket: WebSocket,
+                             token: str | None = Query(default=None, description="Access token, browsers can't "
+                                                                                 "set headers on a WebSocket"),
+                             db: Session = Depends(get_db)):
+    """Same checks as get_active_current_user, the token comes from the `token` param or the Authorization header."""
+    if token is None:
+        scheme, _, token = websocket.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer":
+            token = None
+
+    payload = decode_access_token(token) if token else None
+    user_id = payload and payload.get("sub")
+    user = await UserLogic.get_by_id(db, row_id=user_id) if user_id is not None else None
+    if user is None or not user.isActive:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid authentication credentials")
+    return WebSocketUser(user, payload["exp"])
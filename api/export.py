@@ -0,0 +1,50 @@
+import csv
+import io
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Sequence
+
+from logic.order import to_utc
+from utils.enums import ExportFormats
+
+
+MEDIA_TYPES = {
+    ExportFormats.CSV: 'text/csv',
+    ExportFormats.NDJSON: 'application/x-ndjson',
+}
+
+
+def format_value(value: Any) -> Any:
+    # Datetimes are stored as naive UTC
+    if isinstance(value, datetime):
+        return to_utc(value).isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+async def stream_csv(columns: Sequence[str], batches: AsyncIterator[Sequence[Any]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    # The header goes out before the first row is read
+    yield buffer.getvalue()
+    async for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([format_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+async def stream_ndjson(columns: Sequence[str], batches: AsyncIterator[Sequence[Any]]) -> AsyncIterator[str]:
+    async for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, map(format_value, row)))) + '\n' for row in rows)
+
+
+def stream_export(export_format: ExportFormats, columns: Sequence[str],
+                  batches: AsyncIterator[Sequence[Any]]) -> AsyncIterator[str]:
+    """One chunk per batch of rows, so only a batch is ever held in memory."""
+    if export_format == ExportFormats.CSV:
+        return stream_csv(columns, batches)
+    return stream_ndjson(columns, batches)
@@ -0,0 +1,53 @@
+import hashlib
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from fastapi import Depends, Header, HTTPException, Request, Response, status
+from pydantic import BaseModel
+
+from api.dependencies import get_active_current_user
+from logic.idempotency import IdempotencyConflict, idempotency
+from schemas.user import User
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# Set on responses that were not produced by running the request again
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class IdempotentRequest(NamedTuple):
+    key: str
+    # Of the body, the same key with another body is refused
+    fingerprint: str
+    response: Response
+
+
+async def get_idempotent_request(request: Request, response: Response,
+                                 idempotency_key: str | None = Header(default=None, alias=IDEMPOTENCY_HEADER,
+                                                                      max_length=255),
+                                 current_user: User = Depends(get_active_current_user)) -> IdempotentRequest | None:
+    """None when the client sent no Idempotency-Key. Keys are scoped to the user and the endpoint."""
+    if idempotency_key is None:
+        return None
+    body = await request.body()
+    return IdempotentRequest(key=f"{current_user.id}:{request.method} {request.url.path}:{idempotency_key}",
+                             fingerprint=hashlib.sha256(body).hexdigest(), response=response)
+
+
+async def run_idempotent(idempotent_request: IdempotentRequest | None, execute: Callable[[], Awaitable[Any]],
+                         schema: type[BaseModel]) -> Any:
+    """
+    Result of `execute`, run at most once per Idempotency-Key: retries get the stored `schema` response without
+    touching the database, and duplicates sent while it runs wait for it.
+    """
+    if idempotent_request is None:
+        return await execute()
+    try:
+        result, replayed = await idempotency.run(idempotent_request.key, idempotent_request.fingerprint, execute,
+                                                 encode=lambda model: model.model_dump(mode='json'),
+                                                 decode=schema.model_validate)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                            detail=f"{IDEMPOTENCY_HEADER} was already used with a different request")
+    if replayed:
+        idempotent_request.response.headers[REPLAYED_HEADER] = 'true'
+    return result
@@ -0,0 +1,74 @@
+from typing import Any
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy.orm import Session
+
+from logic.base import CRUD
+from logic.cursor import InvalidCursor
+from logic.filters import InvalidFilter
+from api.sparse import SparseFields
+from schemas.paginated import Paginated
+from utils.config import get_settings
+from utils.enums import TotalModes
+
+
+settings = get_settings()
+
+
+def get_total_mode(include_total: bool, approximate_total: bool) -> TotalModes:
+    if not include_total:
+        return TotalModes.NONE
+    return TotalModes.APPROXIMATE if approximate_total else TotalModes.EXACT
+
+
+async def paginate(logic: CRUD, db: Session, query: Any, schema: Any,
+                   page: int = 1, skip: int = 0, size: int = 100, cursor: str | None = None,
+                   include_total: bool = True, approximate_total: bool = False, fields: SparseFields | None = None):
+    """
+    Page of `logic` rows matching `query`.
+
+    Without cursor it is the classic page/skip offset pagination. With a cursor (an empty one for the first page) it
+    switches to keyset pagination on the filter order_by columns, and the response carries `next_cursor`.
+
+    The filtered total can be skipped (include_total) or estimated from the planner statistics (approximate_total).
+
+    With sparse `fields` only those are loaded and serialized. The response is rendered here, as it no longer
+    matches the route's response_model.
+    """
+    if isinstance(query, logic.filter_model):
+        # Validated before the database is involved, the compiled plan is then reused by the queries below
+        try:
+            logic.check_filter(query)
+        except InvalidFilter as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    size = min(size, settings.app.maximum_page_size)
+    total_mode = get_total_mode(include_total, approximate_total)
+    next_cursor = None
+    names = fields.names if fields else None
+    if cursor is None:
+        absolute_skip = (max(page, 1) - 1) * size + skip
+        data, total = await logic.filter_page_by_query(db, query=query, skip=absolute_skip, limit=size,
+                                                       total_mode=total_mode, fields=names)
+    else:
+        try:
+            data, next_cursor = await logic.filter_by_query_cursor(db, query=query, cursor=cursor, limit=size,
+                                                                   fields=names)
+        except InvalidCursor as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+        if total_mode == TotalModes.EXACT:
+            total = await logic.count_rows_by_query_partial(db, query=query)
+        elif total_mode == TotalModes.APPROXIMATE:
+            total = await logic.estimate_rows_by_query_partial(db, query=query)
+        else:
+            total = None
+    result = Paginated[list[fields.model if fields else schema]](
+        data=data,
+        total=total,
+        page=page,
+        size=size,
+        next_cursor=next_cursor
+    )
+    if fields:
+        return Response(content=result.model_dump_json(), media_type='application/json')
+    return result
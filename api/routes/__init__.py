@@ -1 +1 @@
-from . import auth, admins, users, operators, forklifts, materials, orders
+from . import auth, admins, users, operators, forklifts, materials, orders, monitoring, analytics
\ No newline at end of file
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, HTTPException, Depends, Query, status
+from pydantic import AwareDatetime
+from fastapi_filter import FilterDepends
+
+from logic.analytics import MaterialUsageLogic, MAXIMUM_USAGE_ROWS
+from logic.filters import InvalidFilter
+from logic.order_log import OrderTransitionLogic
+from api.dependencies import is_super_user_or_is_admin
+from db.dependencies import get_db, get_read_db
+from sqlalchemy.orm import Session
+from utils.enums import UsageDimensions
+from utils.logs import get_logger
+import schemas
+
+
+logger = get_logger(__name__)
+
+
+# Period of the latency report when `since` is not given
+DEFAULT_LATENCY_DAYS = 7
+
+
+router = APIRouter(
+    prefix='/analytics',
+    tags=['analytics', 'platform'],
+    dependencies=[Depends(is_super_user_or_is_admin)]
+)
+
+
+@router.get("/material-usage", response_model=list[schemas.analytics.MaterialUsage], response_model_exclude_none=True)
+async def read_material_usage(usage_filter: schemas.analytics.MaterialUsageFilter =
+                              FilterDepends(schemas.analytics.MaterialUsageFilter),
+                              group_by: list[UsageDimensions] = Query(default=[UsageDimensions.DAY,
+                                                                               UsageDimensions.MATERIAL]),
+                              size: int = Query(default=1000, ge=1, le=MAXIMUM_USAGE_ROWS),
+                              db: Session = Depends(get_read_db)):
+    """
+    Quantity and lines ordered, summed by the `group_by` dimensions. Days are UTC days of the order creation, the
+    area is the one of the operator and every state is included unless filtered.
+    """
+    try:
+        MaterialUsageLogic.check_filter(usage_filter)
+    except InvalidFilter as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return await MaterialUsageLogic.get_usage(db, usage_filter, list(dict.fromkeys(group_by)), limit=size)
+
+
+@router.post("/material-usage/rebuild", status_code=status.HTTP_204_NO_CONTENT)
+async def rebuild_material_usage(db: Session = Depends(get_db)):
+    """
+    Recomputes the rollup from the orders, e.g. after orders were changed outside the API. The usage of the archived
+    orders is lost, see logic.partitions.
+    """
+    await MaterialUsageLogic.rebuild(db)
+
+
+@router.get("/order-latency", response_model=schemas.analytics.OrderLatency)
+async def read_order_latency(since: AwareDatetime | None = None, until: AwareDatetime | None = None,
+                             id_forklift: int | None = None,
+                             db: Session = Depends(get_read_db)):
+    """
+    Seconds the orders created in [since, until) took from pending to delivered, from delivered to confirmed and
+    overall, from their logged state changes. Defaults to the last 7 days.
+    """
+    until = until or datetime.now(timezone.utc)
+    since = since or until - timedelta(days=DEFAULT_LATENCY_DAYS)
+    # Stored as naive UTC
+    return await OrderTransitionLogic.get_latency(db, since.astimezone(timezone.utc).replace(tzinfo=None),
+                                                  until.astimezone(timezone.utc).replace(tzinfo=None), id_forklift)
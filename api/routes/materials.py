@@ -1,4 +1,6 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, Depends, Body, UploadFile, status
 from fastapi_filter import FilterDepends
 
 from logic.material import MaterialLogic
@@ -7,9 +9,11 @@ from utils.logs import get_logger
 import schemas
 from utils.config import get_settings
 from schemas.paginated import Paginated
+from api.pagination import paginate
+from api.bulk import check_bulk_size, validate_rows, read_csv_rows, merge_errors
 
 from sqlalchemy.orm import Session
-from db.dependencies import get_db
+from db.dependencies import get_db, get_read_db
 from sqlalchemy.exc import IntegrityError
 
 
@@ -30,21 +34,53 @@ server_error_exception = HTTPException(status_code=status.HTTP_500_INTERNAL_SERV
             dependencies=[Depends(get_active_current_user)], tags=['mobile'])
 async def read_materials(material_filter: schemas.material.MaterialFilter =
                          FilterDepends(schemas.material.MaterialFilter),
-                         page: int = 1, skip: int = 0, size: int = 100, db: Session = Depends(get_db)):
-    total = await MaterialLogic.get_rows_count(db)
-    size = min(size, settings.app.maximum_page_size)
-    absolute_skip = (max(page, 1) - 1) * size + skip
-    return Paginated[list[schemas.material.Material]](
-        data=await MaterialLogic.filter_by_query_partial(db, query=material_filter, skip=absolute_skip, limit=size),
-        total=total,
-        page=page,
-        size=size
-    )
+                         page: int = 1, skip: int = 0, size: int = 100, cursor: str | None = None,
+                         include_total: bool = True, approximate_total: bool = False,
+                         db: Session = Depends(get_read_db)):
+    return await paginate(MaterialLogic, db, material_filter, schemas.material.Material,
+                          page=page, skip=skip, size=size, cursor=cursor,
+                          include_total=include_total, approximate_total=approximate_total)
+
+
+# ------------------------
+# Bulk endpoints
+# ------------------------
+
+
+async def bulk_create_materials(rows: list[Any], db: Session):
+    valid, errors = validate_rows(rows, schemas.material.MaterialCreate)
+    result = await MaterialLogic.bulk_create(db, {index: row.model_dump() for index, row in valid.items()})
+    return merge_errors(result, errors)
+
+
+@router.post("/bulk", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def create_materials(rows: list[Any] = Body(), db: Session = Depends(get_db)):
+    return await bulk_create_materials(rows, db)
+
+
+@router.post("/bulk/csv", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def create_materials_from_csv(file: UploadFile, db: Session = Depends(get_db)):
+    return await bulk_create_materials(await read_csv_rows(file), db)
+
+
+@router.patch("/bulk", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def update_materials(rows: list[Any] = Body(), db: Session = Depends(get_db)):
+    valid, errors = validate_rows(rows, schemas.material.MaterialBulkPartialIn)
+    # Only the fields sent are changed, null included
+    result = await MaterialLogic.bulk_update(db, {index: row.model_dump(exclude_unset=True)
+                                                  for index, row in valid.items()})
+    return merge_errors(result, errors)
+
+
+@router.delete("/bulk", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def delete_materials(target_material_ids: list[int] = Body(), db: Session = Depends(get_db)):
+    check_bulk_size(target_material_ids)
+    return await MaterialLogic.bulk_delete(db, dict(enumerate(target_material_ids)))
 
 
 @router.get("/{target_material_id}", response_model=schemas.material.PublicMaterial,
             dependencies=[Depends(get_active_current_user)], tags=['mobile'])
-async def read_material(target_material_id: int, db: Session = Depends(get_db)):
+async def read_material(target_material_id: int, db: Session = Depends(get_read_db)):
     db_material = await MaterialLogic.get_by_id(db, row_id=target_material_id)
     if not db_material:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Material does not exist")
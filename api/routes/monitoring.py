@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends
+
+from api.dependencies import is_super_user_or_is_admin
+from db.pool import pool_statistics
+from logic.cache import entity_caches
+from utils.logs import get_logger
+import schemas
+
+
+logger = get_logger(__name__)
+
+
+router = APIRouter(
+    prefix='/monitoring',
+    tags=['monitoring', 'platform'],
+    dependencies=[Depends(is_super_user_or_is_admin)]
+)
+
+
+@router.get("/pool", response_model=list[schemas.monitoring.PoolStatus])
+async def read_pool_statistics():
+    return [statistics.snapshot() for statistics in pool_statistics.values()]
+
+
+@router.post("/pool/reset", response_model=list[schemas.monitoring.PoolStatus])
+async def reset_pool_statistics():
+    for statistics in pool_statistics.values():
+        statistics.reset()
+    return [statistics.snapshot() for statistics in pool_statistics.values()]
+
+
+@router.get("/cache", response_model=list[schemas.monitoring.CacheStatus])
+async def read_cache_statistics():
+    return [cache.snapshot() for cache in entity_caches.values()]
+
+
+@router.post("/cache/reset", response_model=list[schemas.monitoring.CacheStatus])
+async def reset_cache_statistics():
+    for cache in entity_caches.values():
+        cache.reset()
+    return [cache.snapshot() for cache in entity_caches.values()]
@@ -1,15 +1,22 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, Depends, Body, UploadFile, status
 from fastapi_filter import FilterDepends
 
 from logic import OperatorLogic
-from db.dependencies import get_db
+from logic.role_profile import ProtectedUserError
+from db.dependencies import get_db, get_read_db
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
 from api.dependencies import is_super_user_or_is_admin, get_active_current_user
 from utils.logs import get_logger
 import schemas
 from utils.config import get_settings
 from schemas.paginated import Paginated
-from api.routes.users import create_user, update_user, delete_user
+from api.pagination import paginate
+from api.sparse import SparseFields, sparse_fields
+from api.bulk import check_bulk_size, validate_rows, read_csv_rows, merge_errors
+from api.routes.users import create_user
 
 
 settings = get_settings()
@@ -30,21 +37,54 @@ router = APIRouter(
             dependencies=[Depends(get_active_current_user)], tags=['mobile'])
 async def read_operators(
         operator_filter: schemas.operator.OperatorFilter = FilterDepends(schemas.operator.OperatorFilter),
-        page: int = 1, skip: int = 0, size: int = 100, db: Session = Depends(get_db)):
-    total = await OperatorLogic.get_rows_count(db)
-    size = min(size, settings.app.maximum_page_size)
-    absolute_skip = (max(page, 1) - 1) * size + skip
-    return Paginated[list[schemas.operator.Operator]](
-        data=await OperatorLogic.filter_by_query_partial(db, query=operator_filter, skip=absolute_skip, limit=size),
-        total=total,
-        page=page,
-        size=size
-    )
+        page: int = 1, skip: int = 0, size: int = 100, cursor: str | None = None,
+        include_total: bool = True, approximate_total: bool = False,
+        fields: SparseFields | None = Depends(sparse_fields(schemas.operator.PublicOperator)),
+        db: Session = Depends(get_read_db)):
+    return await paginate(OperatorLogic, db, operator_filter, schemas.operator.Operator,
+                          page=page, skip=skip, size=size, cursor=cursor,
+                          include_total=include_total, approximate_total=approximate_total, fields=fields)
+
+
+# ------------------------
+# Bulk endpoints
+# ------------------------
+
+
+async def bulk_create_operators(rows: list[Any], db: Session):
+    valid, errors = validate_rows(rows, schemas.operator.OperatorCreate)
+    result = await OperatorLogic.bulk_create(db, {index: row.model_dump() for index, row in valid.items()})
+    return merge_errors(result, errors)
+
+
+@router.post("/bulk", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def create_operators(rows: list[Any] = Body(), db: Session = Depends(get_db)):
+    return await bulk_create_operators(rows, db)
+
+
+@router.post("/bulk/csv", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def create_operators_from_csv(file: UploadFile, db: Session = Depends(get_db)):
+    return await bulk_create_operators(await read_csv_rows(file), db)
+
+
+@router.patch("/bulk", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def update_operators(rows: list[Any] = Body(), db: Session = Depends(get_db)):
+    valid, errors = validate_rows(rows, schemas.operator.OperatorBulkPartialIn)
+    # Only the fields sent are changed, null included
+    result = await OperatorLogic.bulk_update_by_user_id(db, {index: row.model_dump(exclude_unset=True)
+                                                             for index, row in valid.items()})
+    return merge_errors(result, errors)
+
+
+@router.delete("/bulk", response_model=schemas.bulk.BulkResult, dependencies=[Depends(is_super_user_or_is_admin)])
+async def remove_operators(target_user_ids: list[int] = Body(), db: Session = Depends(get_db)):
+    check_bulk_size(target_user_ids)
+    return await OperatorLogic.bulk_delete_by_user_id(db, dict(enumerate(target_user_ids)))
 
 
 @router.get("/{target_operator_id}", response_model=schemas.operator.PublicOperator,
             dependencies=[Depends(get_active_current_user)], tags=['mobile'])
-async def read_operator(target_operator_id: int, db: Session = Depends(get_db)):
+async def read_operator(target_operator_id: int, db: Session = Depends(get_read_db)):
     db_operator = await OperatorLogic.get_by_id(db, row_id=target_operator_id)
     if not db_operator:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Operator does not exist")
@@ -62,17 +102,24 @@ async def create_operator(data_in: schemas.operator.OperatorCreate, db: Session
 @router.patch("/{target_user_id}", response_model=schemas.operator.PublicOperator,
               dependencies=[Depends(is_super_user_or_is_admin)])
 async def update_operator(target_user_id: int, data_in: schemas.operator.OperatorPartialIn, db: Session = Depends(get_db)):
-    operator = await OperatorLogic.get_by_user_id(db, target_user_id)
+    try:
+        operator = await OperatorLogic.update_by_user_id(db, target_user_id, data_in.model_dump(exclude_none=True))
+    except ProtectedUserError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Can't edit this user")
+    except DBAPIError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Error: Username already registered.")
     if not operator:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Operator not found")
-    await OperatorLogic.update(db, operator.id, data_in.model_dump(exclude_none=True))
-    await update_user(target_user_id, schemas.user.ModifyUserByAdmin(**data_in.model_dump(exclude_none=True)), db)
     return operator
 
 
 @router.delete("/{target_user_id}", dependencies=[Depends(is_super_user_or_is_admin)])
 async def remove_operator(target_user_id: int, db: Session = Depends(get_db)):
-    operator = await OperatorLogic.get_by_user_id(db, target_user_id)
-    if not operator:
+    try:
+        deleted = await OperatorLogic.delete_user_by_user_id(db, target_user_id)
+    except ProtectedUserError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Can't remove this user")
+    except DBAPIError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Can't delete User, related to other data")
+    if not deleted:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Operator not found")
-    await delete_user(target_user_id, db)
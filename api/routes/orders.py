@@ -1,25 +1,44 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+import asyncio
+import time
+
+from fastapi import APIRouter, HTTPException, Depends, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.exc import IntegrityError
 from fastapi_filter import FilterDepends
 
-from logic.order import OrderLogic
+from logic.dispatch import NoForkliftAvailable, dispatcher
+from logic.events import Subscription
+from logic.filters import InvalidFilter
+from logic.order import OrderLogic, ORDER_TRANSITIONS, ALL_ORDERS, EXPORT_COLUMNS, order_events
+from logic.order_log import OrderTransitionLogic, log_order_transition
 
-from db.dependencies import get_db
+from db.dependencies import get_db, get_read_db
 from sqlalchemy.orm import Session
 from utils.logs import get_logger
 from utils.config import get_settings
 from utils import enums
 
-from api.dependencies import get_active_current_user, is_operator_user, is_forklift_user
+from api.dependencies import get_active_current_user, is_operator_user, is_forklift_user, get_websocket_user, \
+    WebSocketUser
 
 import schemas
 from schemas.paginated import Paginated
+from api.export import MEDIA_TYPES, stream_export
+from api.idempotency import IdempotentRequest, get_idempotent_request, run_idempotent
+from api.pagination import paginate
+from api.sparse import SparseFields, sparse_fields
 from schemas.user import User
 
 logger = get_logger(__name__)
 settings = get_settings()
 
 
+MAXIMUM_WAIT_SECONDS = 30
+# Writes of other workers publish no event here, waits check the database again at least this often to see them
+CHANGES_RECHECK_SECONDS = 5
+# Rows read from the cursor and sent per chunk of an export
+EXPORT_BATCH_SIZE = 1000
+
 router = APIRouter(
     prefix='/orders',
     tags=['orders']
@@ -36,29 +55,76 @@ async def validate_can_cancel_order(db: Session):
 
 @router.get("", response_model=Paginated[list[schemas.order.PublicOrder]])
 async def read_orders(order_filter: schemas.order.OrderFilter = FilterDepends(schemas.order.OrderFilter),
-                      page: int = 1, skip: int = 0, size: int = 100,
-                      db: Session = Depends(get_db),
+                      page: int = 1, skip: int = 0, size: int = 100, cursor: str | None = None,
+                      include_total: bool = True, approximate_total: bool = False,
+                      fields: SparseFields | None = Depends(sparse_fields(schemas.order.PublicOrder)),
+                      db: Session = Depends(get_read_db),
                       current_user: User = Depends(get_active_current_user)):
-    if enums.has_role(enums.UserRoles.OPERATOR, current_user.roles):
-        order_filter.id_operator = current_user.id
-    elif enums.has_role(enums.UserRoles.FORKLIFT, current_user.roles):
-        order_filter.id_forklift = current_user.id
-
-    total = await OrderLogic.count_rows_by_query_partial(db, query=order_filter)
-    size = min(size, settings.app.maximum_page_size)
-    absolute_skip = (max(page, 1) - 1) * size + skip
-    return Paginated[list[schemas.order.Order]](
-        data=await OrderLogic.filter_by_query_partial(db, query=order_filter,
-                                                      skip=absolute_skip, limit=size),
-        total=total,
-        page=page,
-        size=size
-    )
+    restrict_order_filter(order_filter, current_user)
+    return await paginate(OrderLogic, db, order_filter, schemas.order.Order,
+                          page=page, skip=skip, size=size, cursor=cursor,
+                          include_total=include_total, approximate_total=approximate_total, fields=fields)
+
+
+@router.get("/export", response_class=StreamingResponse,
+            responses={200: {"content": {media_type: {} for media_type in MEDIA_TYPES.values()}}})
+async def export_orders(order_filter: schemas.order.OrderFilter = FilterDepends(schemas.order.OrderFilter),
+                        export_format: enums.ExportFormats = Query(default=enums.ExportFormats.CSV, alias="format"),
+                        db: Session = Depends(get_read_db),
+                        current_user: User = Depends(get_active_current_user)):
+    """
+    Every order matching the filter, a row per material line, streamed as CSV or NDJSON while it is read. Orders
+    without lines get one row with empty line columns.
+    """
+    restrict_order_filter(order_filter, current_user)
+    try:
+        OrderLogic.check_filter(order_filter)
+    except InvalidFilter as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+
+    batches = OrderLogic.export_rows(db, order_filter, batch_size=EXPORT_BATCH_SIZE)
+    return StreamingResponse(stream_export(export_format, list(EXPORT_COLUMNS), batches),
+                             media_type=MEDIA_TYPES[export_format],
+                             headers={"Content-Disposition": f'attachment; filename="orders.{export_format.value}"'})
+
+
+@router.get("/changes", response_model=schemas.order.OrderChanges)
+async def read_order_changes(since: int = Query(default=0, ge=0),
+                             wait: float = Query(default=0, ge=0, le=MAXIMUM_WAIT_SECONDS),
+                             size: int = Query(default=100, ge=1, le=1000),
+                             db: Session = Depends(get_read_db),
+                             current_user: User = Depends(get_active_current_user)):
+    """
+    Orders created or changed after version `since`, oldest change first. With `wait`, blocks up to that many seconds
+    until there is a change, holding no database connection while waiting.
+    """
+    owner = get_order_owner(current_user)
+    deadline = time.monotonic() + wait
+    # Subscribed before the first read, so a change committed in between still ends the wait
+    subscription = order_events.subscribe(get_owner_topics(owner))
+    try:
+        while True:
+            orders, has_more = await OrderLogic.get_changes(db, since, owner, limit=size)
+            remaining = deadline - time.monotonic()
+            if orders or remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(subscription.get(), timeout=min(remaining, CHANGES_RECHECK_SECONDS))
+            except TimeoutError:
+                pass
+            if subscription.closed:
+                order_events.unsubscribe(subscription)
+                subscription = order_events.subscribe(get_owner_topics(owner))
+    finally:
+        order_events.unsubscribe(subscription)
+
+    return schemas.order.OrderChanges(version=orders[-1].version if orders else since, has_more=has_more,
+                                      orders=orders)
 
 
 @router.get("/{target_order_id}", response_model=schemas.order.PublicOrder)
 async def read_individual_order(target_order_id: int,
-                                db: Session = Depends(get_db),
+                                db: Session = Depends(get_read_db),
                                 current_user: User = Depends(get_active_current_user)):
     db_order = await OrderLogic.get_by_id(db, row_id=target_order_id)
 
@@ -76,6 +142,17 @@ async def read_individual_order(target_order_id: int,
     return db_order
 
 
+@router.get("/{target_order_id}/timeline", response_model=list[schemas.order.OrderTransition])
+async def read_order_timeline(target_order_id: int,
+                              db: Session = Depends(get_read_db),
+                              current_user: User = Depends(get_active_current_user)):
+    """States the order went through, oldest first. A change shows up here within ORDER_LOG__FLUSH_MILLISECONDS."""
+    timeline = await OrderTransitionLogic.get_timeline(db, target_order_id, get_order_owner(current_user))
+    if timeline is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order does not exist")
+    return timeline
+
+
 # ------------------------
 # Mobile process endpoints
 # ------------------------
@@ -85,87 +162,162 @@ async def read_individual_order(target_order_id: int,
              dependencies=[Depends(is_operator_user)])
 async def create_order(order_data: schemas.order.OrderCreate,
                        db: Session = Depends(get_db),
-                       current_user: schemas.user.User = Depends(get_active_current_user)):
-    await validate_order(db, order_data.id_forklift, order_data.materials_order)
-    order_data.id_operator = current_user.id
-    try:
-        return await OrderLogic.create(db, data_in=order_data.model_dump())
-    except IntegrityError:
-        logger.debug("Order already exists")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong foreign keys")
+                       current_user: schemas.user.User = Depends(get_active_current_user),
+                       idempotent_request: IdempotentRequest | None = Depends(get_idempotent_request)):
+    """With an Idempotency-Key header, retrying with the same key returns the order created the first time."""
+    async def create():
+        if order_data.id_forklift is None and not settings.dispatch.enabled:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="id_forklift is required")
+        await validate_order(db, order_data.id_forklift, order_data.materials_order)
+        order_data.id_operator = current_user.id
+        try:
+            if order_data.id_forklift is not None:
+                created = await OrderLogic.create(db, data_in=order_data.model_dump())
+            else:
+                if dispatcher.needs_refresh:
+                    await dispatcher.refresh(db)
+                with dispatcher.reserve(current_user.id) as id_forklift:
+                    order_data.id_forklift = id_forklift
+                    created = await OrderLogic.create(db, data_in=order_data.model_dump())
+        except NoForkliftAvailable:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No forklift available")
+        except IntegrityError:
+            logger.debug("Order already exists")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong foreign keys")
+        log_order_transition(created.id, None, created.state, current_user.id)
+        return created
+
+    return await run_idempotent(idempotent_request, create, schemas.order.Order)
+
+
+def restrict_order_filter(order_filter: schemas.order.OrderFilter, current_user: User):
+    # Operators and forklifts only list their own orders
+    if enums.has_role(enums.UserRoles.OPERATOR, current_user.roles):
+        order_filter.id_operator = current_user.id
+    elif enums.has_role(enums.UserRoles.FORKLIFT, current_user.roles):
+        order_filter.id_forklift = current_user.id
 
 
-@router.post("/{target_order_id}/confirm", response_model=schemas.order.PublicOrder,
-             dependencies=[Depends(is_operator_user)])
-async def confirm_order(target_order_id: int, db: Session = Depends(get_db),
-                        current_user: schemas.user.User = Depends(get_active_current_user)):
-    order = await read_individual_order(target_order_id, db, current_user)
+def get_order_owner(current_user: User) -> dict:
+    # Same visibility as read_individual_order: operators and forklifts only act on their own orders
+    owner = {}
+    if enums.has_role(enums.UserRoles.OPERATOR, current_user.roles):
+        owner["id_operator"] = current_user.id
+    if enums.has_role(enums.UserRoles.FORKLIFT, current_user.roles):
+        owner["id_forklift"] = current_user.id
+    return owner
 
-    if order.state in [enums.OrderStates.CONFIRMED]:
-        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail="Already confirmed and delivered")
 
-    if order.state in [enums.OrderStates.CANCELED_BY_OPERATOR, enums.OrderStates.CANCELED_NO_MATERIAL]:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order is canceled can't confirm")
+def get_owner_topics(owner: dict) -> list:
+    # Event topics of the orders get_order_owner gives access to
+    return list(owner.items()) or [ALL_ORDERS]
 
-    try:
-        return await OrderLogic.update(db, target_order_id, {"state": enums.OrderStates.CONFIRMED})
-    except IntegrityError:
-        logger.debug("Order already exists")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong foreign keys")
 
+async def change_order_state(db: Session, target_order_id: int, state: enums.OrderStates, current_user: User,
+                             idempotent_request: IdempotentRequest | None, done_detail: str, refused_detail: str):
+    async def change():
+        order, current_state = await OrderLogic.change_state(db, target_order_id, state,
+                                                             get_order_owner(current_user))
+        if order:
+            log_order_transition(order.id, current_state, state, current_user.id)
+            return order
+        if current_state is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order does not exist")
+        if current_state in ORDER_TRANSITIONS[state].done:
+            raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail=done_detail)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=refused_detail)
+
+    # A retry with the same Idempotency-Key gets the order as this change left it
+    return await run_idempotent(idempotent_request, change, schemas.order.Order)
 
-@router.post("/{target_order_id}/cancel-by-operator", response_model=schemas.order.PublicOrder,
-             dependencies=[Depends(is_operator_user)])
-async def cancel_order_by_operator(target_order_id: int, db: Session = Depends(get_db),
-                                   current_user: schemas.user.User = Depends(get_active_current_user)):
-    order = await read_individual_order(target_order_id, db, current_user)
 
-    if order.state in [enums.OrderStates.CANCELED_BY_OPERATOR, enums.OrderStates.CANCELED_NO_MATERIAL]:
-        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail="Already canceled")
+@router.post("/{target_order_id}/confirm", response_model=schemas.order.PublicOrder,
+             dependencies=[Depends(is_operator_user)])
+async def confirm_order(target_order_id: int, db: Session = Depends(get_db),
+                        current_user: schemas.user.User = Depends(get_active_current_user),
+                        idempotent_request: IdempotentRequest | None = Depends(get_idempotent_request)):
+    return await change_order_state(db, target_order_id, enums.OrderStates.CONFIRMED, current_user,
+                                    idempotent_request,
+                                    done_detail="Already confirmed and delivered",
+                                    refused_detail="Order is canceled can't confirm")
 
-    if order.state == enums.OrderStates.DELIVERED:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order is delivered can't cancel")
 
-    try:
-        return await OrderLogic.update(db, target_order_id, {"state": enums.OrderStates.CANCELED_BY_OPERATOR})
-    except IntegrityError:
-        logger.debug("Order already exists")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong foreign keys")
+@router.post("/{target_order_id}/cancel-by-operator", response_model=schemas.order.PublicOrder,
+             dependencies=[Depends(is_operator_user)])
+async def cancel_order_by_operator(target_order_id: int, db: Session = Depends(get_db),
+                                   current_user: schemas.user.User = Depends(get_active_current_user),
+                                   idempotent_request: IdempotentRequest | None = Depends(get_idempotent_request)):
+    return await change_order_state(db, target_order_id, enums.OrderStates.CANCELED_BY_OPERATOR, current_user,
+                                    idempotent_request,
+                                    done_detail="Already canceled",
+                                    refused_detail="Order is delivered can't cancel")
 
 
 @router.post("/{target_order_id}/cancel-by-forklift", response_model=schemas.order.PublicOrder,
              dependencies=[Depends(is_forklift_user)])
 async def cancel_order_by_forklift(target_order_id: int, db: Session = Depends(get_db),
-                                   current_user: schemas.user.User = Depends(get_active_current_user)):
-    order = await read_individual_order(target_order_id, db, current_user)
-
-    if order.state in [enums.OrderStates.CANCELED_BY_OPERATOR, enums.OrderStates.CANCELED_NO_MATERIAL]:
-        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail="Already canceled")
-
-    if order.state == enums.OrderStates.DELIVERED:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order is delivered can't cancel")
-
-    try:
-        return await OrderLogic.update(db, target_order_id, {"state": enums.OrderStates.CANCELED_NO_MATERIAL})
-    except IntegrityError:
-        logger.debug("Order already exists")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong foreign keys")
+                                   current_user: schemas.user.User = Depends(get_active_current_user),
+                                   idempotent_request: IdempotentRequest | None = Depends(get_idempotent_request)):
+    return await change_order_state(db, target_order_id, enums.OrderStates.CANCELED_NO_MATERIAL, current_user,
+                                    idempotent_request,
+                                    done_detail="Already canceled",
+                                    refused_detail="Order is delivered can't cancel")
 
 
 @router.post("/{target_order_id}/deliver", response_model=schemas.order.PublicOrder,
              dependencies=[Depends(is_forklift_user)])
 async def notify_order_delivered(target_order_id: int, db: Session = Depends(get_db),
-                                 current_user: schemas.user.User = Depends(get_active_current_user)):
-    order = await read_individual_order(target_order_id, db, current_user)
+                                 current_user: schemas.user.User = Depends(get_active_current_user),
+                                 idempotent_request: IdempotentRequest | None = Depends(get_idempotent_request)):
+    return await change_order_state(db, target_order_id, enums.OrderStates.DELIVERED, current_user,
+                                    idempotent_request,
+                                    done_detail="Already confirmed and delivered",
+                                    refused_detail="Order is canceled can't notify")
 
-    if order.state in [enums.OrderStates.CONFIRMED, enums.OrderStates.DELIVERED]:
-        raise HTTPException(status_code=status.HTTP_204_NO_CONTENT, detail="Already confirmed and delivered")
 
-    if order.state in [enums.OrderStates.CANCELED_BY_OPERATOR, enums.OrderStates.CANCELED_NO_MATERIAL]:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Order is canceled can't notify")
+# ------------------------
+# Push endpoints
+# ------------------------
 
+
+async def close_on_disconnect(websocket: WebSocket, subscription: Subscription):
+    # Client messages are ignored, reading is only how the client leaving is noticed
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        subscription.close()
+
+
+@router.websocket("/events")
+async def push_order_events(websocket: WebSocket, connection: WebSocketUser = Depends(get_websocket_user)):
+    """
+    Sends a schemas.order.OrderEvent (JSON text) for every order created or changing state, with the same visibility
+    as GET /orders: operators and forklifts only get their own orders.
+
+    Closed with 1008 once the token expires and 1013 if the client can't keep up; either way the client reconnects
+    and re-reads GET /orders.
+    """
+    subscription = order_events.subscribe(get_owner_topics(get_order_owner(connection.user)))
+    receiver = None
     try:
-        return await OrderLogic.update(db, target_order_id, {"state": enums.OrderStates.DELIVERED})
-    except IntegrityError:
-        logger.debug("Order already exists")
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong foreign keys")
+        await websocket.accept()
+        receiver = asyncio.create_task(close_on_disconnect(websocket, subscription))
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(),
+                                                 timeout=max(connection.expires_at - time.time(), 0))
+            except TimeoutError:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                break
+            if message is None:
+                if subscription.overflowed:
+                    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many pending events")
+                break
+            await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if receiver:
+            receiver.cancel()
+        order_events.unsubscribe(subscription)
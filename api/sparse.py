@@ -0,0 +1,36 @@
+from functools import lru_cache
+from typing import NamedTuple
+
+from fastapi import HTTPException, Query, status
+from pydantic import BaseModel, ConfigDict, create_model
+
+
+class SparseFields(NamedTuple):
+    names: tuple[str, ...]
+    model: type[BaseModel]
+
+
+@lru_cache(maxsize=256)
+def get_sparse_model(schema: type[BaseModel], names: tuple[str, ...]) -> type[BaseModel]:
+    # Same field types as the public schema, restricted to the requested ones
+    fields = {name: (schema.model_fields[name].annotation, ...) for name in names}
+    return create_model(f"{schema.__name__}Fields", __config__=ConfigDict(from_attributes=True), **fields)
+
+
+def sparse_fields(schema: type[BaseModel]):
+    """
+    Dependency reading the `fields` query param: a comma separated subset of the fields of `schema`.
+
+    Returns None when the param is missing, so the full schema is used.
+    """
+    def dependency(fields: str | None = Query(default=None, description=f"Comma separated subset of: "
+                                                                        f"{', '.join(schema.model_fields)}")):
+        if not fields:
+            return None
+        names = tuple(dict.fromkeys(name.strip() for name in fields.split(',') if name.strip()))
+        unknown = [name for name in names if name not in schema.model_fields]
+        if unknown or not names:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields requested")
+        return SparseFields(names, get_sparse_model(schema, names))
+    return dependency
@@ -0,0 +1,87 @@
+"""
+Shared helpers for the benchmark scripts.
+
+They run against an in-memory SQLite database built from db.models, so they measure Python side costs (parsing,
+statement building, round trips counted as queries) without needing a Postgres server. Run them from the project
+root, e.g. `python -m benchmarks.parse_rows`.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.base import Base
+from db import models
+from logic.order import ORDER_VERSION_ID
+from utils.enums import UserRoles, OrderStates
+
+
+def build_session_local(url: str = 'sqlite://'):
+    # In memory by default, pass a file URL when commits (and their fsync) are part of what is measured
+    engine = create_engine(url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def count_queries(engine) -> list[int]:
+    counter = [0]
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count(*args):
+        counter[0] += 1
+
+    return counter
+
+
+def seed(db, operators: int = 100, forklifts: int = 10, materials: int = 20, orders: int = 1000,
+         lines_per_order: int = 3):
+    for role in UserRoles:
+        db.add(models.Role(id=role))
+    db.add(models.OrderVersion(id=ORDER_VERSION_ID, base=0))
+    db.flush()
+
+    def add_role_user(role, username, profile):
+        user = models.User(username=username, password='x', isActive=True)
+        db.add(user)
+        db.flush()
+        role_user = models.RoleByUser(id_role=role, id_user=user.id)
+        db.add(role_user)
+        db.flush()
+        profile.id = role_user.id
+        db.add(profile)
+        return user
+
+    operator_users = [add_role_user(UserRoles.OPERATOR, f'operator{i}',
+                                    models.Operator(machine=f'm{i}', area=f'area{i % 5}'))
+                      for i in range(operators)]
+    forklift_users = [add_role_user(UserRoles.FORKLIFT, f'forklift{i}', models.Forklift(name=f'f{i}'))
+                      for i in range(forklifts)]
+    material_rows = [models.Material(name=f'material{i}', unit='kg') for i in range(materials)]
+    db.add_all(material_rows)
+    db.flush()
+
+    now = datetime.now(timezone.utc)
+    for i in range(orders):
+        order = models.Order(id_operator=operator_users[i % operators].id,
+                             id_forklift=forklift_users[i % forklifts].id,
+                             creation_datetime=now - timedelta(minutes=i), estimate_datetime=now,
+                             state=OrderStates.PENDING, area=f'area{i % operators % 5}')
+        db.add(order)
+        db.flush()
+        db.add(models.OrderKey(id=order.id, creation_datetime=order.creation_datetime))
+        for j in range(lines_per_order):
+            db.add(models.MaterialByOrder(id_order=order.id, creation_datetime=order.creation_datetime,
+                                          id_material=material_rows[(i + j) % materials].id, quantity=j + 1))
+    db.commit()
+
+
+def measure(fn, repeat: int = 5) -> float:
+    """Best wall time of `repeat` runs, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
@@ -0,0 +1,97 @@
+"""
+Simulation of a plant dispatching thousands of orders per minute, with the ForkliftDispatcher against operators
+picking a forklift at random and against dispatching by load only (no area consolidation).
+
+Forklifts deliver their orders first in, first out: an order in the area of the previous one is a short hop, any
+other area is a trip. Only dispatcher calls are timed, the plant itself is simulated second by second.
+"""
+import random
+import statistics
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from logic.dispatch import ForkliftDispatcher
+from logic.order import ORDER_CREATED, ORDER_STATE_CHANGED
+from utils.enums import OrderStates
+
+ORDERS_PER_MINUTE = 3000
+MINUTES = 10
+FORKLIFTS = 200
+OPERATORS = 400
+AREAS = 20
+HOP_SECONDS = 2
+TRIP_SECONDS = 6
+
+
+def simulate(strategy: str, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    forklifts = list(range(1, FORKLIFTS + 1))
+    operator_areas = {operator: f'area{operator % AREAS}' for operator in range(1, OPERATORS + 1)}
+    dispatcher = ForkliftDispatcher(consolidate_below=0 if strategy == 'load only' else 5,
+                                    refresh_seconds=float('inf'))
+    dispatcher.reset(forklifts, operator_areas, [])
+
+    queues = {forklift: deque() for forklift in forklifts}
+    in_service = {}
+    last_area = {forklift: None for forklift in forklifts}
+    waits, trips, max_open, dispatch_time = [], 0, 0, 0.0
+    order_id = 0
+    per_second = ORDERS_PER_MINUTE / 60
+
+    for second in range(MINUTES * 60):
+        for _ in range(int(per_second) + (rng.random() < per_second % 1)):
+            order_id += 1
+            operator = rng.randint(1, OPERATORS)
+            started = time.perf_counter()
+            if strategy == 'random':
+                forklift = rng.choice(forklifts)
+            else:
+                with dispatcher.reserve(operator) as forklift:
+                    pass
+            order = SimpleNamespace(id=order_id, id_operator=operator, id_forklift=forklift,
+                                    state=OrderStates.PENDING)
+            dispatcher.on_order_event(ORDER_CREATED, order)
+            dispatch_time += time.perf_counter() - started
+            queues[forklift].append((order, second))
+
+        for forklift in forklifts:
+            current = in_service.get(forklift)
+            if current and current[1] <= second:
+                order, _, created = current
+                order.state = OrderStates.DELIVERED
+                dispatcher.on_order_event(ORDER_STATE_CHANGED, order)
+                waits.append(second - created)
+                del in_service[forklift]
+            if forklift not in in_service and queues[forklift]:
+                order, created = queues[forklift].popleft()
+                area = operator_areas[order.id_operator]
+                hop = area == last_area[forklift]
+                trips += not hop
+                last_area[forklift] = area
+                in_service[forklift] = (order, second + (HOP_SECONDS if hop else TRIP_SECONDS), created)
+            max_open = max(max_open, len(queues[forklift]))
+
+    waits.sort()
+    return {
+        "delivered": len(waits),
+        "open": sum(len(queue) for queue in queues.values()),
+        "p50 wait": waits[len(waits) // 2] if waits else 0,
+        "p95 wait": waits[int(len(waits) * 0.95)] if waits else 0,
+        "trips/order": trips / max(len(waits), 1),
+        "max queue": max_open,
+        "queue stdev": statistics.pstdev([len(queue) for queue in queues.values()]),
+        "decisions/sec": order_id / dispatch_time if dispatch_time else 0,
+    }
+
+
+def run():
+    print(f'{ORDERS_PER_MINUTE} orders/min for {MINUTES} min, {FORKLIFTS} forklifts, {AREAS} areas')
+    for strategy in ('random', 'load only', 'dispatcher'):
+        result = simulate(strategy)
+        print(f'{strategy:<11} ' + '  '.join(f'{name} {value:.2f}' if isinstance(value, float) else
+                                            f'{name} {value}' for name, value in result.items()))
+
+
+if __name__ == '__main__':
+    run()
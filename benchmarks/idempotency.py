@@ -0,0 +1,167 @@
+"""
+Retried and duplicated order requests carrying an Idempotency-Key, as mobile clients send them on a flaky network:
+each key must create (or change) its order once, retries must be answered without a statement on the order tables,
+and duplicates sent at the same time must share one execution. The script exits with an error otherwise.
+
+Requests go through the ASGI interface in-process with the async session (aiosqlite), so a running request yields
+to its duplicates the way it does against the server. `python -m benchmarks.idempotency [memory|database]` picks the
+store of the responses.
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from fastapi import FastAPI
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from api.routes import orders
+from db import models
+from db.dependencies import get_db, get_read_db
+from db.session import LazySession
+from logic.idempotency import DatabaseIdempotencyStore, MemoryIdempotencyStore, idempotency
+from utils.enums import IdempotencyStores, OrderStates, UserRoles
+from utils.jwt_helper import encode_access_token
+
+from .common import build_session_local, seed
+
+KEYS = 200
+RETRIES = 5
+DUPLICATES = 20
+# Statements on these tables are the ones a replay must not run, auth still reads users
+ORDER_TABLES = re.compile(r'\b(orders|material_by_order|order_versions|order_events|material_usage)\b')
+
+
+async def request(app: FastAPI, method: str, path: str, user_id: int, key: str | None = None,
+                  body: dict | None = None) -> tuple[int, dict, dict]:
+    """Status, headers and JSON body of the response."""
+    token, _ = encode_access_token(str(user_id))
+    content = json.dumps(body).encode() if body is not None else b''
+    headers = [(b'authorization', f'Bearer {token}'.encode()), (b'content-type', b'application/json'),
+               (b'content-length', str(len(content)).encode())]
+    if key is not None:
+        headers.append((b'idempotency-key', key.encode()))
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": b"", "headers": headers,
+             "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80)}
+    messages = [{"type": "http.request", "body": content, "more_body": False}]
+    response = {"body": b""}
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {name.decode().lower(): value.decode() for name, value in message["headers"]}
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["headers"], json.loads(response["body"] or b"null")
+
+
+async def run(store: IdempotencyStores = IdempotencyStores.MEMORY) -> bool:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'orders.db')
+        _, seed_session_local = build_session_local(f'sqlite:///{path}')
+        with seed_session_local() as db:
+            seed(db, operators=10, forklifts=10, orders=0)
+            operator_id = db.scalar(select(models.RoleByUser.id_user)
+                                    .where(models.RoleByUser.id_role == UserRoles.OPERATOR))
+            forklift_id = db.scalar(select(models.RoleByUser.id_user)
+                                    .where(models.RoleByUser.id_role == UserRoles.FORKLIFT))
+            material_id = db.scalar(select(models.Material.id))
+
+        # A connection per request, thousands are in flight at once
+        engine = create_async_engine(f'sqlite+aiosqlite:///{path}', poolclass=NullPool)
+        session_local = sessionmaker(engine, class_=AsyncSession, autocommit=False, autoflush=False,
+                                     expire_on_commit=False)
+        order_statements = [0]
+
+        @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+        def _count(connection, cursor, statement, *args):
+            if ORDER_TABLES.search(statement):
+                order_statements[0] += 1
+
+        if store == IdempotencyStores.DATABASE:
+            idempotency.store = DatabaseIdempotencyStore(session_local, ttl=3600, claim_timeout=30)
+        else:
+            idempotency.store = MemoryIdempotencyStore(max_size=10 * KEYS, ttl=3600)
+
+        app = FastAPI()
+        app.include_router(orders.router)
+        app.dependency_overrides[get_db] = lambda: LazySession(session_local)
+        app.dependency_overrides[get_read_db] = lambda: LazySession(session_local)
+
+        now = datetime.now(timezone.utc).isoformat()
+
+        async def create(key: str, i: int):
+            # A retry sends the same body
+            return await request(app, 'POST', '/orders', operator_id, key,
+                                 {"id_forklift": forklift_id, "estimate_datetime": now, "creation_datetime": now,
+                                  "materials_order": [{"id_material": material_id, "quantity": i + 1}]})
+
+        ok = True
+        # Retries: each key sent once and then again RETRIES times
+        started = time.perf_counter()
+        first = [await create(f'create-{i}', i) for i in range(KEYS)]
+        executed = time.perf_counter() - started
+        order_statements[0] = 0
+        started = time.perf_counter()
+        retried = [await create(f'create-{i}', i) for i in range(KEYS) for _ in range(RETRIES)]
+        replayed = time.perf_counter() - started
+        same = all(response[2] == first[i // RETRIES][2] and response[1].get('idempotent-replayed') == 'true'
+                   for i, response in enumerate(retried))
+        ok &= same and order_statements[0] == 0
+        print(f'create        {executed / KEYS * 1000:>6.2f}ms per request, replay '
+              f'{replayed / (KEYS * RETRIES) * 1000:>6.2f}ms, {order_statements[0]} order statements for '
+              f'{KEYS * RETRIES} replays, {"same order" if same else "DIFFERENT ORDER"}')
+
+        # Duplicates of a key sent together, before any of them got a response. One key at a time: SQLite takes a
+        # single writer, the point is duplicates, not concurrent orders
+        executions, coalesced = idempotency.executions, idempotency.coalesced
+        responses = []
+        for i in range(KEYS):
+            responses += await asyncio.gather(*(create(f'burst-{i}', i) for _ in range(DUPLICATES)))
+        ids = {response[2]["id"] for response in responses if response[0] == 200}
+        ok &= len(ids) == KEYS and idempotency.executions - executions == KEYS
+        print(f'burst         {KEYS * DUPLICATES} requests for {KEYS} keys: {idempotency.executions - executions} '
+              f'executions, {len(ids)} orders, {idempotency.coalesced - coalesced} coalesced')
+
+        # Deliveries retried together for the orders created above
+        executions, coalesced = idempotency.executions, idempotency.coalesced
+        delivered = [response[2]["id"] for response in first]
+        responses = []
+        for order_id in delivered:
+            responses += await asyncio.gather(*(request(app, 'POST', f'/orders/{order_id}/deliver', forklift_id,
+                                                        f'deliver-{order_id}') for _ in range(DUPLICATES)))
+        states = {(response[0], response[2]["state"]) for response in responses}
+        ok &= idempotency.executions - executions == KEYS and states == {(200, OrderStates.DELIVERED.value)}
+        print(f'deliver       {KEYS * DUPLICATES} requests for {KEYS} orders: '
+              f'{idempotency.executions - executions} executions, {idempotency.coalesced - coalesced} coalesced, '
+              f'responses {sorted(states)}')
+
+        # The same key with another body is refused
+        status_code, _, _ = await create('create-0', 1)
+        ok &= status_code == 422
+        print(f'reused key    status {status_code}')
+
+        async with session_local() as db:
+            total = await db.scalar(select(func.count()).select_from(models.Order))
+        ok &= total == 2 * KEYS
+        print(f'{total} orders in the database for {2 * KEYS} keys')
+        await engine.dispose()
+    return ok
+
+
+if __name__ == '__main__':
+    if not asyncio.run(run(IdempotencyStores(sys.argv[1]) if len(sys.argv) > 1 else IdempotencyStores.MEMORY)):
+        sys.exit('Idempotency keys did not hold')
@@ -0,0 +1,90 @@
+"""
+Query plans of the hot list queries and role checks, checking that each one uses its index from db.models.
+
+SQLite's EXPLAIN QUERY PLAN stands in for Postgres' EXPLAIN here: it shows whether a statement can be answered by
+the index at all, not what the Postgres planner picks for the production data. Exits with an error when an expected
+index is not used.
+"""
+import sys
+
+from sqlalchemy import event, select, text, update
+
+from db import models
+from logic import OperatorLogic
+from logic.analytics import MaterialUsageLogic
+from logic.order import OrderLogic
+from logic.order_log import OrderTransitionLogic
+from schemas.order import OrderFilter
+from utils.enums import OrderStates, UserRoles
+
+from .common import build_session_local, seed
+
+
+def capture_statements(engine) -> list:
+    statements = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    return statements
+
+
+def get_plans(db, statements: list) -> list[str]:
+    plans = []
+    for statement, parameters in statements:
+        rows = db.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        plans.append('\n'.join(f'    {row[-1]}' for row in rows))
+    return plans
+
+
+def run() -> bool:
+    engine, session_local = build_session_local()
+    with session_local() as db:
+        seed(db)
+        forklift_id, operator_id = [db.scalar(select(models.RoleByUser.id_user)
+                                              .where(models.RoleByUser.id_role == role))
+                                    for role in (UserRoles.FORKLIFT, UserRoles.OPERATOR)]
+        # Most orders are done in a running plant, only a few are pending
+        db.execute(update(models.Order).where(models.Order.id % 10 != 0).values(state=OrderStates.DELIVERED))
+        db.commit()
+        db.execute(text('ANALYZE'))
+
+    cases = (
+        ('forklift orders', 'ix_orders_id_forklift_creation_datetime',
+         lambda db: OrderLogic._filter_page_by_query(db, OrderFilter(id_forklift=forklift_id), limit=20)),
+        ('operator orders', 'ix_orders_id_operator_creation_datetime',
+         lambda db: OrderLogic._filter_page_by_query(db, OrderFilter(id_operator=operator_id), limit=20)),
+        ('pending forklift orders', 'ix_orders_pending_id_forklift',
+         lambda db: OrderLogic._filter_page_by_query(db, OrderFilter(id_forklift=forklift_id,
+                                                                     state=OrderStates.PENDING), limit=20)),
+        # By the key of their order. The lines of a page are loaded with a (id_order, creation_datetime) IN list, which
+        # SQLite can't answer from an index: tests/test_index_usage.py checks that one on Postgres
+        ('order lines', 'ix_material_by_order_id_order',
+         lambda db: MaterialUsageLogic._add_order_usage(db, 1, db.scalar(select(models.Order.creation_datetime)
+                                                                           .where(models.Order.id == 1)))),
+        ('role check', 'ix_role_by_user_id_user_id_role',
+         lambda db: OperatorLogic._get_by_user_id(db, operator_id)),
+        ('order timeline', 'ix_order_events_id_order_ts',
+         lambda db: OrderTransitionLogic._get_timeline(db, 1, {})),
+    )
+
+    statements = capture_statements(engine)
+    used = True
+    for name, index, fn in cases:
+        with session_local() as db:
+            statements.clear()
+            fn(db)
+            executed = list(statements)
+            plans = get_plans(db, executed)
+        found = any(index in plan for plan in plans)
+        used = used and found
+        print(f'{name:<24} {index:<42} {"used" if found else "NOT USED"}')
+        if not found:
+            print('\n'.join(plans))
+    return used
+
+
+if __name__ == '__main__':
+    if not run():
+        sys.exit('Some indexes are not used')
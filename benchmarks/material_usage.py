@@ -0,0 +1,81 @@
+"""
+Material usage by day and material from the MaterialUsage rollup, against aggregating the order history itself.
+
+Then creates and moves orders through OrderLogic and checks that the rollup still equals the usage recomputed from
+the orders; the script exits with an error when it does not.
+"""
+import sys
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, true
+
+from db import models
+from logic.analytics import MaterialUsageLogic, MAXIMUM_USAGE_ROWS, select_usage
+from logic.order import OrderLogic
+from schemas.analytics import MaterialUsageFilter
+from utils.enums import OrderStates, UsageDimensions, UserRoles
+
+from .common import build_session_local, seed, measure
+
+ORDERS = 20000
+CHANGES = 200
+GROUP_BY = [UsageDimensions.DAY, UsageDimensions.MATERIAL]
+
+
+def rollup_rows(db) -> set:
+    return {(str(row.day), row.id_material, row.area, row.id_forklift, row.state, row.quantity, row.lines)
+            for row in db.scalars(select(models.MaterialUsage).where(models.MaterialUsage.lines != 0))}
+
+
+def recomputed_rows(db) -> set:
+    return {tuple(str(value) if i == 0 else value for i, value in enumerate(row))
+            for row in db.execute(select_usage(true())).all()}
+
+
+def run() -> bool:
+    engine, session_local = build_session_local()
+    with session_local() as db:
+        seed(db, orders=ORDERS)
+        MaterialUsageLogic._rebuild(db)
+        usage_rows = db.query(models.MaterialUsage).count()
+
+    def from_rollup():
+        with session_local() as db:
+            MaterialUsageLogic._get_usage(db, MaterialUsageFilter(), GROUP_BY, limit=MAXIMUM_USAGE_ROWS)
+
+    def from_orders():
+        with session_local() as db:
+            day = func.date(models.Order.creation_datetime)
+            line = models.MaterialByOrder
+            db.execute(select(day, line.id_material, func.sum(line.quantity), func.count())
+                       .join(line, line.id_order == models.Order.id)
+                       .group_by(day, line.id_material).order_by(day, line.id_material)).all()
+
+    print(f'{ORDERS} orders, {usage_rows} rollup rows')
+    for label, fn in (('orders history', from_orders), ('rollup', from_rollup)):
+        print(f'{label:<15} {measure(fn) * 1000:>8.1f}ms per day/material report')
+
+    with session_local() as db:
+        operator_id, forklift_id = [db.scalar(select(models.RoleByUser.id_user)
+                                              .where(models.RoleByUser.id_role == role))
+                                    for role in (UserRoles.OPERATOR, UserRoles.FORKLIFT)]
+        material_ids = db.scalars(select(models.Material.id)).all()
+        order_ids = db.scalars(select(models.Order.id).limit(CHANGES)).all()
+        now = datetime.now(timezone.utc)
+        for i in range(CHANGES):
+            OrderLogic._create(db, {"id_operator": operator_id, "id_forklift": forklift_id, "creation_datetime": now,
+                                    "estimate_datetime": now, "order_datetime": None, "state": OrderStates.PENDING,
+                                    "materials_order": [{"id_material": material_ids[(i + j) % len(material_ids)],
+                                                         "quantity": j + 1} for j in range(3)]})
+        targets = (OrderStates.DELIVERED, OrderStates.CONFIRMED, OrderStates.CANCELED_BY_OPERATOR)
+        for i, order_id in enumerate(order_ids):
+            OrderLogic._change_state(db, order_id, targets[i % len(targets)], {})
+        consistent = rollup_rows(db) == recomputed_rows(db)
+    print(f'{CHANGES} orders created and {CHANGES} moved: rollup {"matches" if consistent else "DIFFERS FROM"} '
+          f'the orders')
+    return consistent
+
+
+if __name__ == '__main__':
+    if not run():
+        sys.exit('Rollup out of date')
@@ -0,0 +1,70 @@
+"""
+Orders/sec of OrderCRUD.create with 1, 10 and 50 material lines, against the former one commit per line create.
+
+Runs on a SQLite file so every commit pays its fsync, as it would on the server.
+"""
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+from logic.order import OrderLogic
+from db import models
+from utils.enums import OrderStates, UserRoles
+
+from .common import build_session_local, count_queries, seed, measure
+
+LINE_COUNTS = (1, 10, 50)
+ORDERS = 50
+
+
+def legacy_create(db, data_in: dict):
+    # Previous implementation: the order, then one add + commit per line, then a re-read
+    materials_order = data_in.pop("materials_order")
+    order_id = OrderLogic._insert_returning(db, data_in).id
+    db.commit()
+    for material_order in materials_order:
+        db.add(models.MaterialByOrder(id_order=order_id, creation_datetime=data_in["creation_datetime"],
+                                      id_material=material_order.get("id_material"),
+                                      quantity=material_order.get("quantity")))
+        db.commit()
+    return OrderLogic._get_by_id(db, order_id)
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        engine, session_local = build_session_local(f"sqlite:///{os.path.join(directory, 'orders.db')}")
+        with session_local() as db:
+            seed(db, orders=0, materials=max(LINE_COUNTS))
+            operator_id, forklift_id = [db.scalar(select(func.min(models.RoleByUser.id_user))
+                                                  .where(models.RoleByUser.id_role == role))
+                                        for role in (UserRoles.OPERATOR, UserRoles.FORKLIFT)]
+            material_ids = db.scalars(select(models.Material.id)).all()
+        queries = count_queries(engine)
+
+        def order_data(lines: int) -> dict:
+            now = datetime.now(timezone.utc)
+            return {"id_operator": operator_id, "id_forklift": forklift_id, "creation_datetime": now,
+                    "estimate_datetime": now, "order_datetime": None, "state": OrderStates.PENDING,
+                    "materials_order": [{"id_material": material_ids[i], "quantity": i + 1, "material": None}
+                                        for i in range(lines)]}
+
+        for lines in LINE_COUNTS:
+            for label, create in (('before', legacy_create), ('after', OrderLogic._create)):
+                def create_orders():
+                    with session_local() as db:
+                        for _ in range(ORDERS):
+                            create(db, order_data(lines))
+
+                queries[0] = 0
+                with session_local() as db:
+                    create(db, order_data(lines))
+                order_queries = queries[0]
+                elapsed = measure(create_orders, repeat=3)
+                print(f'{lines:>3} lines {label:<7} {ORDERS / elapsed:>8.0f} orders/sec '
+                      f'({order_queries} statements/order)')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,136 @@
+"""
+Load test of the /orders/events WebSocket: thousands of idle connections held by one worker, then orders created
+through OrderLogic.create and the time until every subscriber of each one got its event.
+
+Connections are driven in-process through the ASGI interface, no network involved, so the numbers are the cost of
+the endpoint and the event bus themselves. `python -m benchmarks.order_events [connections]`
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from fastapi import FastAPI
+from sqlalchemy import select
+
+from api.routes import orders
+from db import models
+from db.dependencies import get_db
+from db.session import LazySession
+from logic.order import OrderLogic, order_events
+from utils.enums import OrderStates, UserRoles
+from utils.jwt_helper import encode_access_token
+
+from .common import build_session_local, seed
+
+CONNECTIONS = 2000
+ORDERS = 50
+
+
+class Client:
+    """One WebSocket connection, as the ASGI server would drive it."""
+
+    def __init__(self, app: FastAPI, user_id: int, received: list):
+        self.user_id = user_id
+        self.accepted = asyncio.Event()
+        self.closed = None
+        self._received = received
+        self._incoming = asyncio.Queue()
+        self._incoming.put_nowait({"type": "websocket.connect"})
+        token, _ = encode_access_token(str(user_id))
+        scope = {"type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "path": "/orders/events",
+                 "raw_path": b"/orders/events", "query_string": urlencode({"token": token}).encode(),
+                 "headers": [], "subprotocols": [], "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80)}
+        self.task = asyncio.create_task(app(scope, self._incoming.get, self._send))
+
+    async def _send(self, message: dict):
+        if message["type"] == "websocket.accept":
+            self.accepted.set()
+        elif message["type"] == "websocket.send":
+            self._received[0] += 1
+        elif message["type"] == "websocket.close":
+            self.closed = message.get("code")
+            self.accepted.set()
+
+    async def disconnect(self):
+        self._incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+
+async def wait_for_count(received: list, expected: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while received[0] < expected:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'{received[0]} of {expected} events received')
+        await asyncio.sleep(0)
+
+
+async def run(connections: int = CONNECTIONS):
+    engine, session_local = build_session_local()
+    with session_local() as db:
+        seed(db, orders=0)
+        role_users = {role: db.scalars(select(models.RoleByUser.id_user).where(models.RoleByUser.id_role == role)
+                                       .order_by(models.RoleByUser.id_user)).all()
+                      for role in (UserRoles.OPERATOR, UserRoles.FORKLIFT)}
+        material_id = db.scalar(select(models.Material.id))
+
+    app = FastAPI()
+    app.include_router(orders.router)
+    app.dependency_overrides[get_db] = lambda: LazySession(session_local)
+
+    # Half operators, half forklifts, several connections per user as with many devices
+    users = role_users[UserRoles.OPERATOR] + role_users[UserRoles.FORKLIFT]
+    received = [0]
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    clients = [Client(app, users[i % len(users)], received) for i in range(connections)]
+    await asyncio.gather(*(client.accepted.wait() for client in clients))
+    connect_time = time.perf_counter() - started
+    # Let every connection settle into its idle wait
+    await asyncio.sleep(0.1)
+    idle, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    refused = sum(client.closed is not None for client in clients)
+    print(f'{connections} connections in {connect_time:.2f}s, {refused} refused, '
+          f'{(idle - before) / connections / 1024:.1f} KiB per idle connection, '
+          f'{order_events.subscriptions} subscriptions')
+
+    listeners: dict[int, int] = {}
+    for client in clients:
+        listeners[client.user_id] = listeners.get(client.user_id, 0) + 1
+
+    latencies = []
+    db = LazySession(session_local)
+    for i in range(ORDERS):
+        operator_id = role_users[UserRoles.OPERATOR][i % len(role_users[UserRoles.OPERATOR])]
+        forklift_id = role_users[UserRoles.FORKLIFT][i % len(role_users[UserRoles.FORKLIFT])]
+        expected = received[0] + listeners.get(operator_id, 0) + listeners.get(forklift_id, 0)
+        now = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        await OrderLogic.create(db, {"id_operator": operator_id, "id_forklift": forklift_id,
+                                     "creation_datetime": now, "estimate_datetime": now, "order_datetime": None,
+                                     "state": OrderStates.PENDING,
+                                     "materials_order": [{"id_material": material_id, "quantity": 1}]})
+        await wait_for_count(received, expected)
+        latencies.append(time.perf_counter() - started)
+    await db.aclose()
+
+    latencies.sort()
+    print(f'{ORDERS} orders created, create to last delivery: '
+          f'median {latencies[len(latencies) // 2] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms, '
+          f'{order_events.delivered} events delivered, {order_events.dropped} dropped')
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client.disconnect() for client in clients))
+    print(f'{connections} disconnected in {time.perf_counter() - started:.2f}s, '
+          f'{order_events.subscriptions} subscriptions left')
+    return order_events.subscriptions == 0 and refused == 0
+
+
+if __name__ == '__main__':
+    if not asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else CONNECTIONS)):
+        sys.exit('Connections refused or subscriptions left behind')
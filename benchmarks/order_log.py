@@ -0,0 +1,121 @@
+"""
+State changes logged through the batched order_log_writer, against inserting and committing each log row as part of
+the change. Then the latency report over a synthetic log, checked against the durations it was built with; the
+script exits with an error when they differ.
+
+Runs on a SQLite file so every commit pays its fsync, as it would on the server.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, select
+
+from db import models
+from logic.order import OrderLogic
+from logic.order_log import OrderTransitionLogic, log_order_transition, order_log_writer
+from utils.enums import OrderStates
+
+from .common import build_session_local, count_queries, seed, measure
+
+ORDERS = 5000
+CHANGES = 500
+# Delivery and confirmation seconds of the synthetic log, by order id modulo their length
+DELIVERY_SECONDS = (60, 120, 300, 900)
+CONFIRMATION_SECONDS = (30, 90)
+
+
+def change_states(session_local, order_ids, log) -> float:
+    """Microseconds per change spent logging it, the state change itself is not counted."""
+    logging = 0.0
+    with session_local() as db:
+        for order_id in order_ids:
+            order, previous = OrderLogic._change_state(db, order_id, OrderStates.DELIVERED, {})
+            started = time.perf_counter()
+            log(db, order.id, previous)
+            logging += time.perf_counter() - started
+    return logging / len(order_ids) * 1e6
+
+
+def log_inline(db, order_id, previous):
+    # The log row in its own statement and commit, right after the change
+    db.execute(insert(models.OrderTransition).values(id_order=order_id, from_state=previous.value,
+                                                     to_state=OrderStates.DELIVERED.value, id_actor=None,
+                                                     ts=datetime.now(timezone.utc)))
+    db.commit()
+
+
+def log_batched(db, order_id, previous):
+    log_order_transition(order_id, previous, OrderStates.DELIVERED, None)
+
+
+async def drain(session_local) -> float:
+    order_log_writer.start(session_local)
+    started = time.perf_counter()
+    await order_log_writer.stop()
+    return time.perf_counter() - started
+
+
+def run() -> bool:
+    with tempfile.TemporaryDirectory() as directory:
+        engine, session_local = build_session_local(f"sqlite:///{os.path.join(directory, 'orders.db')}")
+        with session_local() as db:
+            seed(db, orders=ORDERS)
+            order_ids = db.scalars(select(models.Order.id).order_by(models.Order.id)).all()
+        queries = count_queries(engine)
+
+        inline = change_states(session_local, order_ids[:CHANGES], log_inline)
+        batched = change_states(session_local, order_ids[CHANGES:2 * CHANGES], log_batched)
+        queries[0] = 0
+        elapsed = asyncio.run(drain(session_local))
+        print(f'inline log   {inline:>8.1f}us per change')
+        print(f'batched log  {batched:>8.1f}us per change, {order_log_writer.written} rows written later in '
+              f'{elapsed * 1000:.1f}ms and {queries[0]} statements')
+
+        with session_local() as db:
+            db.query(models.OrderTransition).delete()
+            created = {order.id: order.creation_datetime for order in db.query(models.Order)}
+            rows = []
+            for order_id, created_at in created.items():
+                delivered_at = created_at + timedelta(seconds=DELIVERY_SECONDS[order_id % len(DELIVERY_SECONDS)])
+                confirmed_at = delivered_at + \
+                    timedelta(seconds=CONFIRMATION_SECONDS[order_id % len(CONFIRMATION_SECONDS)])
+                rows += [{"id_order": order_id, "from_state": None, "to_state": OrderStates.PENDING.value,
+                          "id_actor": None, "ts": created_at},
+                         {"id_order": order_id, "from_state": OrderStates.PENDING.value,
+                          "to_state": OrderStates.DELIVERED.value, "id_actor": None, "ts": delivered_at},
+                         {"id_order": order_id, "from_state": OrderStates.DELIVERED.value,
+                          "to_state": OrderStates.CONFIRMED.value, "id_actor": None, "ts": confirmed_at}]
+            db.execute(insert(models.OrderTransition), rows)
+            db.commit()
+            since, until = min(created.values()), max(created.values()) + timedelta(seconds=1)
+
+        def latency():
+            with session_local() as db:
+                return OrderTransitionLogic._get_latency(db, since, until)
+
+        print(f'latency report over {ORDERS} orders {measure(latency) * 1000:.1f}ms')
+        report = latency()
+        expected = {
+            "delivery": [DELIVERY_SECONDS[i % len(DELIVERY_SECONDS)] for i in created],
+            "confirmation": [CONFIRMATION_SECONDS[i % len(CONFIRMATION_SECONDS)] for i in created],
+        }
+        expected["total"] = [d + c for d, c in zip(expected["delivery"], expected["confirmation"])]
+        consistent = True
+        for stage, seconds in expected.items():
+            stats = getattr(report, stage)
+            matches = stats.orders == len(seconds) \
+                and abs(stats.average_seconds - sum(seconds) / len(seconds)) < 0.01 \
+                and abs(stats.maximum_seconds - max(seconds)) < 0.01
+            consistent &= matches
+            print(f'  {stage:<13} {stats.orders} orders, average {stats.average_seconds:.1f}s, '
+                  f'max {stats.maximum_seconds:.1f}s {"ok" if matches else "WRONG"}')
+    return consistent
+
+
+if __name__ == '__main__':
+    if not run():
+        sys.exit('Latency report differs from the log')
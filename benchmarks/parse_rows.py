@@ -0,0 +1,55 @@
+"""
+Rows/sec of CRUD.parse for 100-row pages of orders and operators, against the former dir() based parse.
+"""
+from typing import Any
+
+from logic import OperatorLogic
+from logic.order import OrderLogic, to_utc
+from db import models
+
+from .common import build_session_local, count_queries, seed, measure
+
+PAGE_SIZE = 100
+
+
+def legacy_parse(crud, row: Any):
+    # Previous implementation: every public attribute, relationships included
+    if isinstance(row, models.Order):
+        row.estimate_datetime = to_utc(row.estimate_datetime)
+        row.creation_datetime = to_utc(row.creation_datetime)
+    data = {column: getattr(row, column, None) for column in dir(row)
+            if not column.startswith('_') and column != 'metadata'}
+    return crud.model(**data)
+
+
+def run():
+    engine, session_local = build_session_local()
+    with session_local() as db:
+        seed(db)
+    queries = count_queries(engine)
+
+    for crud in (OrderLogic, OperatorLogic):
+        for label, parse in (('before', lambda row, crud=crud: legacy_parse(crud, row)), ('after', crud.parse)):
+            # Cold: fresh session, includes the lazy loads each parse triggers
+            def parse_page():
+                with session_local() as db:
+                    rows = db.query(crud.db_model).limit(PAGE_SIZE).all()
+                    [parse(row) for row in rows]
+
+            queries[0] = 0
+            parse_page()
+            page_queries = queries[0]
+            cold = measure(parse_page)
+
+            # Warm: rows and relationships already loaded, only the mapping itself is measured
+            with session_local() as db:
+                rows = db.query(crud.db_model).limit(PAGE_SIZE).all()
+                [legacy_parse(crud, row) for row in rows]
+                warm = measure(lambda: [parse(row) for row in rows], repeat=20)
+
+            print(f'{crud.db_model.__name__:<10} {label:<7} cold {PAGE_SIZE / cold:>8.0f} rows/sec '
+                  f'({page_queries} queries/page)   warm {PAGE_SIZE / warm:>8.0f} rows/sec')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,42 @@
+"""
+Queries issued to fetch and parse one list page, by page size. With the loader plans of each CRUD the count must not
+depend on the page size; the script exits with an error when it does.
+"""
+import sys
+
+from logic import OperatorLogic, ForkliftLogic, UserLogic
+from logic.order import OrderLogic
+from schemas.order import OrderFilter
+from schemas.operator import OperatorFilter
+from schemas.forklift import ForkliftFilter
+from schemas.user import UserFilter
+
+from .common import build_session_local, count_queries, seed
+
+PAGE_SIZES = (10, 50, 100)
+
+
+def run() -> bool:
+    engine, session_local = build_session_local()
+    with session_local() as db:
+        seed(db)
+    queries = count_queries(engine)
+
+    constant = True
+    for crud, filter_model in ((OrderLogic, OrderFilter), (OperatorLogic, OperatorFilter),
+                               (ForkliftLogic, ForkliftFilter), (UserLogic, UserFilter)):
+        counts = []
+        for size in PAGE_SIZES:
+            with session_local() as db:
+                queries[0] = 0
+                data, _ = crud._filter_page_by_query(db, filter_model(), limit=size)
+                counts.append(queries[0])
+        constant = constant and len(set(counts)) == 1
+        print(f'{crud.db_model.__name__:<10} ' + '   '.join(f'{size:>3} rows: {count:>3} queries'
+                                                          for size, count in zip(PAGE_SIZES, counts)))
+    return constant
+
+
+if __name__ == '__main__':
+    if not run():
+        sys.exit('Query count grows with the page size')
@@ -1,19 +1,70 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from utils.config import get_settings
+from .pool import get_pool_options, register_pool_statistics, timed_pool_class
 
 
 settings = get_settings()
 
 
-SQLALCHEMY_DATABASE_URL: str = f"postgresql://{settings.db.user}:{settings.db.password}" \
-                          f"@{settings.db.host}:{settings.db.port}/{settings.db.name}"
+def build_database_url(driver: str, host: str, port) -> str:
+    return f"{driver}://{settings.db.user}:{settings.db.password}@{host}:{port}/{settings.db.name}"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-)
+
+def build_engine(url: str, name: str):
+    statistics = register_pool_statistics(name)
+    db_engine = create_engine(
+        url,
+        poolclass=timed_pool_class(QueuePool, statistics),
+        **get_pool_options(settings.db),
+    )
+    statistics.listen(db_engine)
+    return db_engine
+
+
+def build_async_engine(url: str, name: str):
+    statistics = register_pool_statistics(name)
+    db_engine = create_async_engine(
+        url,
+        poolclass=timed_pool_class(AsyncAdaptedQueuePool, statistics),
+        **get_pool_options(settings.db),
+    )
+    statistics.listen(db_engine.sync_engine)
+    return db_engine
+
+
+SQLALCHEMY_DATABASE_URL: str = build_database_url("postgresql", settings.db.host, settings.db.port)
+
+# psycopg3 is used for the async path as, like psycopg2, it accepts aware datetimes on naive columns
+SQLALCHEMY_ASYNC_DATABASE_URL: str = build_database_url("postgresql+psycopg", settings.db.host, settings.db.port)
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL, 'primary')
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if settings.db.use_async:
+    async_engine = build_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, 'primary_async')
+    AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine)
+else:
+    async_engine = None
+    AsyncSessionLocal = None
+
+# Read replica, GET endpoints are routed here when configured
+if settings.db.replica_host:
+    replica_port = settings.db.replica_port or settings.db.port
+    if settings.db.use_async:
+        replica_engine = build_async_engine(
+            build_database_url("postgresql+psycopg", settings.db.replica_host, replica_port), 'replica_async')
+        ReplicaSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+    else:
+        replica_engine = build_engine(
+            build_database_url("postgresql", settings.db.replica_host, replica_port), 'replica')
+        ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+else:
+    replica_engine = None
+    ReplicaSessionLocal = None
+
 Base = declarative_base()
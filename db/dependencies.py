@@ -1,16 +1,47 @@
 import logging
 
-from db.base import SessionLocal
+from fastapi.requests import HTTPConnection
+
+from db.base import SessionLocal, AsyncSessionLocal, ReplicaSessionLocal
+from db.routing import WRITER_KEY, READ_LAG, get_writer_key, should_read_primary
+from db.session import LazySession
+from utils.config import get_settings
 
 logger = logging.getLogger(__name__)
 
+settings = get_settings()
+
+PrimarySessionLocal = AsyncSessionLocal if settings.db.use_async else SessionLocal
+
+
+def open_session():
+    return PrimarySessionLocal()
+
 
 # Dependency
-def get_db():
-    db = SessionLocal()
+async def get_db(request: HTTPConnection):
+    # Nothing is opened until the first query, see LazySession
+    db = LazySession(PrimarySessionLocal, info={WRITER_KEY: get_writer_key(request)})
+    try:
+        yield db
+    finally:
+        if db.is_opened:
+            logger.debug('Database Session closed.')
+        await db.aclose()
+
+
+async def get_replica_db(request: HTTPConnection):
+    if should_read_primary(request):
+        db = LazySession(PrimarySessionLocal)
+    else:
+        db = LazySession(ReplicaSessionLocal, info={READ_LAG: settings.db.replica_sticky_seconds})
     try:
-        logger.debug('Database Session opened.')
         yield db
     finally:
-        logger.debug('Database Session closed.')
-        db.close()
+        if db.is_opened:
+            logger.debug('Read Database Session closed.')
+        await db.aclose()
+
+
+# Dependency for read only endpoints, same as get_db when no replica is configured
+get_read_db = get_replica_db if settings.db.replica_host else get_db
@@ -1,9 +1,15 @@
+import asyncio
 import logging
 
 from schemas.user import FirstSuperUserCreate
 from logic import UserLogic, RoleLogic, AdminLogic
+from logic.order import OrderLogic
+from logic.dispatch import dispatcher
+from logic.partitions import OrderPartitionLogic
 from utils.config import get_settings
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.base import async_engine
 from utils.enums import UserRoles
 
 logger = logging.getLogger(__name__)
@@ -43,12 +49,69 @@ async def create_base_roles(db: Session) -> bool:
     return True
 
 
+async def create_order_version(db: Session) -> bool:
+    try:
+        await OrderLogic.init_version(db)
+    except Exception as e:
+        logger.error(f"Something wrong creating the order version base {e}")
+        return False
+    return True
+
+
+async def load_dispatcher(db: Session) -> bool:
+    if not settings.dispatch.enabled:
+        return True
+    try:
+        await dispatcher.refresh(db)
+    except Exception as e:
+        logger.error(f"Something wrong loading the forklift dispatcher {e}")
+        return False
+    return True
+
+
+async def maintain_order_partitions(db: Session, archive: bool = True) -> bool:
+    try:
+        created, archived = await OrderPartitionLogic.maintain(db, archive)
+    except Exception as e:
+        logger.error(f"Something wrong maintaining the order partitions {e}")
+        return False
+    if created or archived:
+        logger.info(f"Order partitions created for {created}, archived for {archived}")
+    return True
+
+
+async def close_session(db: Session):
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        db.close()
+
+
+async def maintain_order_partitions_forever():
+    """Background task of the server, init_db creates the partitions before it starts and archives nothing."""
+    from db.dependencies import open_session
+    while True:
+        await asyncio.sleep(settings.partitions.interval_seconds)
+        db = open_session()
+        try:
+            await maintain_order_partitions(db)
+        finally:
+            await close_session(db)
+
+
 async def init_db() -> bool:
     try:
-        from db.dependencies import get_db
-        db = next(get_db())
+        from db.dependencies import open_session
+        db = open_session()
     except Exception as e:
         logger.error(f"Could not connect DB {e}")
         return False
 
-    return await create_base_roles(db) and await create_first_super_user(db)
+    try:
+        return await create_base_roles(db) and await create_first_super_user(db) and await create_order_version(db) \
+            and await maintain_order_partitions(db, archive=False) and await load_dispatcher(db)
+    finally:
+        await close_session(db)
+        if isinstance(db, AsyncSession):
+            # Pooled async connections are bound to the event loop that opened them
+            await async_engine.dispose()
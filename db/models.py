@@ -1,17 +1,27 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from sqlalchemy import Column, Boolean
 from .base import Base
-from typing import Optional
+from typing import Any, Optional
 from sqlalchemy.orm import (
     mapped_column,
     relationship,
     Mapped
 )
 from sqlalchemy import (
+    JSON,
+    BigInteger,
     String,
     ForeignKey,
-    DateTime
+    ForeignKeyConstraint,
+    Date,
+    DateTime,
+    Index,
+    Integer,
+    Sequence
 )
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from utils.enums import OrderStates
 
 
 class BaseMixin:
@@ -70,6 +80,11 @@ class RoleByUser(Base):
     role: Mapped[Role] = relationship(back_populates='users_role')
     user: Mapped[User] = relationship(back_populates='roles_user')
 
+    __table_args__ = (
+        # Role checks and the roles of a user
+        Index('ix_role_by_user_id_user_id_role', 'id_user', 'id_role'),
+    )
+
     operator: Mapped['Operator'] = relationship(lazy='noload', back_populates="role_user", cascade='all, delete')
     forklift: Mapped['Forklift'] = relationship(lazy='noload', back_populates="role_user",  cascade='all, delete')
     admin: Mapped['Admin'] = relationship(lazy='noload', back_populates="role_user",  cascade='all, delete')
@@ -107,18 +122,48 @@ class Admin(Base):
     role_user: Mapped[RoleByUser] = relationship(lazy='joined', back_populates="admin")
 
 
+# Ids of the orders, not owned by the table: it outlives the tables replaced by the partitioning migration
+ORDER_ID_SEQUENCE = Sequence('orders_id_seq', metadata=Base.metadata)
+
+
+class next_order_id(FunctionElement):
+    """Id of a new order. A key of two columns can't autoincrement, the id is taken by the INSERT itself."""
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(next_order_id)
+def _compile_next_order_id(element, compiler, **kw):
+    return compiler.process(ORDER_ID_SEQUENCE.next_value(), **kw)
+
+
+@compiles(next_order_id, 'sqlite')
+def _compile_next_order_id_sqlite(element, compiler, **kw):
+    # No sequences, and a single writer at a time
+    return "(SELECT coalesce(max(id), 0) + 1 FROM orders)"
+
+
 class Order(Base):
+    """
+    On PostgreSQL the table is partitioned by month of creation_datetime, part of its key, see logic.partitions. An
+    order looked up by id takes its creation_datetime from OrderKey, so only the partition of its month is read.
+    creation_datetime is never changed after the order is created.
+    """
     __tablename__ = 'orders'
 
-    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False, default=next_order_id())
     id_operator: Mapped[int] = mapped_column(ForeignKey('users.id'))
     id_forklift: Mapped[int] = mapped_column(ForeignKey('users.id'))
 
-    creation_datetime: Mapped[datetime] = mapped_column(DateTime())
+    creation_datetime: Mapped[datetime] = mapped_column(DateTime(), primary_key=True)
     estimate_datetime: Mapped[datetime] = mapped_column(DateTime())
     order_datetime: Mapped[Optional[datetime]] = mapped_column(DateTime(), nullable=True)
     state: Mapped[str] = mapped_column(String(60))
     canceled: Mapped[bool] = mapped_column(default=False)
+    # Of its operator when it was created (empty without one), the key of its MaterialUsage rows
+    area: Mapped[str] = mapped_column(String(), default='', server_default='')
+    # Set by every write, see logic.order.NEXT_VERSIONS
+    version: Mapped[int] = mapped_column(BigInteger, default=0, server_default='0', index=True)
 
     materials: Mapped[list['Material']] = relationship(
         secondary="material_by_order",
@@ -141,6 +186,87 @@ class Order(Base):
     )
 
 
+class OrderKey(Base):
+    """
+    creation_datetime of each order by id, in a table that is not partitioned, written with the order. Rows of the
+    archived months are deleted with them.
+    """
+    __tablename__ = 'order_keys'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    creation_datetime: Mapped[datetime] = mapped_column(DateTime())
+
+
+# Order lists are filtered by their forklift or operator and read newest first, id is the tie-breaker of the cursor
+Index('ix_orders_id_forklift_creation_datetime', Order.id_forklift, Order.creation_datetime.desc(), Order.id)
+Index('ix_orders_id_operator_creation_datetime', Order.id_operator, Order.creation_datetime.desc(), Order.id)
+# Only the pending orders, what the forklifts are working on
+Index('ix_orders_pending_id_forklift', Order.id_forklift, Order.creation_datetime.desc(), Order.id,
+      postgresql_where=Order.state == OrderStates.PENDING.value, sqlite_where=Order.state == OrderStates.PENDING.value)
+
+
+class OrderTransition(Base):
+    """
+    Append only log of the states the orders entered, from_state being None when the order was created. Written in
+    batches by logic.order_log, without foreign keys so a deleted user or order never rejects a batch.
+    """
+    __tablename__ = 'order_events'
+
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer(), 'sqlite'), primary_key=True,
+                                    autoincrement=True)
+    id_order: Mapped[int] = mapped_column()
+    from_state: Mapped[Optional[str]] = mapped_column(String(60), nullable=True)
+    to_state: Mapped[str] = mapped_column(String(60))
+    # User who made the change
+    id_actor: Mapped[Optional[int]] = mapped_column(nullable=True)
+    ts: Mapped[datetime] = mapped_column(DateTime())
+
+    __table_args__ = (
+        # Timeline of an order, and the transitions of the orders of a period joined by order
+        Index('ix_order_events_id_order_ts', 'id_order', 'ts'),
+    )
+
+
+class IdempotentResponse(Base):
+    """Responses of the requests sent with an Idempotency-Key, see logic.idempotency.DatabaseIdempotencyStore."""
+    __tablename__ = 'idempotent_responses'
+
+    # User, endpoint and key sent
+    key: Mapped[str] = mapped_column(String(), primary_key=True)
+    # sha256 of the request body
+    fingerprint: Mapped[str] = mapped_column(String(64))
+    # None while the request runs
+    content: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(), index=True)
+
+
+class OrderVersion(Base):
+    """
+    Single row offset of the order versions on PostgreSQL, where they are the id of the writing transaction plus
+    `base`: it keeps them above the versions taken before.
+    """
+    __tablename__ = 'order_versions'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    base: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class MaterialUsage(Base):
+    """
+    Rollup of the order lines: quantity and lines by UTC day of the order, material, area stored on the order,
+    forklift and state. Kept up to date by OrderCRUD in the transaction that writes the order.
+    """
+    __tablename__ = 'material_usage'
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    id_material: Mapped[int] = mapped_column(primary_key=True)
+    area: Mapped[str] = mapped_column(String(), primary_key=True)
+    id_forklift: Mapped[int] = mapped_column(primary_key=True)
+    state: Mapped[str] = mapped_column(String(60), primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger, default=0)
+    lines: Mapped[int] = mapped_column(default=0)
+
+
 class Material(Base):
     __tablename__ = 'materials'
 
@@ -166,8 +292,16 @@ class MaterialByOrder(Base):
     __tablename__ = 'material_by_order'
 
     id_material: Mapped[int] = mapped_column(ForeignKey('materials.id'), primary_key=True)
-    id_order: Mapped[int] = mapped_column(ForeignKey('orders.id'), primary_key=True)
+    id_order: Mapped[int] = mapped_column(primary_key=True)
+    # Copy of the one of the order: lines are partitioned with their order and archived along with it
+    creation_datetime: Mapped[datetime] = mapped_column(DateTime(), primary_key=True)
     quantity: Mapped[int] = mapped_column()
 
+    __table_args__ = (
+        ForeignKeyConstraint(['id_order', 'creation_datetime'], ['orders.id', 'orders.creation_datetime']),
+        # Lines are read by the key of their order, the primary key starts with id_material
+        Index('ix_material_by_order_id_order', 'id_order', 'creation_datetime'),
+    )
+
     material: Mapped[Material] = relationship(back_populates='materials_order', innerjoin=True)
     order: Mapped[Order] = relationship(back_populates='materials_order', innerjoin=True)
@@ -0,0 +1,121 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool
+
+from utils.config import DatabaseSettings
+
+
+class PoolStatistics:
+    """
+    Counters fed by the pool events of an engine, plus the live pool gauges read at snapshot time.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.invalidations = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def listen(self, engine):
+        self.engine = engine
+        event.listen(engine, 'connect', self._on_connect)
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        with self._lock:
+            waits = self.checkouts + self.timeouts
+            return {
+                "name": self.name,
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "connections": self.connections,
+                "invalidations": self.invalidations,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "timeouts": self.timeouts,
+                "wait_total_seconds": self.wait_total,
+                "wait_max_seconds": self.wait_max,
+                "wait_avg_seconds": self.wait_total / waits if waits else 0.0,
+            }
+
+
+class _TimedPoolMixin:
+    statistics: PoolStatistics
+
+    def connect(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.statistics.record_wait(time.perf_counter() - started, timed_out)
+
+
+def timed_pool_class(pool_class: type[Pool], statistics: PoolStatistics) -> type[Pool]:
+    # The statistics live on the class so they survive Pool.recreate() on engine.dispose()
+    return type(f"Timed{pool_class.__name__}", (_TimedPoolMixin, pool_class), {"statistics": statistics})
+
+
+def get_pool_options(db_settings: DatabaseSettings) -> dict:
+    return {
+        "pool_size": db_settings.pool_size,
+        "max_overflow": db_settings.pool_max_overflow,
+        "pool_timeout": db_settings.pool_timeout,
+        "pool_recycle": db_settings.pool_recycle,
+        "pool_pre_ping": db_settings.pool_pre_ping,
+        "pool_use_lifo": db_settings.pool_use_lifo,
+    }
+
+
+# Registry used by the monitoring endpoints, one entry per engine
+pool_statistics: dict[str, PoolStatistics] = {}
+
+
+def register_pool_statistics(name: str) -> PoolStatistics:
+    statistics = PoolStatistics(name)
+    pool_statistics[name] = statistics
+    return statistics
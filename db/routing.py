@@ -0,0 +1,78 @@
+import threading
+import time
+
+from fastapi.requests import HTTPConnection
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.config import get_settings
+
+
+settings = get_settings()
+
+# Clients can always force a read from the primary with this header
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+
+WRITER_KEY = 'writer_key'
+HAS_WRITES = 'has_writes'
+# Seconds the data read by a session may lag behind the primary
+READ_LAG = 'read_lag'
+
+
+class ReadYourWrites:
+    """
+    Remembers who committed recently, so their reads keep going to the primary while the replica catches up.
+
+    State is per worker process; clients spread across workers should send READ_PRIMARY_HEADER after a write.
+    """
+
+    def __init__(self, window: float, max_writers: int = 10000):
+        self.window = window
+        self.max_writers = max_writers
+        self._writes: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def mark(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._writes) >= self.max_writers:
+                self._writes = {k: t for k, t in self._writes.items() if now - t < self.window}
+            self._writes[key] = now
+
+    def is_recent_writer(self, key: str) -> bool:
+        with self._lock:
+            written_at = self._writes.get(key)
+        return written_at is not None and time.monotonic() - written_at < self.window
+
+
+read_your_writes = ReadYourWrites(settings.db.replica_sticky_seconds)
+
+
+def get_writer_key(request: HTTPConnection) -> str | None:
+    # Keyed by the bearer token, the same one the client will read with
+    return request.headers.get('Authorization')
+
+
+def should_read_primary(request: HTTPConnection) -> bool:
+    if request.headers.get(READ_PRIMARY_HEADER, '').lower() in ('1', 'true', 'yes'):
+        return True
+    key = get_writer_key(request)
+    return key is not None and read_your_writes.is_recent_writer(key)
+
+
+@event.listens_for(Session, 'after_flush')
+def _flag_flush(session: Session, flush_context):
+    session.info[HAS_WRITES] = True
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _flag_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info[HAS_WRITES] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _mark_writer(session: Session):
+    key = session.info.get(WRITER_KEY)
+    if key and session.info.pop(HAS_WRITES, False):
+        read_your_writes.mark(key)
@@ -0,0 +1,54 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+class LazySession:
+    """
+    Request scoped proxy that only builds its Session (and so checks out a pooled connection) on first use.
+
+    `release` ends the running transaction, giving the connection back to the pool as soon as the work that needed
+    it is done instead of holding it until the response is sent.
+    """
+
+    def __init__(self, session_factory, **kwargs):
+        self._session_factory = session_factory
+        self._kwargs = kwargs
+        self._session: Session | AsyncSession | None = None
+
+    @property
+    def session(self) -> Session | AsyncSession:
+        if self._session is None:
+            self._session = self._session_factory(**self._kwargs)
+        return self._session
+
+    @property
+    def is_opened(self) -> bool:
+        return self._session is not None
+
+    @property
+    def info(self) -> dict:
+        # Readable without opening the session, entries set before the first query are handed to the Session
+        if self._session is None:
+            return self._kwargs.setdefault('info', {})
+        return self._session.info
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    async def release(self, failed: bool = False):
+        if self._session is None or not self._session.in_transaction():
+            return
+        if isinstance(self._session, AsyncSession):
+            await (self._session.rollback() if failed else self._session.commit())
+        elif failed:
+            self._session.rollback()
+        else:
+            self._session.commit()
+
+    async def aclose(self):
+        if self._session is None:
+            return
+        if isinstance(self._session, AsyncSession):
+            await self._session.close()
+        else:
+            self._session.close()
@@ -0,0 +1,111 @@
+from datetime import datetime
+from typing import Any, Sequence
+
+from sqlalchemy import and_, delete, func, literal, select, true, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from db import models
+from schemas.analytics import MaterialUsage, MaterialUsageFilter
+from utils.enums import OrderStates, UsageDimensions, UserRoles
+from .base import CRUD, run_sync
+
+# INSERT ... ON CONFLICT of each supported database
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+USAGE_KEY = [dimension.value for dimension in UsageDimensions]
+
+MAXIMUM_USAGE_ROWS = 10000
+
+
+def get_order_key(order_id: int, creation_datetime: datetime):
+    # Its whole key, only the partition of its month is read on PostgreSQL
+    return and_(models.Order.id == order_id, models.Order.creation_datetime == creation_datetime)
+
+
+def select_operator_area(id_operator: Any):
+    """Area of the operator user `id_operator` (a value or a column), empty when it is none."""
+    return func.coalesce(select(models.Operator.area)
+                         .join(models.RoleByUser, models.RoleByUser.id == models.Operator.id)
+                         .where(models.RoleByUser.id_user == id_operator,
+                                models.RoleByUser.id_role == UserRoles.OPERATOR)
+                         .scalar_subquery(), '')
+
+
+def select_usage(condition: Any, sign: int = 1, state: OrderStates | None = None):
+    """
+    Rollup rows of the lines of the orders matching `condition`, counted `sign` times (-1 removes them), keyed by
+    `state` instead of their own when given.
+    """
+    order, line = models.Order, models.MaterialByOrder
+    # The area stored on the order, its rows stay where they are when the operator moves to another area
+    key = [func.date(order.creation_datetime), line.id_material, order.area, order.id_forklift]
+    group_by = key if state is not None else [*key, order.state]
+    return select(*key, order.state if state is None else literal(state.value),
+                  func.sum(line.quantity) * sign, func.count() * sign) \
+        .select_from(order) \
+        .join(line, and_(line.id_order == order.id, line.creation_datetime == order.creation_datetime)) \
+        .where(condition) \
+        .group_by(*group_by)
+
+
+class MaterialUsageCRUD(CRUD):
+    """
+    Material usage read from the MaterialUsage rollup, a few rows per day instead of the order history.
+
+    Rows are added and moved by OrderCRUD, in the transaction that writes the order.
+    """
+
+    def _add_rows(self, db: Session, rows: Any):
+        # Upsert: existing keys are incremented, so concurrent writers of the same key add up
+        statement = UPSERTS[db.get_bind().dialect.name](self.db_model) \
+            .from_select([*USAGE_KEY, "quantity", "lines"], rows)
+        db.execute(statement.on_conflict_do_update(index_elements=USAGE_KEY, set_={
+            "quantity": self.db_model.quantity + statement.excluded.quantity,
+            "lines": self.db_model.lines + statement.excluded.lines,
+        }))
+
+    def _add_usage(self, db: Session, condition: Any, sign: int = 1):
+        self._add_rows(db, select_usage(condition, sign))
+
+    def _add_order_usage(self, db: Session, order_id: int, creation_datetime: datetime, sign: int = 1):
+        """Adds (or removes, with sign -1) the lines of the order as it currently is. Not committed."""
+        self._add_usage(db, get_order_key(order_id, creation_datetime), sign)
+
+    def _move_order_usage(self, db: Session, order_id: int, creation_datetime: datetime, from_state: OrderStates,
+                          to_state: OrderStates):
+        """Moves the lines of the order from the rows of `from_state` to those of `to_state`. Not committed."""
+        condition = get_order_key(order_id, creation_datetime)
+        self._add_rows(db, union_all(select_usage(condition, -1, from_state), select_usage(condition, 1, to_state)))
+
+    def _rebuild(self, db: Session):
+        db.execute(delete(self.db_model))
+        self._add_usage(db, true())
+        db.commit()
+
+    def _get_usage(self, db: Session, query: MaterialUsageFilter, group_by: Sequence[UsageDimensions],
+                   limit: int = 1000):
+        columns = [getattr(self.db_model, dimension.value) for dimension in group_by]
+        row_filter = db.query(*columns,
+                              func.sum(self.db_model.quantity).label("quantity"),
+                              func.sum(self.db_model.lines).label("lines"))
+        row_filter = self.get_filter_plan(query).apply(row_filter, query, sort=False)
+        rows = row_filter.group_by(*columns) \
+            .having(func.sum(self.db_model.lines) > 0) \
+            .order_by(*columns) \
+            .limit(min(limit, MAXIMUM_USAGE_ROWS)) \
+            .all()
+        return [self.model(**row._asdict()) for row in rows]
+
+    async def rebuild(self, db: Session):
+        """Recomputes the whole rollup from the orders."""
+        return await run_sync(db, self._rebuild)
+
+    async def get_usage(self, db: Session, query: MaterialUsageFilter, group_by: Sequence[UsageDimensions],
+                        limit: int = 1000):
+        """Quantity and lines of the rows matching `query`, summed by the `group_by` dimensions."""
+        return await run_sync(db, self._get_usage, query, group_by, limit)
+
+
+MaterialUsageLogic = MaterialUsageCRUD(db_model=models.MaterialUsage, model=MaterialUsage,
+                                       filter_model=MaterialUsageFilter)
@@ -1,105 +1,275 @@
-from sqlalchemy.exc import DataError, InternalError
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, insert, select, update, inspect as sa_inspect
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only, noload
 
-from typing import Any, Mapping
+from db.session import LazySession
+from schemas.bulk import BulkError, BulkResult
+from utils.enums import TotalModes
+from db.routing import READ_LAG
+from .cache import INVALIDATES, MISSING, has_pending_invalidations, register_entity_cache
+from .filters import FilterPlan, compile_filter_plan, get_filter_shape
+from .cursor import get_cursor_keys, keyset_condition, encode_cursor, decode_cursor
+
+from typing import Any, Callable, Mapping
+
+
+async def run_sync(db: Session | AsyncSession, fn: Callable, *args, **kwargs):
+    """
+    Run a blocking ORM function against the request session.
+
+    With an AsyncSession the function is executed through `run_sync`, so every query (lazy loads included) awaits
+    the async driver instead of blocking the event loop. With a plain Session it is called directly.
+
+    A LazySession is released right after, so the connection is only held while the function runs.
+    """
+    if isinstance(db, LazySession):
+        try:
+            result = await run_sync(db.session, fn, *args, **kwargs)
+        except Exception:
+            await db.release(failed=True)
+            raise
+        await db.release()
+        return result
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return fn(db, *args, **kwargs)
+
+
+# Bound for the plans kept per CRUD, shapes come from the query string
+MAXIMUM_FILTER_PLANS = 256
 
 
 class CRUD:
-    def __init__(self, db_model, model, filter_model, join=None):
+    def __init__(self, db_model, model, filter_model, join=None, extra_fields=None, cache=False, cache_depends_on=None,
+                 load_options=None):
         self.db_model = db_model
         self.model = model
         self.filter_model = filter_model
         if not join:
             join = []
         self.join = join
+        # Compiled filter plans by filter class and shape, see get_filter_plan
+        self.filter_plans: dict[tuple, FilterPlan] = {}
+        if not extra_fields:
+            extra_fields = []
+        self.parse_fields = self.compile_parse_fields(extra_fields)
+        # Loader options (selectinload/joinedload) by the schema field they load, applied to every row query
+        self.load_options = dict(load_options or {})
+        self.cache = None
+        if cache:
+            if cache_depends_on is None:
+                cache_depends_on = self.get_related_tables()
+            self.cache = register_entity_cache(self.db_model.__table__.name, cache_depends_on)
+
+    def compile_parse_fields(self, extra_fields: list[str]) -> tuple[str, ...]:
+        """
+        Attributes read from a row to build its schema: the schema fields mapped by the model (columns and
+        relationships) plus `extra_fields`, needed by schema validators. Nothing else is touched, so relationships
+        the schema does not expose are never lazy loaded.
+        """
+        mapper = sa_inspect(self.db_model)
+        attributes = set(mapper.column_attrs.keys()) | set(mapper.relationships.keys())
+        fields = [field for field in self.model.model_fields if field in attributes]
+        return tuple(fields + [field for field in extra_fields if field not in fields])
+
+    def get_related_tables(self) -> set[str]:
+        # Tables of the relationships parsed into the schema, their changes show up in cached rows
+        tables = set()
+        for relationship in sa_inspect(self.db_model).relationships:
+            if relationship.key in self.parse_fields:
+                tables.add(relationship.target.name)
+                if relationship.secondary is not None:
+                    tables.add(relationship.secondary.name)
+        return tables
+
+    def get_cache_key(self, row_id: Any):
+        # Ids arrive as path params or token claims, normalized to the column type so invalidations match
+        try:
+            return self.db_model.id.type.python_type(row_id)
+        except (TypeError, ValueError):
+            return None
+
+    def store_cached(self, db: Session, key: Any, value: Any, token: tuple[int, float]):
+        # Rows read inside a transaction with uncommitted writes are never shared
+        if value is not None and not has_pending_invalidations(db.info):
+            self.cache.set(key, value.model_copy(), token, lag=db.info.get(READ_LAG, 0.0))
 
-    async def parse(self, row: Any):
+    def get_filter_plan(self, query: Any) -> FilterPlan:
+        """
+        Compiled plan for the shape of `query` (fields set and ordering). Fields are resolved against the model and
+        the `join` entities when the plan is built, and invalid ones raise InvalidFilter before any query runs.
+        """
+        key = (type(query), get_filter_shape(query))
+        plan = self.filter_plans.get(key)
+        if plan is None:
+            plan = compile_filter_plan(type(query), self.db_model, self.join, key[1])
+            if len(self.filter_plans) < MAXIMUM_FILTER_PLANS:
+                self.filter_plans[key] = plan
+        return plan
+
+    def check_filter(self, query: Any):
+        """Raises InvalidFilter for fields or values the database would reject, without running any query."""
+        self.get_filter_plan(query).get_params(query)
+
+    def get_load_options(self, fields: tuple[str, ...] | None = None) -> list:
+        """
+        Loader options for rows parsed with `fields`, all of the plan when None. With fields, only the requested
+        columns are selected and relationships not requested are neither joined nor loaded.
+        """
+        if fields is None:
+            options = []
+            for option in self.load_options.values():
+                if not any(option is added for added in options):
+                    options.append(option)
+            return options
+
+        mapper = sa_inspect(self.db_model)
+        columns = [getattr(self.db_model, name) for name in fields if name in mapper.column_attrs and name != 'id']
+        options = [load_only(self.db_model.id, *columns)]
+        for relationship in mapper.relationships:
+            if relationship.key not in fields:
+                options.append(noload(getattr(self.db_model, relationship.key)))
+            elif relationship.key in self.load_options:
+                options.append(self.load_options[relationship.key])
+        return options
+
+    def query_rows(self, db: Session, *entities, fields: tuple[str, ...] | None = None):
+        return db.query(self.db_model, *entities).options(*self.get_load_options(fields))
+
+    def parse_data(self, row: Any, fields: tuple[str, ...] | None = None) -> dict:
+        return {field: getattr(row, field) for field in fields or self.parse_fields}
+
+    def parse(self, row: Any, fields: tuple[str, ...] | None = None):
+        """The row as `model`, or as a dict of just `fields` when given."""
         if not row:
             return None
-        data = {column: getattr(row, column, None) for column in dir(row)
-                if not column.startswith('_') and column != 'metadata'}
-        return self.model(**data)
+        if fields:
+            return self.parse_data(row, fields)
+        return self.model(**self.parse_data(row))
 
-    async def get_rows_count(self, db: Session):
+    # ------------------------
+    # Blocking implementations, always executed through run_sync
+    # ------------------------
+
+    def _get_rows_count(self, db: Session):
         return db.query(self.db_model).count()
 
-    async def get_by_id(self, db: Session, row_id: int):
-        return await self.parse(db.query(self.db_model).filter(self.db_model.id == row_id).first())
+    def _get_by_id(self, db: Session, row_id: int):
+        return self.parse(self.query_rows(db).filter(self.db_model.id == row_id).first())
 
-    async def filter_by_query_partial(self, db: Session, query: Any, skip: int = 0, limit: int = 100):
+    def _filter_by_query_partial(self, db: Session, query: Any, skip: int = 0, limit: int = 100,
+                                 fields: tuple[str, ...] | None = None):
         if not isinstance(query, self.filter_model):
-            data: list = db.query(self.db_model).offset(skip).limit(limit).all()
+            data: list = self.query_rows(db, fields=fields).offset(skip).limit(limit).all()
         else:
-            try:
-                row_filter = db.query(self.db_model)
-                for j in self.join:
-                    row_filter = row_filter.join(j)
-                row_filter = query.filter(row_filter)
-                row_filter = query.sort(row_filter)
-                data = row_filter.offset(skip).limit(limit).all()
-            except (DataError, InternalError) as error:
-                db.rollback()
-                data: list = db.query(self.db_model).offset(skip).limit(limit).all()
-        return [await self.parse(d) for d in data]
+            row_filter = self.get_filter_plan(query).apply(self.query_rows(db, fields=fields), query)
+            data = row_filter.offset(skip).limit(limit).all()
+        return [self.parse(d, fields) for d in data]
 
-    async def count_rows_by_query_partial(self, db: Session, query: Any):
+    def _filter_by_query_cursor(self, db: Session, query: Any, cursor: str = '', limit: int = 100,
+                                fields: tuple[str, ...] | None = None):
+        keys = get_cursor_keys(query, self.db_model)
+        # The key columns of the last row are needed to build the next cursor, id is always loaded
+        row_filter = self.query_rows(db, fields=fields and fields + tuple(key.name for key in keys if key.name != 'id'))
+        if isinstance(query, self.filter_model):
+            row_filter = self.get_filter_plan(query).apply(row_filter, query, sort=False)
+        if cursor:
+            row_filter = row_filter.filter(keyset_condition(keys, decode_cursor(keys, cursor)))
+        data = row_filter.order_by(*[key.order_by() for key in keys]).limit(limit + 1).all()
+
+        next_cursor = encode_cursor(keys, data[limit - 1]) if len(data) > limit else None
+        return [self.parse(d, fields) for d in data[:limit]], next_cursor
+
+    def _filter_page_by_query(self, db: Session, query: Any, skip: int = 0, limit: int = 100,
+                              total_mode: TotalModes = TotalModes.EXACT, fields: tuple[str, ...] | None = None):
+        if total_mode != TotalModes.EXACT:
+            data = self._filter_by_query_partial(db, query, skip=skip, limit=limit, fields=fields)
+            total = self._estimate_rows_by_query_partial(db, query) if total_mode == TotalModes.APPROXIMATE else None
+            return data, total
+
+        # The filtered total travels with every row of the page, no separate COUNT round trip
+        total_column = func.count().over().label('total')
+        if not isinstance(query, self.filter_model):
+            rows: list = self.query_rows(db, total_column, fields=fields).offset(skip).limit(limit).all()
+        else:
+            row_filter = self.get_filter_plan(query).apply(self.query_rows(db, total_column, fields=fields), query)
+            rows = row_filter.offset(skip).limit(limit).all()
+
+        if rows:
+            total = rows[0].total
+        elif skip:
+            # Past the last page, nothing carried the total
+            total = self._count_rows_by_query_partial(db, query)
+        else:
+            total = 0
+        return [self.parse(row[0], fields) for row in rows], total
+
+    def _count_rows_by_query_partial(self, db: Session, query: Any):
         if not isinstance(query, self.filter_model):
             count: int = db.query(self.db_model).count()
         else:
-            try:
-                row_filter = db.query(self.db_model)
-                for j in self.join:
-                    row_filter = row_filter.join(j)
-                row_filter = query.filter(row_filter)
-                row_filter = query.sort(row_filter)
-                count = row_filter.count()
-            except (DataError, InternalError) as error:
-                db.rollback()
-                count: int = db.query(self.db_model).count()
+            count = self.get_filter_plan(query).apply(db.query(self.db_model), query, sort=False).count()
         return count
 
-    async def filter_by_attributes(self, db: Session, attributes: Mapping[str, Any], skip: int = 0, limit: int = 100):
-        q = db.query(self.db_model)
+    def _estimate_rows_by_query_partial(self, db: Session, query: Any):
+        connection = db.connection()
+        if connection.dialect.name != 'postgresql':
+            return self._count_rows_by_query_partial(db, query)
+
+        row_filter = db.query(self.db_model.id)
+        if isinstance(query, self.filter_model):
+            row_filter = self.get_filter_plan(query).apply(row_filter, query, sort=False)
+        # Planner estimate, built from the table statistics instead of scanning the rows
+        compiled = row_filter.statement.compile(dialect=connection.dialect,
+                                                compile_kwargs={"render_postcompile": True})
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def _filter_by_attributes(self, db: Session, attributes: Mapping[str, Any], skip: int = 0, limit: int = 100):
+        q = self.query_rows(db)
         for attr, value in attributes.items():
             q = q.filter(getattr(self.db_model, attr).__eq__(value))
         data = q.offset(skip).limit(limit).all()
-        return [await self.parse(d) for d in data]
+        return [self.parse(d) for d in data]
 
-    async def filter_by_id_list(self, db: Session, list_id: list[int]):
-        data = db.query(self.db_model).filter(self.db_model.id.in_(list_id)).all()
-        return [await self.parse(d) for d in data]
+    def _filter_by_id_list(self, db: Session, list_id: list[int]):
+        data = self.query_rows(db).filter(self.db_model.id.in_(list_id)).all()
+        return [self.parse(d) for d in data]
 
-    async def get_all(self, db: Session, skip: int = 0, limit: int = 100):
-        data = db.query(self.db_model).offset(skip).limit(limit).all()
-        return [await self.parse(d) for d in data]
+    def _get_all(self, db: Session, skip: int = 0, limit: int = 100):
+        data = self.query_rows(db).offset(skip).limit(limit).all()
+        return [self.parse(d) for d in data]
 
-    async def create(self, db: Session, data_in: dict):
-        dict_data = data_in
-        db_row = self.db_model(**dict_data)
-        db.add(db_row)
-        db.commit()
-        db.refresh(db_row)
-        return await self.get_by_id(db, db_row.id)
+    def _insert_returning(self, db: Session, data_in: dict):
+        return db.scalars(insert(self.db_model).values(**data_in).returning(self.db_model)).one()
 
-    async def update(self, db: Session, row_id: int, data_changes: dict):
-        db_row = await self.get_by_id(db, row_id=row_id)
-        if not db_row:
-            return
+    def _create(self, db: Session, data_in: dict):
+        # INSERT ... RETURNING, parsed before the commit expires the row
+        db_row = self._insert_returning(db, data_in)
+        created = self.parse(db_row)
+        db.commit()
+        return created
 
+    def _update(self, db: Session, row_id: int, data_changes: dict):
         entry_data = data_changes
         if not len(entry_data):
-            return await self.get_by_id(db, row_id)
+            return self._get_by_id(db, row_id)
 
-        db.query(self.db_model) \
-            .filter(self.db_model.id == row_id) \
-            .update(values=entry_data)
+        db_row = db.scalars(update(self.db_model)
+                            .where(self.db_model.id == row_id)
+                            .values(**entry_data)
+                            .returning(self.db_model)
+                            .execution_options(**{INVALIDATES: [row_id]})).one_or_none()
+        if not db_row:
+            db.rollback()
+            return
 
+        updated = self.parse(db_row)
         db.commit()
-        # db.refresh(row)
+        return updated
 
-        return await self.get_by_id(db, row_id)
-
-    async def delete(self, db: Session, row_id: int):
+    def _delete(self, db: Session, row_id: int):
         db_row = db.query(self.db_model).filter(self.db_model.id == row_id).first()
         if not db_row:
             return False
@@ -107,3 +277,184 @@ class CRUD:
         db.delete(db_row)
         db.commit()
         return True
+
+    # ------------------------
+    # Bulk implementations: one transaction, rows keyed by their position in the request
+    # ------------------------
+
+    @classmethod
+    def bulk_error_detail(cls, error: Exception) -> str:
+        if isinstance(error, IntegrityError):
+            return "Conflicts with existing data"
+        return "Invalid data"
+
+    def _bulk_insert(self, db: Session, rows: Mapping[int, dict]) -> tuple[dict[int, int], list[BulkError]]:
+        if not rows:
+            return {}, []
+        statement = insert(self.db_model).returning(self.db_model.id, sort_by_parameter_order=True)
+        try:
+            # Multi-row INSERT ... RETURNING, batched by the driver
+            with db.begin_nested():
+                ids = db.scalars(statement, list(rows.values())).all()
+            return dict(zip(rows.keys(), ids)), []
+        except (IntegrityError, DataError):
+            pass
+
+        # Some row was rejected, find which ones still inside the same transaction
+        ids, errors = {}, []
+        for index, values in rows.items():
+            try:
+                with db.begin_nested():
+                    ids[index] = db.scalars(insert(self.db_model).values(**values).returning(self.db_model.id)).one()
+            except (IntegrityError, DataError) as error:
+                errors.append(BulkError(row=index, detail=self.bulk_error_detail(error)))
+        return ids, errors
+
+    def _bulk_create(self, db: Session, rows: Mapping[int, dict]):
+        ids, errors = self._bulk_insert(db, rows)
+        db.commit()
+        return BulkResult(processed=len(ids), ids=list(ids.values()), errors=errors)
+
+    def _bulk_update(self, db: Session, rows: Mapping[int, dict]):
+        row_ids = [values["id"] for values in rows.values()]
+        existing = set(db.scalars(select(self.db_model.id).where(self.db_model.id.in_(row_ids))))
+        errors = [BulkError(row=index, detail="Not found") for index, values in rows.items()
+                  if values["id"] not in existing]
+        found = {index: values for index, values in rows.items() if values["id"] in existing}
+        changes = [values for values in found.values() if len(values) > 1]
+
+        updated = dict(found)
+        try:
+            if changes:
+                # ORM bulk UPDATE by primary key, executemany
+                with db.begin_nested():
+                    db.execute(update(self.db_model), changes)
+        except (IntegrityError, DataError):
+            for index, values in found.items():
+                try:
+                    with db.begin_nested():
+                        db.execute(update(self.db_model), [values])
+                except (IntegrityError, DataError) as error:
+                    del updated[index]
+                    errors.append(BulkError(row=index, detail=self.bulk_error_detail(error)))
+        db.commit()
+        return BulkResult(processed=len(updated), ids=[values["id"] for values in updated.values()],
+                          errors=sorted(errors, key=lambda e: e.row))
+
+    def _bulk_delete(self, db: Session, row_ids: Mapping[int, int], condition: Any = None):
+        statement = delete(self.db_model).execution_options(**{INVALIDATES: list(row_ids.values())})
+        if condition is not None:
+            statement = statement.where(condition)
+        try:
+            with db.begin_nested():
+                deleted = set(db.scalars(statement.where(self.db_model.id.in_(list(row_ids.values())))
+                                         .returning(self.db_model.id)))
+            failed = {}
+        except (IntegrityError, DataError):
+            deleted, failed = set(), {}
+            for index, row_id in row_ids.items():
+                try:
+                    with db.begin_nested():
+                        deleted.update(db.scalars(statement.where(self.db_model.id == row_id)
+                                                  .returning(self.db_model.id)))
+                except (IntegrityError, DataError) as error:
+                    failed[index] = self.bulk_error_detail(error)
+        db.commit()
+        errors = [BulkError(row=index, detail=failed.get(index, "Not found")) for index, row_id in row_ids.items()
+                  if row_id not in deleted]
+        return BulkResult(processed=len(deleted), ids=[row_id for row_id in row_ids.values() if row_id in deleted],
+                          errors=errors)
+
+    # ------------------------
+    # Public API
+    # ------------------------
+
+    async def get_rows_count(self, db: Session):
+        return await run_sync(db, self._get_rows_count)
+
+    async def get_by_id(self, db: Session, row_id: int):
+        key = self.get_cache_key(row_id) if self.cache else None
+        if key is None:
+            return await run_sync(db, self._get_by_id, row_id)
+
+        cached = self.cache.get(key)
+        if cached is not MISSING:
+            return cached.model_copy()
+        token = self.cache.begin_load()
+        data = await run_sync(db, self._get_by_id, row_id)
+        self.store_cached(db, key, data, token)
+        return data
+
+    async def filter_by_query_partial(self, db: Session, query: Any, skip: int = 0, limit: int = 100,
+                                      fields: tuple[str, ...] | None = None):
+        return await run_sync(db, self._filter_by_query_partial, query, skip=skip, limit=limit, fields=fields)
+
+    async def filter_by_query_cursor(self, db: Session, query: Any, cursor: str = '', limit: int = 100,
+                                     fields: tuple[str, ...] | None = None):
+        """
+        Keyset pagination on the filter's order_by columns. An empty cursor starts from the first row.
+
+        Returns the page and the cursor of the next one, None on the last page.
+        """
+        return await run_sync(db, self._filter_by_query_cursor, query, cursor=cursor, limit=limit, fields=fields)
+
+    async def filter_page_by_query(self, db: Session, query: Any, skip: int = 0, limit: int = 100,
+                                   total_mode: TotalModes = TotalModes.EXACT, fields: tuple[str, ...] | None = None):
+        """
+        Page of rows matching `query` and the total of matching rows, exact (fetched along the page), approximate
+        (planner estimate) or None.
+
+        With `fields` rows are dicts of just those fields, loaded without the rest of the columns and relationships.
+        """
+        return await run_sync(db, self._filter_page_by_query, query, skip=skip, limit=limit, total_mode=total_mode,
+                              fields=fields)
+
+    async def count_rows_by_query_partial(self, db: Session, query: Any):
+        return await run_sync(db, self._count_rows_by_query_partial, query)
+
+    async def estimate_rows_by_query_partial(self, db: Session, query: Any):
+        return await run_sync(db, self._estimate_rows_by_query_partial, query)
+
+    async def filter_by_attributes(self, db: Session, attributes: Mapping[str, Any], skip: int = 0, limit: int = 100):
+        return await run_sync(db, self._filter_by_attributes, attributes, skip=skip, limit=limit)
+
+    async def filter_by_id_list(self, db: Session, list_id: list[int]):
+        keys = [self.get_cache_key(row_id) for row_id in list_id] if self.cache else [None]
+        if None in keys:
+            return await run_sync(db, self._filter_by_id_list, list_id)
+
+        found = {}
+        for key in keys:
+            cached = self.cache.get(key)
+            if cached is not MISSING:
+                found[key] = cached.model_copy()
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            token = self.cache.begin_load()
+            for data in await run_sync(db, self._filter_by_id_list, missing):
+                key = self.get_cache_key(data.id)
+                self.store_cached(db, key, data, token)
+                found[key] = data
+        return [found[key] for key in dict.fromkeys(keys) if key in found]
+
+    async def get_all(self, db: Session, skip: int = 0, limit: int = 100):
+        return await run_sync(db, self._get_all, skip=skip, limit=limit)
+
+    async def create(self, db: Session, data_in: dict):
+        return await run_sync(db, self._create, data_in)
+
+    async def update(self, db: Session, row_id: int, data_changes: dict):
+        return await run_sync(db, self._update, row_id, data_changes)
+
+    async def delete(self, db: Session, row_id: int):
+        return await run_sync(db, self._delete, row_id)
+
+    async def bulk_create(self, db: Session, rows: Mapping[int, dict]):
+        return await run_sync(db, self._bulk_create, rows)
+
+    async def bulk_update(self, db: Session, rows: Mapping[int, dict]):
+        """Every row carries the `id` of the row to change and the columns to set."""
+        return await run_sync(db, self._bulk_update, rows)
+
+    async def bulk_delete(self, db: Session, row_ids: Mapping[int, int]):
+        return await run_sync(db, self._bulk_delete, row_ids)
@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from utils.config import get_settings
+
+
+settings = get_settings()
+
+# Tables written by the running transaction: table name -> primary keys changed, None when unknown (whole table)
+PENDING_INVALIDATIONS = 'cache_invalidations'
+# Statement execution option listing the primary keys an UPDATE/DELETE touches
+INVALIDATES = 'invalidates'
+
+MISSING = object()
+
+
+class EntityCache:
+    """
+    Bounded LRU of parsed rows keyed by primary key, each entry living at most `ttl` seconds.
+
+    Invalidation is applied when a transaction that wrote the table commits. Loads racing with a write are not stored:
+    a load keeps the generation it started at and is dropped if its key was invalidated meanwhile.
+
+    Entries are per worker process, other workers only see a change once their entry expires.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float, depends_on: Iterable[str] = ()):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        # Tables whose rows are embedded in the cached schema, any write to them clears the whole cache
+        self.depends_on = frozenset(depends_on)
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # Recently invalidated keys, with the generation and time of their invalidation
+        self._invalidated: OrderedDict[Hashable, tuple[int, float]] = OrderedDict()
+        self._generation = 0
+        # Everything invalidated up to this generation/time, kept when clearing or forgetting old invalidations
+        self._floor = (0, float('-inf'))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+            self.invalidations = 0
+            self.rejected = 0
+
+    def get(self, key: Hashable):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def begin_load(self) -> tuple[int, float]:
+        with self._lock:
+            return self._generation, time.monotonic()
+
+    def set(self, key: Hashable, value: Any, token: tuple[int, float], lag: float = 0.0):
+        """
+        Stores a row loaded since `token`. `lag` is how far behind the primary the source may be (replica reads), so
+        invalidations that recent are also considered newer than the load.
+        """
+        generation, started_at = token
+        started_at -= lag
+        with self._lock:
+            invalidated = self._invalidated.get(key, self._floor)
+            if max(invalidated[0], self._floor[0]) > generation or max(invalidated[1], self._floor[1]) >= started_at:
+                self.rejected += 1
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys: Iterable[Hashable]):
+        with self._lock:
+            self._generation += 1
+            mark = (self._generation, time.monotonic())
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+                self._invalidated[key] = mark
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_size:
+                _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._invalidated.clear()
+            self._floor = (self._generation, time.monotonic())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "rejected": self.rejected,
+            }
+
+
+# Registry used by the invalidation events and the monitoring endpoints, one entry per cached table
+entity_caches: dict[str, EntityCache] = {}
+
+
+def register_entity_cache(name: str, depends_on: Iterable[str] = ()) -> EntityCache | None:
+    """Cache for the table `name` as configured in the settings, None when caching is off for it."""
+    cache_settings = settings.cache
+    max_size = cache_settings.sizes.get(name, cache_settings.max_size)
+    ttl = cache_settings.ttls.get(name, cache_settings.ttl)
+    if not cache_settings.enabled or max_size <= 0 or ttl <= 0:
+        return None
+    cache = EntityCache(name, max_size, ttl, depends_on)
+    entity_caches[name] = cache
+    return cache
+
+
+def has_pending_invalidations(info: dict) -> bool:
+    return bool(info.get(PENDING_INVALIDATIONS))
+
+
+def _add_pending(session: Session, table: str, keys: Iterable[Hashable] | None):
+    pending = session.info.setdefault(PENDING_INVALIDATIONS, {})
+    if keys is None:
+        pending[table] = None
+    elif table not in pending:
+        pending[table] = set(keys)
+    elif pending[table] is not None:
+        pending[table].update(keys)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed(session: Session, flush_context):
+    for obj in session.new:
+        _add_pending(session, obj.__table__.name, ())
+    for obj in list(session.dirty) + list(session.deleted):
+        identity = sa_inspect(obj).identity
+        _add_pending(session, obj.__table__.name, identity[:1] if identity else None)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_dml(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    session = orm_execute_state.session
+    table = orm_execute_state.statement.table.name
+    if orm_execute_state.is_insert:
+        _add_pending(session, table, ())
+        return
+
+    keys = orm_execute_state.execution_options.get(INVALIDATES)
+    parameters = orm_execute_state.parameters
+    if keys is None and isinstance(parameters, list) and all('id' in values for values in parameters):
+        # ORM bulk UPDATE by primary key
+        keys = [values['id'] for values in parameters]
+    _add_pending(session, table, keys)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidations(session: Session):
+    pending = session.info.pop(PENDING_INVALIDATIONS, None)
+    if not pending:
+        return
+    for cache in entity_caches.values():
+        if cache.depends_on.intersection(pending) or (cache.name in pending and pending[cache.name] is None):
+            cache.clear()
+        elif pending.get(cache.name):
+            cache.invalidate(pending[cache.name])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session: Session):
+    session.info.pop(PENDING_INVALIDATIONS, None)
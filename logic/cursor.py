@@ -0,0 +1,95 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import and_, or_, tuple_, inspect as sa_inspect
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorKey:
+    def __init__(self, name: str, column: Any, descending: bool):
+        self.name = name
+        self.column = column
+        self.descending = descending
+
+    def order_by(self):
+        return self.column.desc() if self.descending else self.column.asc()
+
+    def after(self, value: Any):
+        return self.column < value if self.descending else self.column > value
+
+    def from_(self, value: Any):
+        return self.column <= value if self.descending else self.column >= value
+
+
+def get_cursor_keys(query: Any, db_model) -> list[CursorKey]:
+    """
+    Keyset columns for a filter: its active `order_by` fields, with the primary key appended as tie-breaker so
+    every row has a unique position.
+    """
+    columns = sa_inspect(db_model).column_attrs
+    ordering = getattr(query, 'ordering_values', None) or []
+    keys = []
+    for field_name in ordering:
+        name = field_name.replace("-", "").replace("+", "")
+        if name not in columns:
+            raise InvalidCursor(f"{name} can't be used to paginate with a cursor")
+        column = getattr(db_model, name)
+        if any(c.nullable for c in columns[name].columns):
+            raise InvalidCursor(f"{name} is nullable, it can't be used to paginate with a cursor")
+        keys.append(CursorKey(name, column, field_name.startswith('-')))
+    if 'id' not in [key.name for key in keys]:
+        keys.append(CursorKey('id', db_model.id, False))
+    return keys
+
+
+def keyset_condition(keys: list[CursorKey], values: list[Any]):
+    """
+    Rows after `values` in the order of `keys`, written so the index on the keys is entered at the cursor: a deep
+    page costs the same as the first one.
+    """
+    descending = {key.descending for key in keys}
+    if len(descending) == 1:
+        # Same direction for every key: (k1, k2) > (v1, v2), a single index range
+        columns, row = tuple_(*(key.column for key in keys)), tuple_(*values)
+        return columns < row if descending.pop() else columns > row
+
+    # (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... with each comparison following its own sort direction, and k1 >= v1
+    # repeated on its own, the bound the index range starts from
+    conditions = []
+    for i, key in enumerate(keys):
+        equals = [keys[j].column == values[j] for j in range(i)]
+        conditions.append(and_(*equals, key.after(values[i])))
+    return and_(keys[0].from_(values[0]), or_(*conditions))
+
+
+def encode_cursor(keys: list[CursorKey], row: Any) -> str:
+    values = [getattr(row, key.name) for key in keys]
+    data = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(keys: list[CursorKey], cursor: str) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor("Cursor does not match the requested order")
+
+    decoded = []
+    for key, value in zip(keys, values):
+        python_type = key.column.type.python_type
+        try:
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif not isinstance(value, python_type):
+                raise InvalidCursor("Cursor does not match the requested order")
+        except (ValueError, TypeError):
+            raise InvalidCursor("Invalid cursor")
+        decoded.append(value)
+    return decoded
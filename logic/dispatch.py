@@ -0,0 +1,150 @@
+import heapq
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from db import models
+from schemas.order import Order
+from utils.config import get_settings
+from utils.enums import OrderStates, UserRoles
+from .base import run_sync
+from .order import order_listeners
+
+
+settings = get_settings()
+
+
+class NoForkliftAvailable(Exception):
+    """There is no active forklift to dispatch the order to."""
+
+
+class ForkliftDispatcher:
+    """
+    Picks the forklift of new orders: the one already serving the area of the order while it has fewer than
+    `consolidate_below` open (pending) orders, so trips to an area are consolidated, else the least loaded one.
+
+    Loads live in memory, in a priority queue of forklifts by open orders where stale entries are skipped when they
+    reach the top. They follow every order event and are reloaded from the pending orders every `refresh_seconds`,
+    which also picks up new forklifts and the orders of other worker processes. Forklifts reserved for orders being
+    created are kept apart and counted again on top of every reload. Must be used from the event loop.
+    """
+
+    def __init__(self, consolidate_below: int, refresh_seconds: float):
+        self.consolidate_below = consolidate_below
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at: float | None = None
+        # (forklift, area) -> outstanding reservations
+        self.reserved: Counter[tuple[int, str | None]] = Counter()
+        self.reset([], {}, [])
+
+    def reset(self, forklifts: Iterable[int], operator_areas: dict[int, str],
+              open_orders: Iterable[tuple[int, int, int]]):
+        """Loads from scratch: forklift ids, area by operator id and (id, forklift, operator) of the open orders."""
+        self.operator_areas = operator_areas
+        # Candidates, the open orders of other (e.g. deactivated) forklifts are still counted
+        self.forklifts = frozenset(forklifts)
+        self.loads: dict[int, int] = {forklift: 0 for forklift in self.forklifts}
+        # area -> {forklift: open orders of the area}
+        self.area_loads: defaultdict[str | None, dict[int, int]] = defaultdict(dict)
+        # open order id -> (forklift, area)
+        self.orders: dict[int, tuple[int, str | None]] = {}
+        for order_id, forklift, operator in open_orders:
+            self.open(order_id, forklift, operator_areas.get(operator))
+        for (forklift, area), count in self.reserved.items():
+            self._count(forklift, area, count)
+        self._heap = [(load, forklift) for forklift, load in self.loads.items()]
+        heapq.heapify(self._heap)
+
+    def _count(self, forklift: int, area: str | None, delta: int):
+        load = self.loads[forklift] = self.loads.get(forklift, 0) + delta
+        in_area = self.area_loads[area].get(forklift, 0) + delta
+        if in_area > 0:
+            self.area_loads[area][forklift] = in_area
+        else:
+            self.area_loads[area].pop(forklift, None)
+        heapq.heappush(self._heap, (load, forklift))
+        if len(self._heap) > 4 * len(self.loads) + 64:
+            # Mostly stale entries, rebuilt from the current loads
+            self._heap = [(load, forklift) for forklift, load in self.loads.items()]
+            heapq.heapify(self._heap)
+
+    def open(self, order_id: int, forklift: int, area: str | None):
+        if order_id not in self.orders:
+            self.orders[order_id] = (forklift, area)
+            self._count(forklift, area, 1)
+
+    def close(self, order_id: int):
+        if order_id in self.orders:
+            self._count(*self.orders.pop(order_id), -1)
+
+    def on_order_event(self, event: str, order: Order):
+        if order.state == OrderStates.PENDING:
+            self.open(order.id, order.id_forklift, self.operator_areas.get(order.id_operator))
+        else:
+            self.close(order.id)
+
+    def least_loaded(self) -> int | None:
+        while self._heap:
+            load, forklift = self._heap[0]
+            if self.loads.get(forklift) == load and forklift in self.forklifts:
+                return forklift
+            heapq.heappop(self._heap)
+        return None
+
+    def choose(self, area: str | None) -> int:
+        serving = [forklift for forklift in self.area_loads.get(area, ()) if forklift in self.forklifts]
+        if serving:
+            forklift = min(serving, key=lambda f: (self.loads[f], f))
+            if self.loads[forklift] < self.consolidate_below:
+                return forklift
+        forklift = self.least_loaded()
+        if forklift is None:
+            raise NoForkliftAvailable()
+        return forklift
+
+    @contextmanager
+    def reserve(self, id_operator: int):
+        """
+        Forklift for a new order of the operator, counted as loaded until the block ends so orders created meanwhile
+        are spread. The created order is counted by its event.
+        """
+        area = self.operator_areas.get(id_operator)
+        forklift = self.choose(area)
+        self.reserved[forklift, area] += 1
+        self._count(forklift, area, 1)
+        try:
+            yield forklift
+        finally:
+            self.reserved[forklift, area] -= 1
+            if not self.reserved[forklift, area]:
+                del self.reserved[forklift, area]
+            self._count(forklift, area, -1)
+
+    @staticmethod
+    def _fetch(db: Session):
+        forklifts = db.scalars(select(models.User.id)
+                               .join(models.RoleByUser, models.RoleByUser.id_user == models.User.id)
+                               .where(models.RoleByUser.id_role == UserRoles.FORKLIFT, models.User.isActive)).all()
+        operator_areas = dict(db.execute(select(models.RoleByUser.id_user, models.Operator.area)
+                                         .join(models.Operator, models.Operator.id == models.RoleByUser.id)).all())
+        open_orders = db.execute(select(models.Order.id, models.Order.id_forklift, models.Order.id_operator)
+                                 .where(models.Order.state == OrderStates.PENDING)).all()
+        return forklifts, operator_areas, open_orders
+
+    @property
+    def needs_refresh(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.refresh_seconds
+
+    async def refresh(self, db: Session):
+        self.reset(*await run_sync(db, self._fetch))
+        self.loaded_at = time.monotonic()
+
+
+dispatcher = ForkliftDispatcher(settings.dispatch.consolidate_below, settings.dispatch.refresh_seconds)
+
+if settings.dispatch.enabled:
+    order_listeners.append(dispatcher.on_order_event)
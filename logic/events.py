@@ -0,0 +1,93 @@
+import asyncio
+from collections import defaultdict, deque
+from typing import Hashable, Iterable
+
+
+# Events a subscriber may have waiting before it's considered too slow and dropped
+MAXIMUM_PENDING_EVENTS = 256
+
+
+class Subscription:
+    """Events of some topics waiting to be sent to one consumer, closed when it leaves or falls too far behind."""
+
+    def __init__(self, topics: Iterable[Hashable], max_pending: int = MAXIMUM_PENDING_EVENTS):
+        self.topics = frozenset(topics)
+        self.max_pending = max_pending
+        self.closed = False
+        self.overflowed = False
+        self._pending: deque[str] = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, message: str):
+        if self.closed:
+            return
+        if len(self._pending) >= self.max_pending:
+            # The consumer must re-read the current state, skipping events would leave it silently outdated
+            self.overflowed = True
+            self.close()
+            return
+        self._pending.append(message)
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._pending.clear()
+        self._ready.set()
+
+    async def get(self) -> str | None:
+        """Next event, None once closed."""
+        while not self._pending:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self._pending.popleft()
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of serialized events by topic.
+
+    Publishing never waits on subscribers: events are queued per subscription and sent by their consumer. Must be used
+    from the event loop thread. Subscribers only get the events published by their own worker process.
+    """
+
+    def __init__(self, max_pending: int = MAXIMUM_PENDING_EVENTS):
+        self.max_pending = max_pending
+        self._subscribers: defaultdict[Hashable, set[Subscription]] = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    @property
+    def subscriptions(self) -> int:
+        return len(set().union(*self._subscribers.values()))
+
+    def subscribe(self, topics: Iterable[Hashable]) -> Subscription:
+        subscription = Subscription(topics, self.max_pending)
+        for topic in subscription.topics:
+            self._subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        for topic in subscription.topics:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def publish(self, topics: Iterable[Hashable], message: str):
+        # A subscriber of several of the topics gets the event once
+        receivers = set()
+        for topic in topics:
+            receivers.update(self._subscribers.get(topic, ()))
+        self.published += 1
+        for subscription in receivers:
+            subscription.push(message)
+            if subscription.overflowed:
+                self.dropped += 1
+                self.unsubscribe(subscription)
+            else:
+                self.delivered += 1
@@ -0,0 +1,143 @@
+from enum import Enum
+from typing import Any
+
+from sqlalchemy import BigInteger, Integer, SmallInteger, bindparam, inspect as sa_inspect, literal, or_
+from sqlalchemy.orm import Query
+from fastapi_filter.contrib.sqlalchemy import Filter
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+# Django style operators of fastapi-filter, name -> column method
+OPERATORS = {
+    "eq": "__eq__",
+    "neq": "__ne__",
+    "gt": "__gt__",
+    "gte": "__ge__",
+    "lt": "__lt__",
+    "lte": "__le__",
+    "in": "in_",
+    "not_in": "not_in",
+    "like": "like",
+    "ilike": "ilike",
+    "not": "is_not",
+}
+
+INTEGER_RANGES = {
+    SmallInteger: (-2 ** 15, 2 ** 15 - 1),
+    BigInteger: (-2 ** 63, 2 ** 63 - 1),
+    Integer: (-2 ** 31, 2 ** 31 - 1),
+}
+
+
+def like_value(value: str) -> str:
+    # Same as fastapi-filter: without an explicit % the value is matched anywhere
+    return value if "%" in value else f"%{value}%"
+
+
+class FilterPlan:
+    """
+    WHERE/ORDER BY template for one shape of a filter: which fields are set (and with which operators) and the
+    ordering. Values are bound parameters, so every request with the same shape reuses the same clauses and
+    SQLAlchemy's compiled SQL.
+    """
+
+    def __init__(self, clauses: list, converters: dict[str, Any], ordering: list, joins: list):
+        self.clauses = clauses
+        self.converters = converters
+        self.ordering = ordering
+        self.joins = joins
+
+    def get_params(self, query: Filter) -> dict[str, Any]:
+        return {name: convert(getattr(query, name)) for name, convert in self.converters.items()}
+
+    def apply(self, row_filter: Query, query: Filter, sort: bool = True) -> Query:
+        for join in self.joins:
+            row_filter = row_filter.join(join)
+        if self.clauses:
+            row_filter = row_filter.filter(*self.clauses).params(**self.get_params(query))
+        if sort and self.ordering:
+            row_filter = row_filter.order_by(*self.ordering)
+        return row_filter
+
+
+def get_filter_shape(query: Filter) -> tuple:
+    """
+    Key of the plan of `query`: its set fields and ordering. isnull keeps its value, it changes the SQL, and so do
+    enum values: they are few and written in the SQL, so partial indexes on them (e.g. pending orders) can match.
+    """
+    fields = []
+    for field_name, value in query.filtering_fields:
+        if isinstance(getattr(query, field_name), Filter):
+            raise InvalidFilter(f"{field_name}: nested filters are not supported")
+        keep = field_name.endswith("__isnull") or isinstance(value, Enum)
+        fields.append((field_name, value) if keep else (field_name, None))
+    # Filters without an order_by field (e.g. of aggregates) have no ordering
+    ordering = query.ordering_values if query.Constants.ordering_field_name in type(query).model_fields else None
+    return tuple(fields), tuple(ordering or ())
+
+
+def resolve_column(db_model, joins: list, name: str):
+    """Column `name` of the model, else of the joined entities. Returns it with whether the joins are needed."""
+    if name in sa_inspect(db_model).column_attrs:
+        return getattr(db_model, name), False
+    for entity in joins:
+        if name in sa_inspect(entity).column_attrs:
+            return getattr(entity, name), True
+    raise InvalidFilter(f"{name} is not a valid filtering field")
+
+
+def check_range(column, name: str):
+    # Out of range integers are rejected here instead of failing in the database
+    for column_type, (minimum, maximum) in INTEGER_RANGES.items():
+        if isinstance(column.type, column_type):
+            def check(value):
+                for item in value if isinstance(value, list) else [value]:
+                    if isinstance(item, int) and not minimum <= item <= maximum:
+                        raise InvalidFilter(f"{name}: {item} is out of range")
+                return value
+            return check
+    return lambda value: value
+
+
+def compile_filter_plan(filter_class: type[Filter], db_model, joins: list, shape: tuple) -> FilterPlan:
+    fields, ordering_values = shape
+    clauses, converters, needs_joins = [], {}, False
+
+    for field_name, value in fields:
+        name, _, operator = field_name.partition("__")
+        if name == filter_class.Constants.search_field_name and hasattr(filter_class.Constants, "search_model_fields"):
+            columns = []
+            for search_field in filter_class.Constants.search_model_fields:
+                column, joined = resolve_column(db_model, joins, search_field)
+                needs_joins |= joined
+                columns.append(column)
+            clauses.append(or_(*[column.ilike(bindparam(field_name)) for column in columns]))
+            converters[field_name] = lambda search: f"%{search}%"
+            continue
+
+        column, joined = resolve_column(db_model, joins, name)
+        needs_joins |= joined
+        operator = operator or "eq"
+        if operator == "isnull":
+            clauses.append(column.is_(None) if value else column.is_not(None))
+            continue
+        if operator not in OPERATORS:
+            raise InvalidFilter(f"{field_name}: unknown operator {operator}")
+        if isinstance(value, Enum):
+            clauses.append(getattr(column, OPERATORS[operator])(literal(value.value, literal_execute=True)))
+            continue
+
+        expanding = operator in ("in", "not_in")
+        clauses.append(getattr(column, OPERATORS[operator])(bindparam(field_name, expanding=expanding)))
+        converters[field_name] = like_value if operator in ("like", "ilike") else check_range(column, field_name)
+
+    ordering = []
+    for field_name in ordering_values:
+        column, joined = resolve_column(db_model, joins, field_name.replace("-", "").replace("+", ""))
+        needs_joins |= joined
+        ordering.append(column.desc() if field_name.startswith("-") else column.asc())
+
+    return FilterPlan(clauses, converters, ordering, joins if needs_joins else [])
@@ -0,0 +1,266 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from sqlalchemy import delete, null, select
+from sqlalchemy.orm import Session
+
+from db import models
+from db.session import LazySession
+from utils.config import get_settings
+from utils.logs import get_logger
+from .analytics import UPSERTS
+from .base import run_sync
+
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different request."""
+
+
+class StoredResponse(NamedTuple):
+    # Of the request that produced the response, a replay must match it
+    fingerprint: str
+    # JSON-able
+    content: Any
+
+
+# Expired rows of DatabaseIdempotencyStore are deleted once every this many responses stored by the worker
+PURGE_EVERY = 1000
+# Seconds between two looks at a key claimed by another worker, doubled up to the maximum
+CLAIM_POLL = 0.05
+MAXIMUM_CLAIM_POLL = 1.0
+
+
+class IdempotencyStore(ABC):
+    """Completed responses by idempotency key, see MemoryIdempotencyStore and DatabaseIdempotencyStore."""
+
+    @abstractmethod
+    async def claim(self, key: str, fingerprint: str) -> StoredResponse | None:
+        """
+        Stored response of the key, else None once the caller holds the key: it must then `set` its response or
+        `release` the key.
+        """
+
+    @abstractmethod
+    async def set(self, key: str, response: StoredResponse):
+        ...
+
+    @abstractmethod
+    async def release(self, key: str):
+        """Gives up the claim of a request that failed, so it can be retried."""
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """
+    Bounded LRU, each response living at most `ttl` seconds. Must be used from the event loop. Claims are not kept,
+    the requests of a worker are coalesced by IdempotentRunner already.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, StoredResponse]] = OrderedDict()
+
+    async def claim(self, key: str, fingerprint: str) -> StoredResponse | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    async def set(self, key: str, response: StoredResponse):
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def release(self, key: str):
+        pass
+
+
+class DatabaseIdempotencyStore(IdempotencyStore):
+    """
+    Responses kept in the idempotent_responses table, shared by every worker, each living at most `ttl` seconds.
+    Expired rows are never returned and are deleted every PURGE_EVERY responses stored.
+
+    A key is claimed by inserting its row without content before running the request, and the duplicates sent to other
+    workers wait for the content. A claim lasts `claim_timeout` seconds, after that (e.g. the worker died) a duplicate
+    takes the key over and runs again.
+    """
+
+    def __init__(self, session_factory: Callable, ttl: float, claim_timeout: float):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.claim_timeout = claim_timeout
+        self._stored = 0
+
+    def _claim(self, db: Session, key: str, fingerprint: str) -> tuple[bool, StoredResponse | None]:
+        """Whether the key was claimed, else its row (None when there is none left)."""
+        db_model = models.IdempotentResponse
+        now = datetime.now(timezone.utc)
+        values = {"fingerprint": fingerprint, "content": null(),
+                  "expires_at": now + timedelta(seconds=self.claim_timeout)}
+        # A row left expired, claimed or completed, is taken over
+        statement = UPSERTS[db.get_bind().dialect.name](db_model).values(key=key, **values)
+        statement = statement.on_conflict_do_update(index_elements=[db_model.key], set_=values,
+                                                    where=db_model.expires_at <= now)
+        claimed = db.execute(statement.returning(db_model.key)).first() is not None
+        row = None
+        if not claimed:
+            row = db.execute(select(db_model.fingerprint, db_model.content).where(db_model.key == key)).first()
+        db.commit()
+        return claimed, row and StoredResponse(row.fingerprint, row.content)
+
+    def _set(self, db: Session, key: str, response: StoredResponse, purge: bool):
+        db_model = models.IdempotentResponse
+        now = datetime.now(timezone.utc)
+        if purge:
+            db.execute(delete(db_model).where(db_model.expires_at <= now))
+        # An expired row left for the key is replaced
+        values = {"fingerprint": response.fingerprint, "content": response.content,
+                  "expires_at": now + timedelta(seconds=self.ttl)}
+        statement = UPSERTS[db.get_bind().dialect.name](db_model).values(key=key, **values)
+        db.execute(statement.on_conflict_do_update(index_elements=[db_model.key], set_=values))
+        db.commit()
+
+    def _release(self, db: Session, key: str):
+        db_model = models.IdempotentResponse
+        db.execute(delete(db_model).where(db_model.key == key, db_model.content.is_(None)))
+        db.commit()
+
+    async def claim(self, key: str, fingerprint: str) -> StoredResponse | None:
+        poll = CLAIM_POLL
+        while True:
+            db = LazySession(self.session_factory)
+            try:
+                claimed, stored = await run_sync(db, self._claim, key, fingerprint)
+            finally:
+                await db.aclose()
+            if claimed:
+                return None
+            if stored is not None:
+                if stored.content is not None:
+                    return stored
+                if stored.fingerprint != fingerprint:
+                    raise IdempotencyConflict()
+            # Running in another worker (or released meanwhile)
+            await asyncio.sleep(poll)
+            poll = min(2 * poll, MAXIMUM_CLAIM_POLL)
+
+    async def set(self, key: str, response: StoredResponse):
+        self._stored += 1
+        db = LazySession(self.session_factory)
+        try:
+            await run_sync(db, self._set, key, response, self._stored % PURGE_EVERY == 0)
+        finally:
+            await db.aclose()
+
+    async def release(self, key: str):
+        db = LazySession(self.session_factory)
+        try:
+            await run_sync(db, self._release, key)
+        finally:
+            await db.aclose()
+
+
+class IdempotentRunner:
+    """
+    Runs each idempotency key once: a replay gets the stored response, and duplicates arriving while the first is
+    running wait for its outcome (errors included) instead of running again. Only successes are stored, a failed
+    request can be retried with the same key.
+
+    Running requests are coalesced per worker process. Duplicates sent to other workers wait on the claim of the key
+    in the store when it is shared by the workers (DatabaseIdempotencyStore), with MemoryIdempotencyStore they run
+    again.
+
+    Once the request ran, its result is returned even if the store fails to keep it (logged): it is committed, an error
+    would have the client retry it. The claim is then left to expire.
+    """
+
+    def __init__(self, store: IdempotencyStore):
+        self.store = store
+        self._running: dict[str, tuple[str, asyncio.Future]] = {}
+        self.executions = 0
+        self.replays = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, fingerprint: str, execute: Callable[[], Awaitable[Any]],
+                  encode: Callable[[Any], Any], decode: Callable[[Any], Any]) -> tuple[Any, bool]:
+        """
+        Result of `execute` for `key` and whether it is a replay. `encode`/`decode` turn the result into the
+        JSON-able content kept by the store and back.
+        """
+        while True:
+            running = self._running.get(key)
+            if running is None:
+                break
+            running_fingerprint, future = running
+            if running_fingerprint != fingerprint:
+                raise IdempotencyConflict()
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The first one was cancelled (e.g. its client left), one of the waiting ones runs it
+                continue
+            self.coalesced += 1
+            return result, True
+
+        # Registered before looking the store up, duplicates arriving meanwhile wait for this one
+        future = asyncio.get_running_loop().create_future()
+        self._running[key] = (fingerprint, future)
+        try:
+            stored = await self.store.claim(key, fingerprint)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    raise IdempotencyConflict()
+                self.replays += 1
+                result, replayed = decode(stored.content), True
+            else:
+                self.executions += 1
+                try:
+                    result, replayed = await execute(), False
+                except Exception:
+                    await self._release(key)
+                    raise
+                await self._store(key, StoredResponse(fingerprint, encode(result)))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Retrieved, nobody may be waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, replayed
+        finally:
+            del self._running[key]
+
+    async def _store(self, key: str, response: StoredResponse):
+        try:
+            await self.store.set(key, response)
+        except Exception as e:
+            logger.error(f"Could not store the response of idempotency key {key} {e}")
+
+    async def _release(self, key: str):
+        try:
+            await self.store.release(key)
+        except Exception as e:
+            logger.error(f"Could not release idempotency key {key} {e}")
+
+
+idempotency = IdempotentRunner(MemoryIdempotencyStore(settings.idempotency.max_size, settings.idempotency.ttl))
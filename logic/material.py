@@ -7,4 +7,4 @@ class MaterialCRUD(CRUD):
     pass
 
 
-MaterialLogic = MaterialCRUD(db_model=models.Material, model=Material, filter_model=MaterialFilter)
+MaterialLogic = MaterialCRUD(db_model=models.Material, model=Material, filter_model=MaterialFilter, cache=True)
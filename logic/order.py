@@ -1,10 +1,17 @@
-from typing import Any
+from typing import Any, AsyncIterator, Callable, Mapping, NamedTuple, Sequence
 from datetime import datetime, timezone
-from sqlalchemy.orm import Session
+from sqlalchemy import BigInteger, Row, Text, and_, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 from db import models
-from .base import CRUD
-from schemas.order import Order, OrderFilter
+from db.session import LazySession
+from .analytics import MaterialUsageLogic, get_order_key, select_operator_area
+from .base import CRUD, run_sync
+from .cache import INVALIDATES
+from .events import EventBus
+from schemas.order import Order, OrderEvent, OrderFilter
+from utils.enums import OrderStates
 
 
 def to_utc(dt: datetime) -> datetime:
@@ -13,23 +20,339 @@ def to_utc(dt: datetime) -> datetime:
     return dt
 
 
+class StateTransition(NamedTuple):
+    target: OrderStates
+    # States the order can move to `target` from
+    sources: frozenset[OrderStates]
+    # States where the transition is considered already done
+    done: frozenset[OrderStates]
+
+
+def get_transition(target: OrderStates, done: set[OrderStates], refused: set[OrderStates]) -> StateTransition:
+    # Every state that is neither done nor refused can move to target
+    return StateTransition(target, frozenset(set(OrderStates) - done - refused), frozenset(done))
+
+
+CANCELED_STATES = {OrderStates.CANCELED_BY_OPERATOR, OrderStates.CANCELED_NO_MATERIAL}
+# States no transition leaves for an open one
+CLOSED_STATES = {OrderStates.CONFIRMED, *CANCELED_STATES}
+
+ORDER_TRANSITIONS: dict[OrderStates, StateTransition] = {
+    OrderStates.CONFIRMED: get_transition(OrderStates.CONFIRMED, done={OrderStates.CONFIRMED},
+                                          refused=CANCELED_STATES),
+    OrderStates.DELIVERED: get_transition(OrderStates.DELIVERED, done={OrderStates.CONFIRMED, OrderStates.DELIVERED},
+                                          refused=CANCELED_STATES),
+    OrderStates.CANCELED_BY_OPERATOR: get_transition(OrderStates.CANCELED_BY_OPERATOR, done=CANCELED_STATES,
+                                                     refused={OrderStates.DELIVERED}),
+    OrderStates.CANCELED_NO_MATERIAL: get_transition(OrderStates.CANCELED_NO_MATERIAL, done=CANCELED_STATES,
+                                                     refused={OrderStates.DELIVERED}),
+}
+
+ORDER_CREATED = "order_created"
+ORDER_STATE_CHANGED = "order_state_changed"
+
+# Topic of every order, the (attribute, user id) topics only get the orders of that operator/forklift
+ALL_ORDERS = "orders"
+ORDER_OWNER_ATTRIBUTES = ("id_operator", "id_forklift")
+
+order_events = EventBus()
+# Called with every event and its order before it is published, e.g. to keep in-memory state up to date
+order_listeners: list[Callable[[str, Order], None]] = []
+
+
+def get_order_topics(order: Order) -> list:
+    return [ALL_ORDERS, *((attr, getattr(order, attr)) for attr in ORDER_OWNER_ATTRIBUTES)]
+
+
+def publish_order_event(event: str, order: Order):
+    for listener in order_listeners:
+        listener(event, order)
+    # Serialized once, whatever the number of subscribers
+    order_events.publish(get_order_topics(order), OrderEvent(event=event, order=order).model_dump_json())
+
+
+# Id of the OrderVersion row
+ORDER_VERSION_ID = 1
+
+
+def get_version_base():
+    return func.coalesce(select(models.OrderVersion.base)
+                         .where(models.OrderVersion.id == ORDER_VERSION_ID)
+                         .scalar_subquery(), 0)
+
+
+def xid_to_bigint(xid: Any):
+    return xid.cast(Text).cast(BigInteger)
+
+
+def get_version_after_last():
+    # Aliased, not correlated with the order being written
+    orders = models.Order.__table__.alias()
+    return select(func.coalesce(func.max(orders.c.version), 0) + 1).scalar_subquery()
+
+
+# Version of the orders written by a statement, set by that same statement: no counter row is locked until the commit
+NEXT_VERSIONS = {
+    # The writing transaction: transactions running at once take different versions without waiting for each other
+    "postgresql": lambda: xid_to_bigint(func.pg_current_xact_id()) + get_version_base(),
+    # One writer at a time, versions are taken in commit order
+    "sqlite": get_version_after_last,
+}
+
+# Versions below it can be read: written by transactions that are over, no running or later one takes a lower one.
+# None when versions are taken in commit order
+VISIBLE_VERSIONS = {
+    "postgresql": lambda: xid_to_bigint(func.pg_snapshot_xmin(func.pg_current_snapshot())) + get_version_base(),
+    "sqlite": None,
+}
+
+
+def select_creation_datetime(order_id: int):
+    # From order_keys: the order is then read from the partition of its month alone, pruned when the statement runs
+    return select(models.OrderKey.creation_datetime).where(models.OrderKey.id == order_id).scalar_subquery()
+
+
+def get_order_id_key(order_id: int):
+    """Key condition of the order `order_id` when only its id is known."""
+    return get_order_key(order_id, select_creation_datetime(order_id))
+
+
+def change_state_returning(db: Session, model: Any, row_id: int, conditions: list, sources: frozenset[OrderStates],
+                           values: dict):
+    # Checked and changed by one statement, the state left is read from the row it locked. The conditions are repeated
+    # on the updated table so it is pruned to the partition of the order as well
+    old = select(model.id, model.creation_datetime, model.state).where(*conditions).with_for_update().subquery("old")
+    return db.execute(update(model)
+                      .where(*conditions, model.id == old.c.id, model.creation_datetime == old.c.creation_datetime,
+                             old.c.state.in_(sources))
+                      .values(**values)
+                      .returning(old.c.state, old.c.creation_datetime)
+                      .execution_options(**{INVALIDATES: [row_id]})).first()
+
+
+def change_state_after_read(db: Session, model: Any, row_id: int, conditions: list, sources: frozenset[OrderStates],
+                            values: dict):
+    # RETURNING cannot read the other tables of the statement: the state is read, then changed only if it still is
+    current = db.execute(select(model.state, model.creation_datetime).where(*conditions)).first()
+    if current is None or current.state not in sources:
+        return None
+    changed = db.execute(update(model)
+                         .where(model.id == row_id, model.creation_datetime == current.creation_datetime,
+                                model.state == current.state)
+                         .values(**values)
+                         .execution_options(**{INVALIDATES: [row_id]})).rowcount
+    return current if changed else None
+
+
+# Moves the order `row_id` matching `conditions` to `values` if its state is one of `sources`, returning the state it
+# left and its creation_datetime (None when it did not move)
+CHANGE_STATES = {
+    "postgresql": change_state_returning,
+    "sqlite": change_state_after_read,
+}
+
+# Columns of the order exports, a row per line: orders without lines get a single one with empty line columns
+EXPORT_COLUMNS = {
+    "id": models.Order.id,
+    "id_operator": models.Order.id_operator,
+    "id_forklift": models.Order.id_forklift,
+    "creation_datetime": models.Order.creation_datetime,
+    "estimate_datetime": models.Order.estimate_datetime,
+    "order_datetime": models.Order.order_datetime,
+    "state": models.Order.state,
+    "canceled": models.Order.canceled,
+    "version": models.Order.version,
+    "id_material": models.MaterialByOrder.id_material,
+    "material_name": models.Material.name,
+    "material_unit": models.Material.unit,
+    "quantity": models.MaterialByOrder.quantity,
+}
+
+SINGLE_ORDER_OPTIONS = [
+    joinedload(models.Order.materials_order).joinedload(models.MaterialByOrder.material),
+    joinedload(models.Order.operator).joinedload(models.User.roles),
+    joinedload(models.Order.forklift).joinedload(models.User.roles),
+]
+
+
 class OrderCRUD(CRUD):
-    async def parse(self, row: Any):
-        row.estimate_datetime = to_utc(row.estimate_datetime)
-        row.creation_datetime = to_utc(row.creation_datetime)
-        return await super().parse(row)
+    def parse_data(self, row: Any, fields: tuple[str, ...] | None = None) -> dict:
+        data = super().parse_data(row, fields)
+        for field in ("estimate_datetime", "creation_datetime"):
+            if field in data:
+                data[field] = to_utc(data[field])
+        return data
 
-    async def create(self, db: Session, data_in: dict):
+    def _get_by_id(self, db: Session, row_id: int, creation_datetime: datetime | None = None):
+        # A single order is read in one statement, its lines and users joined instead of selectin loaded
+        condition = get_order_id_key(row_id) if creation_datetime is None \
+            else get_order_key(row_id, creation_datetime)
+        return self.parse(db.query(self.db_model).options(*SINGLE_ORDER_OPTIONS).filter(condition).first())
+
+    @staticmethod
+    def _next_version(db: Session):
+        return NEXT_VERSIONS[db.get_bind().dialect.name]()
+
+    def _init_version(self, db: Session):
+        # Databases built without the migrations, which create the row
+        if db.get(models.OrderVersion, ORDER_VERSION_ID) is None:
+            db.execute(insert(models.OrderVersion).values(id=ORDER_VERSION_ID, base=0))
+        db.commit()
+
+    def _get_changes(self, db: Session, since: int, owner: Mapping[str, Any], limit: int = 100):
+        conditions = [self.db_model.version > since]
+        visible_versions = VISIBLE_VERSIONS[db.get_bind().dialect.name]
+        if visible_versions:
+            # A version taken by a transaction still running is held back with every higher one, a client that read
+            # version N never misses a lower one committed later
+            conditions.append(self.db_model.version < visible_versions())
+        if owner:
+            conditions.append(or_(*(getattr(self.db_model, attr) == value for attr, value in owner.items())))
+        rows = self.query_rows(db).filter(*conditions) \
+            .order_by(self.db_model.version, self.db_model.id).limit(limit + 1).all()
+        if len(rows) <= limit:
+            return [self.parse(row) for row in rows], False
+
+        # The orders written by one transaction share its version: a page ends with all of them, the next one starts
+        # after that version
+        left_out = rows[limit].version
+        page = [row for row in rows[:limit] if row.version != left_out]
+        if not page:
+            # More than a page in a single transaction, all of them
+            page = self.query_rows(db).filter(*conditions[1:], self.db_model.version == left_out) \
+                .order_by(self.db_model.id).all()
+        return [self.parse(row) for row in page], True
+
+    def _create(self, db: Session, data_in: dict):
+        # Order and lines in one transaction, nothing is left half written if a line is rejected
         materials_order = data_in.pop("materials_order")
-        order = await super().create(db, data_in)
+        data_in["version"] = self._next_version(db)
+        data_in["area"] = select_operator_area(data_in["id_operator"])
+        order_id = db.scalars(insert(self.db_model).values(**data_in).returning(self.db_model.id)).one()
+        db.execute(insert(models.OrderKey).values(id=order_id, creation_datetime=data_in["creation_datetime"]))
+        if materials_order:
+            # executemany, batched into multi-row VALUES by the driver
+            db.execute(insert(models.MaterialByOrder), [
+                {"id_order": order_id, "creation_datetime": data_in["creation_datetime"],
+                 "id_material": line["id_material"], "quantity": line["quantity"]}
+                for line in materials_order
+            ])
+            MaterialUsageLogic._add_order_usage(db, order_id, data_in["creation_datetime"])
+        created = self._get_by_id(db, order_id, data_in["creation_datetime"])
+        db.commit()
+        return created
+
+    def _rewrite(self, db: Session, row_id: int, creation_datetime: datetime, values: dict):
+        # With the order row locked: its usage is removed as the order was and added back as it is now
+        MaterialUsageLogic._add_order_usage(db, row_id, creation_datetime, -1)
+        db.execute(update(self.db_model)
+                   .where(get_order_key(row_id, creation_datetime))
+                   .values(**values)
+                   .execution_options(**{INVALIDATES: [row_id]}))
+        MaterialUsageLogic._add_order_usage(db, row_id, creation_datetime)
+        return self._get_by_id(db, row_id, creation_datetime)
+
+    def _change_state(self, db: Session, row_id: int, state: OrderStates, attributes: Mapping[str, Any]):
+        transition = ORDER_TRANSITIONS[state]
+        conditions = [get_order_id_key(row_id)]
+        conditions += [getattr(self.db_model, attr) == value for attr, value in attributes.items()]
+
+        values = {"state": transition.target, "version": self._next_version(db)}
+        left = CHANGE_STATES[db.get_bind().dialect.name](db, self.db_model, row_id, conditions, transition.sources,
+                                                         values)
+        if left is None:
+            # The current state tells why, None if the order does not exist (or is not theirs)
+            current = db.scalars(select(self.db_model.state).where(*conditions)).first()
+            db.rollback()
+            return None, current and OrderStates(current)
+
+        MaterialUsageLogic._move_order_usage(db, row_id, left.creation_datetime, OrderStates(left.state),
+                                             transition.target)
+        changed = self._get_by_id(db, row_id, left.creation_datetime)
+        db.commit()
+        return changed, OrderStates(left.state)
+
+    def _update(self, db: Session, row_id: int, data_changes: dict):
+        if not data_changes:
+            return self._get_by_id(db, row_id)
+        creation_datetime = db.scalars(select(self.db_model.creation_datetime)
+                                       .where(get_order_id_key(row_id)).with_for_update()).first()
+        if creation_datetime is None:
+            db.rollback()
+            return None
+
+        values = {**data_changes, "version": self._next_version(db)}
+        if "id_operator" in data_changes:
+            values["area"] = select_operator_area(data_changes["id_operator"])
+        updated = self._rewrite(db, row_id, creation_datetime, values)
+        db.commit()
+        return updated
+
+    def select_export(self, query: OrderFilter):
+        line = models.MaterialByOrder
+        statement = select(*EXPORT_COLUMNS.values()) \
+            .select_from(self.db_model) \
+            .outerjoin(line, and_(line.id_order == self.db_model.id,
+                                  line.creation_datetime == self.db_model.creation_datetime)) \
+            .outerjoin(models.Material, models.Material.id == line.id_material)
+        # The lines of an order follow each other whatever the ordering of the filter
+        return self.get_filter_plan(query).apply(statement, query).order_by(self.db_model.id)
+
+    async def export_rows(self, db: Session, query: OrderFilter,
+                          batch_size: int = 1000) -> AsyncIterator[Sequence[Row]]:
+        """
+        Rows of EXPORT_COLUMNS of the orders matching `query`, in batches read from a server side cursor: memory stays
+        the same whatever the number of orders. The connection is held until the last batch is read.
+        """
+        session = db.session if isinstance(db, LazySession) else db
+        statement = self.select_export(query).execution_options(yield_per=batch_size)
+        try:
+            if isinstance(session, AsyncSession):
+                result = await session.stream(statement)
+                async for rows in result.partitions():
+                    yield rows
+            else:
+                for rows in session.execute(statement).partitions():
+                    yield rows
+        except Exception:
+            if isinstance(db, LazySession):
+                await db.release(failed=True)
+            raise
+        if isinstance(db, LazySession):
+            await db.release()
+
+    async def init_version(self, db: Session):
+        return await run_sync(db, self._init_version)
+
+    async def get_changes(self, db: Session, since: int, owner: Mapping[str, Any] | None = None, limit: int = 100):
+        """
+        Orders created or changed after version `since`, oldest change first, optionally only those of any of the
+        `owner` attributes (e.g. their operator or forklift). Returns them and whether more changes are left.
+        """
+        return await run_sync(db, self._get_changes, since, owner or {}, limit)
+
+    async def create(self, db: Session, data_in: dict):
+        created = await super().create(db, data_in)
+        publish_order_event(ORDER_CREATED, created)
+        return created
 
-        for material_order in materials_order:
-            row = models.MaterialByOrder(id_order=order.id, id_material=material_order.get("id_material"),
-                                         quantity=material_order.get("quantity"))
-            db.add(row)
-            db.commit()
+    async def change_state(self, db: Session, row_id: int, state: OrderStates,
+                           attributes: Mapping[str, Any] | None = None):
+        """
+        Moves the order to `state` if ORDER_TRANSITIONS allows it from its current one, optionally only when it
+        matches `attributes` (e.g. its operator).
 
-        return await self.get_by_id(db, order.id)
+        Returns the updated order and the state it left, or None and the state that refused the change (None if the
+        order was not found).
+        """
+        changed, current = await run_sync(db, self._change_state, row_id, state, attributes or {})
+        if changed:
+            publish_order_event(ORDER_STATE_CHANGED, changed)
+        return changed, current
 
 
-OrderLogic = OrderCRUD(db_model=models.Order, model=Order, filter_model=OrderFilter)
+OrderLogic = OrderCRUD(db_model=models.Order, model=Order, filter_model=OrderFilter, load_options={
+    "materials_order": selectinload(models.Order.materials_order).joinedload(models.MaterialByOrder.material),
+    "operator": joinedload(models.Order.operator).selectinload(models.User.roles),
+    "forklift": joinedload(models.Order.forklift).selectinload(models.User.roles),
+})
@@ -0,0 +1,211 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Callable, Mapping
+
+from sqlalchemy import case, func, insert, select
+from sqlalchemy.orm import Session
+
+from db import models
+from db.session import LazySession
+from schemas.analytics import LatencyStats, OrderLatency
+from schemas.order import OrderTransition
+from utils.config import get_settings
+from utils.enums import OrderStates
+from utils.logs import get_logger
+from .base import CRUD, run_sync
+from .order import get_order_id_key, to_utc
+
+
+logger = get_logger(__name__)
+
+settings = get_settings()
+
+# Seconds from start to end of each database
+SECONDS_BETWEEN = {
+    "postgresql": lambda start, end: func.extract("epoch", end - start),
+    "sqlite": lambda start, end: (func.julianday(end) - func.julianday(start)) * 86400,
+}
+
+# Latency stages: the state the order entered first and the one it entered next
+LATENCY_STAGES = {
+    "delivery": (OrderStates.PENDING, OrderStates.DELIVERED),
+    "confirmation": (OrderStates.DELIVERED, OrderStates.CONFIRMED),
+    "total": (OrderStates.PENDING, OrderStates.CONFIRMED),
+}
+
+
+class BatchWriter:
+    """
+    Inserts the rows appended to `db_model` from a background task, in batches: once `batch_size` rows are waiting
+    or `flush_seconds` after the first of them, whichever comes first. Appending never touches the database.
+
+    A batch that fails is kept and tried again after `flush_seconds`, up to `maximum_pending` rows are kept and newer
+    ones are dropped. Rows still waiting are written on stop, and lost if the process dies. Rows appended before start
+    are kept for it, with a warning: a writer that is never started only fills up.
+    """
+
+    def __init__(self, db_model, batch_size: int, flush_seconds: float, maximum_pending: int):
+        self.db_model = db_model
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.maximum_pending = maximum_pending
+        self.rows: list[dict] = []
+        self.written = 0
+        self.dropped = 0
+        # Created by start, in the event loop of the task
+        self._pending: asyncio.Event | None = None
+        self._full: asyncio.Event | None = None
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+        self._session_factory: Callable | None = None
+
+    def append(self, row: dict):
+        if len(self.rows) >= self.maximum_pending:
+            if not self.dropped:
+                logger.error(f"{self.db_model.__tablename__} writer is {self.maximum_pending} rows behind, "
+                             f"dropping rows")
+            self.dropped += 1
+            return
+        self.rows.append(row)
+        if self._task is None:
+            if len(self.rows) == 1:
+                logger.warning(f"{self.db_model.__tablename__} writer is not started, rows are kept until it is")
+            return
+        self._pending.set()
+        if len(self.rows) >= self.batch_size:
+            self._full.set()
+
+    def _write(self, db: Session, rows: list[dict]):
+        # executemany, batched into multi-row VALUES by the driver
+        db.execute(insert(self.db_model), rows)
+
+    async def flush(self):
+        self._pending.clear()
+        self._full.clear()
+        while self.rows:
+            rows, self.rows = self.rows[:self.batch_size], self.rows[self.batch_size:]
+            db = LazySession(self._session_factory)
+            try:
+                await run_sync(db, self._write, rows)
+            except Exception as e:
+                logger.error(f"Could not write {len(rows)} {self.db_model.__tablename__} rows {e}")
+                self.rows[:0] = rows
+                self._pending.set()
+                return
+            finally:
+                await db.aclose()
+            self.written += len(rows)
+
+    async def _run(self):
+        while not self._stopping:
+            await self._pending.wait()
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_seconds)
+                except TimeoutError:
+                    pass
+            await self.flush()
+        # Appended between the last flush and stop
+        await self.flush()
+
+    def start(self, session_factory: Callable):
+        self._session_factory = session_factory
+        self._pending, self._full = asyncio.Event(), asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        if self.rows:
+            self._pending.set()
+
+    async def stop(self):
+        """Writes the rows still waiting and ends the task."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._pending.set()
+        self._full.set()
+        await self._task
+        self._task = None
+        if self.rows:
+            logger.error(f"{len(self.rows)} {self.db_model.__tablename__} rows could not be written")
+
+
+order_log_writer = BatchWriter(models.OrderTransition, batch_size=settings.order_log.batch_size,
+                               flush_seconds=settings.order_log.flush_milliseconds / 1000,
+                               maximum_pending=settings.order_log.maximum_pending)
+
+
+def log_order_transition(id_order: int, from_state: OrderStates | None, to_state: OrderStates,
+                         id_actor: int | None):
+    """Queues the transition for order_log_writer, timestamped now."""
+    order_log_writer.append({"id_order": id_order, "from_state": from_state and from_state.value,
+                             "to_state": to_state.value, "id_actor": id_actor, "ts": datetime.now(timezone.utc)})
+
+
+class OrderTransitionCRUD(CRUD):
+    def parse_data(self, row: Any, fields: tuple[str, ...] | None = None) -> dict:
+        data = super().parse_data(row, fields)
+        if "ts" in data:
+            data["ts"] = to_utc(data["ts"])
+        return data
+
+    def _get_timeline(self, db: Session, order_id: int, owner: Mapping[str, Any]):
+        order = models.Order
+        conditions = [get_order_id_key(order_id), *(getattr(order, attr) == value for attr, value in owner.items())]
+        if db.scalar(select(order.id).where(*conditions)) is None:
+            return None
+        rows = db.scalars(select(self.db_model)
+                          .where(self.db_model.id_order == order_id)
+                          .order_by(self.db_model.ts, self.db_model.id)).all()
+        return [self.parse(row) for row in rows]
+
+    def _get_latency(self, db: Session, since: datetime, until: datetime, id_forklift: int | None = None):
+        order, log = models.Order, self.db_model
+        dialect = db.get_bind().dialect.name
+
+        def entered(state: OrderStates):
+            return func.min(case((log.to_state == state.value, log.ts)))
+
+        # Orders created before the log have no creation row, their creation_datetime stands in
+        conditions = [order.creation_datetime >= since, order.creation_datetime < until]
+        if id_forklift is not None:
+            conditions.append(order.id_forklift == id_forklift)
+        per_order = select(func.coalesce(entered(OrderStates.PENDING), order.creation_datetime)
+                           .label(OrderStates.PENDING.value),
+                           entered(OrderStates.DELIVERED).label(OrderStates.DELIVERED.value),
+                           entered(OrderStates.CONFIRMED).label(OrderStates.CONFIRMED.value)) \
+            .select_from(order) \
+            .join(log, log.id_order == order.id) \
+            .where(*conditions) \
+            .group_by(order.id, order.creation_datetime) \
+            .subquery()
+
+        columns = []
+        for stage, (start, end) in LATENCY_STAGES.items():
+            seconds = SECONDS_BETWEEN[dialect](per_order.c[start.value], per_order.c[end.value])
+            columns += [func.count(seconds).label(f"{stage}_orders"),
+                        func.avg(seconds).label(f"{stage}_average_seconds"),
+                        func.min(seconds).label(f"{stage}_minimum_seconds"),
+                        func.max(seconds).label(f"{stage}_maximum_seconds")]
+            if dialect == "postgresql":
+                columns += [func.percentile_cont(0.5).within_group(seconds).label(f"{stage}_p50_seconds"),
+                            func.percentile_cont(0.95).within_group(seconds).label(f"{stage}_p95_seconds")]
+        row = db.execute(select(*columns)).one()._asdict()
+        return OrderLatency(**{
+            stage: LatencyStats(**{name.removeprefix(f"{stage}_"): value for name, value in row.items()
+                                   if name.startswith(f"{stage}_")})
+            for stage in LATENCY_STAGES
+        })
+
+    async def get_timeline(self, db: Session, order_id: int, owner: Mapping[str, Any] | None = None):
+        """
+        Transitions of the order, oldest first, or None when the order does not exist (or does not match `owner`).
+        The ones still waiting in order_log_writer are not there yet.
+        """
+        return await run_sync(db, self._get_timeline, order_id, owner or {})
+
+    async def get_latency(self, db: Session, since: datetime, until: datetime, id_forklift: int | None = None):
+        """Time orders created in [since, until) took through each of LATENCY_STAGES."""
+        return await run_sync(db, self._get_latency, since, until, id_forklift)
+
+
+OrderTransitionLogic = OrderTransitionCRUD(db_model=models.OrderTransition, model=OrderTransition, filter_model=None)
@@ -0,0 +1,130 @@
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from db import models
+from utils.config import get_settings
+from .base import run_sync
+from .order import CLOSED_STATES
+
+
+settings = get_settings()
+
+# Advisory lock held by the worker maintaining the partitions, the others skip their turn
+PARTITIONS_LOCK = 7340022
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class PartitionManager:
+    """
+    Monthly range partitions by creation_datetime of `tables`, the referenced one first, named <table>_<YYYY>_<MM>.
+    PostgreSQL only, databases whose first table is not partitioned are left alone.
+
+    Partitions are created `months_ahead` months in advance, an order whose month has no partition can't be inserted.
+    A month that ended `archive_after_months` ago is archived once all its orders are closed: its partitions are
+    detached and moved to `archive_schema`, out of every query on the tables, where they can be dumped and dropped.
+    The rows of `key_table`, if any, whose creation_datetime falls in an archived month are deleted with it.
+    """
+
+    def __init__(self, tables: list[str], months_ahead: int, archive_after_months: int | None, archive_schema: str,
+                 key_table: str | None = None):
+        self.tables = tables
+        self.key_table = key_table
+        self.months_ahead = months_ahead
+        self.archive_after_months = archive_after_months
+        self.archive_schema = archive_schema
+        self.name_pattern = re.compile(rf'{re.escape(tables[0])}_(\d{{4}})_(\d{{2}})')
+
+    @staticmethod
+    def get_partition_name(table: str, month: date) -> str:
+        return f'{table}_{month:%Y_%m}'
+
+    def _is_partitioned(self, db: Session) -> bool:
+        return db.scalar(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                              "WHERE partrelid = to_regclass(:table))"), {"table": self.tables[0]})
+
+    def _get_months(self, db: Session) -> list[date]:
+        names = db.scalars(text("SELECT child.relname FROM pg_inherits "
+                                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                                "WHERE pg_inherits.inhparent = to_regclass(:table)"), {"table": self.tables[0]})
+        matches = filter(None, map(self.name_pattern.fullmatch, names))
+        return sorted(date(int(match[1]), int(match[2]), 1) for match in matches)
+
+    def _create_partitions(self, db: Session, month: date) -> list[date]:
+        quote = db.get_bind().dialect.identifier_preparer.quote
+        existing = set(self._get_months(db))
+        created = []
+        for start in (add_months(month, i) for i in range(self.months_ahead + 1)):
+            if start in existing:
+                continue
+            for table in self.tables:
+                db.execute(text(f"CREATE TABLE IF NOT EXISTS {quote(self.get_partition_name(table, start))} "
+                                f"PARTITION OF {quote(table)} "
+                                f"FOR VALUES FROM ('{start}') TO ('{add_months(start, 1)}')"))
+            created.append(start)
+        return created
+
+    def _archive_partitions(self, db: Session, month: date) -> list[date]:
+        if self.archive_after_months is None:
+            return []
+        quote = db.get_bind().dialect.identifier_preparer.quote
+        horizon = add_months(month, -self.archive_after_months)
+        # Detaching locks the tables, give up until the next run rather than queueing every query behind it
+        db.execute(text("SET LOCAL lock_timeout = '5s'"))
+        db.execute(text(f"CREATE SCHEMA IF NOT EXISTS {quote(self.archive_schema)}"))
+        closed = [state.value for state in CLOSED_STATES]
+        archived = []
+        for start in self._get_months(db):
+            if add_months(start, 1) > horizon:
+                break
+            orders = quote(self.get_partition_name(self.tables[0], start))
+            if db.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {orders} WHERE state <> ALL(:closed))"),
+                         {"closed": closed}):
+                continue
+            # Referencing tables first, their detached partitions keep foreign keys to the referenced tables that
+            # would refuse to detach their partitions: those are dropped
+            for table in reversed(self.tables):
+                partition = quote(self.get_partition_name(table, start))
+                db.execute(text(f"ALTER TABLE {quote(table)} DETACH PARTITION {partition}"))
+                constraints = db.scalars(text("SELECT conname FROM pg_constraint "
+                                              "WHERE conrelid = to_regclass(:partition) AND contype = 'f' "
+                                              "AND confrelid::regclass::text = ANY(:tables)"),
+                                         {"partition": partition, "tables": self.tables}).all()
+                for constraint in constraints:
+                    db.execute(text(f"ALTER TABLE {partition} DROP CONSTRAINT {quote(constraint)}"))
+                db.execute(text(f"ALTER TABLE {partition} SET SCHEMA {quote(self.archive_schema)}"))
+            if self.key_table:
+                db.execute(text(f"DELETE FROM {quote(self.key_table)} "
+                                f"WHERE creation_datetime >= :start AND creation_datetime < :end"),
+                           {"start": start, "end": add_months(start, 1)})
+            archived.append(start)
+        return archived
+
+    def _maintain(self, db: Session, archive: bool, today: date | None = None) -> tuple[list[date], list[date]]:
+        if db.get_bind().dialect.name != 'postgresql' or not self._is_partitioned(db):
+            return [], []
+        if not db.scalar(select(func.pg_try_advisory_xact_lock(PARTITIONS_LOCK))):
+            return [], []
+        month = (today or datetime.now(timezone.utc).date()).replace(day=1)
+        created = self._create_partitions(db, month)
+        archived = self._archive_partitions(db, month) if archive else []
+        db.commit()
+        return created, archived
+
+    async def maintain(self, db: Session, archive: bool = True,
+                       today: date | None = None) -> tuple[list[date], list[date]]:
+        """Creates the partitions of the coming months and archives the closed old ones, returns both months."""
+        return await run_sync(db, self._maintain, archive, today)
+
+
+OrderPartitionLogic = PartitionManager([models.Order.__tablename__, models.MaterialByOrder.__tablename__],
+                                       months_ahead=settings.partitions.months_ahead,
+                                       archive_after_months=settings.partitions.archive_after_months,
+                                       archive_schema=settings.partitions.archive_schema,
+                                       key_table=models.OrderKey.__tablename__)
@@ -7,4 +7,4 @@ class RoleCRUD(CRUD):
     pass
 
 
-RoleLogic = RoleCRUD(db_model=models.Role, model=Role, filter_model=None)
+RoleLogic = RoleCRUD(db_model=models.Role, model=Role, filter_model=None, cache=True)
@@ -0,0 +1,232 @@
+from typing import Any, Mapping
+
+from sqlalchemy import and_, delete, insert, select, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session, contains_eager, joinedload, load_only, noload, selectinload
+from starlette.concurrency import run_in_threadpool
+
+from db import models
+from schemas.bulk import BulkError, BulkResult
+from schemas.user import ModifyUserByAdmin, PublicUser
+from utils.enums import UserRoles
+from utils.hash_helper import get_hash_passwords
+from .base import CRUD, run_sync
+from .cache import INVALIDATES
+from .user import UserLogic
+
+
+class ProtectedUserError(Exception):
+    """Super users can't be changed or removed through their role profile."""
+
+
+class RoleProfileCRUD(CRUD):
+    """
+    Shared logic of the role profiles (admins, operators, forklifts), rows keyed by the role_by_user id of their user.
+
+    Profiles are looked up by user id with a single statement joining role_by_user, the user and its roles.
+    """
+    role: UserRoles
+    profile_fields: list[str] = []
+    user_fields: list[str] = list(ModifyUserByAdmin.model_fields)
+    # Schema fields unpacked from role_user.user, `id` included
+    public_user_fields: frozenset[str] = frozenset(PublicUser.model_fields)
+
+    def __init__(self, db_model, model, filter_model, join=None, extra_fields=None, cache=False,
+                 cache_depends_on=('role_by_user', 'users', 'roles'), load_options=None):
+        if load_options is None:
+            # The schema unpacks role_user.user and its roles
+            load_options = {"role_user": joinedload(db_model.role_user).joinedload(models.RoleByUser.user)
+                            .selectinload(models.User.roles)}
+        if join is None:
+            # User fields of the filters (username) resolve through role_by_user
+            join = [models.RoleByUser, models.User]
+        super().__init__(db_model, model, filter_model, join=join, extra_fields=['role_user', *(extra_fields or [])],
+                         cache=cache, cache_depends_on=cache_depends_on, load_options=load_options)
+
+    def get_load_options(self, fields: tuple[str, ...] | None = None) -> list:
+        if fields is None:
+            return super().get_load_options()
+
+        user_names = [name for name in fields if name in self.public_user_fields]
+        profile_columns = [getattr(self.db_model, name) for name in fields
+                           if name not in self.public_user_fields and name != 'id']
+        options = [load_only(self.db_model.id, *profile_columns)]
+        if not user_names:
+            options.append(noload(self.db_model.role_user))
+            return options
+
+        user_columns = [getattr(models.User, name) for name in user_names if name not in ('id', 'roles')]
+        user_options = [load_only(models.User.id, *user_columns)]
+        if 'roles' in user_names:
+            user_options.append(selectinload(models.User.roles))
+        options.append(joinedload(self.db_model.role_user).options(
+            load_only(models.RoleByUser.id_user),
+            joinedload(models.RoleByUser.user).options(*user_options)
+        ))
+        return options
+
+    def parse_data(self, row: Any, fields: tuple[str, ...] | None = None) -> dict:
+        if fields is None:
+            return super().parse_data(row)
+        data = {}
+        for field in fields:
+            source = row.role_user.user if field in self.public_user_fields else row
+            data[field] = getattr(source, field)
+        return data
+
+    @classmethod
+    def get_profile_data(cls, complete_data: dict) -> dict:
+        profile_data = {}
+        for field in cls.profile_fields:
+            data = complete_data.get(field, None)
+            if data:
+                profile_data[field] = data
+        return profile_data
+
+    @classmethod
+    def get_user_data(cls, complete_data: dict) -> dict:
+        return {field: complete_data[field] for field in cls.user_fields if complete_data.get(field) is not None}
+
+    def _get_row_by_user_id(self, db: Session, user_id: int):
+        statement = select(self.db_model) \
+            .join(self.db_model.role_user) \
+            .where(and_(models.RoleByUser.id_user == user_id, models.RoleByUser.id_role == self.role)) \
+            .options(contains_eager(self.db_model.role_user)
+                     .joinedload(models.RoleByUser.user)
+                     .joinedload(models.User.roles))
+        return db.scalars(statement).unique().first()
+
+    def _get_by_user_id(self, db: Session, user_id: int):
+        return self.parse(self._get_row_by_user_id(db, user_id))
+
+    def _create(self, db: Session, data_in: dict):
+        extra_data = {"id_role": self.role, "id_user": data_in["user_id"]}
+        # Same transaction as the profile row, committed by CRUD._create
+        role_user_id = db.scalars(insert(models.RoleByUser).values(**extra_data).returning(models.RoleByUser.id)).one()
+        return super()._create(db, {"id": role_user_id, **self.get_profile_data(data_in)})
+
+    def _update_by_user_id(self, db: Session, user_id: int, data_changes: dict):
+        row = self._get_row_by_user_id(db, user_id)
+        if not row:
+            return None
+        user = row.role_user.user
+        if user.isSuperUser:
+            raise ProtectedUserError()
+
+        # Changes go through the rows already loaded, flushed as the needed UPDATEs only
+        for field, value in self.get_profile_data(data_changes).items():
+            setattr(row, field, value)
+        for field, value in self.get_user_data(data_changes).items():
+            setattr(user, field, value)
+        db.flush()
+        updated = self.parse(row)
+        db.commit()
+        return updated
+
+    def _delete_user_by_user_id(self, db: Session, user_id: int):
+        row = self._get_row_by_user_id(db, user_id)
+        if not row:
+            return False
+        if row.role_user.user.isSuperUser:
+            raise ProtectedUserError()
+
+        # role_by_user and the profile go with the user, ON DELETE CASCADE
+        db.execute(delete(models.User).where(models.User.id == user_id).execution_options(**{INVALIDATES: [user_id]}))
+        db.commit()
+        return True
+
+    def _bulk_create(self, db: Session, rows: Mapping[int, dict]):
+        # Rows carry the user data (password already hashed) and the profile data
+        usernames = [values["username"] for values in rows.values()]
+        taken = set(db.scalars(select(models.User.username).where(models.User.username.in_(usernames))))
+        users, errors = {}, []
+        for index, values in rows.items():
+            if values["username"] in taken:
+                errors.append(BulkError(row=index, detail="User already exist"))
+                continue
+            taken.add(values["username"])
+            users[index] = {"username": values["username"], "password": values["password"], "isActive": True}
+
+        user_ids, user_errors = UserLogic._bulk_insert(db, users)
+        if user_ids:
+            role_user_ids = db.scalars(
+                insert(models.RoleByUser).returning(models.RoleByUser.id, sort_by_parameter_order=True),
+                [{"id_role": self.role, "id_user": user_id} for user_id in user_ids.values()]
+            ).all()
+            db.execute(insert(self.db_model), [{"id": role_user_id, **self.get_profile_data(rows[index])}
+                                               for index, role_user_id in zip(user_ids, role_user_ids)])
+        db.commit()
+        return BulkResult(processed=len(user_ids), ids=list(user_ids.values()),
+                          errors=sorted(errors + user_errors, key=lambda e: e.row))
+
+    def _bulk_update_by_user_id(self, db: Session, rows: Mapping[int, dict]):
+        # Rows carry the `user_id` and the profile and user fields to set. Profiles are found with one statement
+        statement = select(models.RoleByUser.id_user, models.RoleByUser.id, models.User.isSuperUser) \
+            .join(models.User, models.User.id == models.RoleByUser.id_user) \
+            .where(and_(models.RoleByUser.id_user.in_([values["user_id"] for values in rows.values()]),
+                        models.RoleByUser.id_role == self.role))
+        profiles = {user_id: (role_user_id, is_super_user)
+                    for user_id, role_user_id, is_super_user in db.execute(statement)}
+
+        errors, changes = [], {}
+        for index, values in rows.items():
+            profile = profiles.get(values["user_id"])
+            if profile is None:
+                errors.append(BulkError(row=index, detail="Not found"))
+            elif profile[1]:
+                errors.append(BulkError(row=index, detail="Can't edit this user"))
+            else:
+                profile_changes = {field: values[field] for field in self.profile_fields if field in values}
+                user_changes = {field: values[field] for field in self.user_fields if field in values}
+                changes[index] = ({"id": profile[0], **profile_changes}, {"id": values["user_id"], **user_changes})
+
+        def write(batch: list[tuple[dict, dict]]):
+            # ORM bulk UPDATEs by primary key, executemany, rows without changes to a table are left out
+            for db_model, table_changes in ((self.db_model, [profile for profile, _ in batch]),
+                                            (models.User, [user for _, user in batch])):
+                table_changes = [values for values in table_changes if len(values) > 1]
+                if table_changes:
+                    db.execute(update(db_model), table_changes)
+
+        updated = dict(changes)
+        try:
+            with db.begin_nested():
+                write(list(changes.values()))
+        except (IntegrityError, DataError):
+            # Some row was rejected (e.g. a taken username), find which ones still inside the same transaction
+            for index, row_changes in changes.items():
+                try:
+                    with db.begin_nested():
+                        write([row_changes])
+                except (IntegrityError, DataError) as error:
+                    del updated[index]
+                    errors.append(BulkError(row=index, detail=self.bulk_error_detail(error)))
+        db.commit()
+        return BulkResult(processed=len(updated), ids=[rows[index]["user_id"] for index in updated],
+                          errors=sorted(errors, key=lambda e: e.row))
+
+    async def get_by_user_id(self, db: Session, user_id: int):
+        return await run_sync(db, self._get_by_user_id, user_id)
+
+    async def update_by_user_id(self, db: Session, user_id: int, data_changes: dict):
+        """Changes both profile and user fields. None when the user has no such profile."""
+        return await run_sync(db, self._update_by_user_id, user_id, data_changes)
+
+    async def delete_user_by_user_id(self, db: Session, user_id: int):
+        """Removes the user together with its profile. False when the user has no such profile."""
+        return await run_sync(db, self._delete_user_by_user_id, user_id)
+
+    async def bulk_create(self, db: Session, rows: Mapping[int, dict]):
+        passwords = await run_in_threadpool(get_hash_passwords, [values["password"] for values in rows.values()])
+        rows = {index: {**values, "password": password} for (index, values), password in zip(rows.items(), passwords)}
+        return await super().bulk_create(db, rows)
+
+    async def bulk_update_by_user_id(self, db: Session, rows: Mapping[int, dict]):
+        """Every row carries the `user_id` of the profile to change and the profile and user fields to set."""
+        return await run_sync(db, self._bulk_update_by_user_id, rows)
+
+    async def bulk_delete_by_user_id(self, db: Session, user_ids: Mapping[int, int]):
+        # Deleting the users cascades to role_by_user and the profiles
+        has_role = models.User.id.in_(select(models.RoleByUser.id_user).where(models.RoleByUser.id_role == self.role))
+        return await run_sync(db, UserLogic._bulk_delete, user_ids,
+                              condition=and_(has_role, models.User.isSuperUser == False))
@@ -1,8 +1,8 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
 import schemas.user
 from db import models
-from .base import CRUD
+from .base import CRUD, run_sync
 from schemas.user import UserPartialIn, UpdatePassword, User, FirstSuperUserCreate, CreateUserByAdmin
 from utils.hash_helper import get_hash_password
 
@@ -29,15 +29,22 @@ class UserCRUD(CRUD):
         data_changes = UpdatePassword(password=hashed_password).model_dump()
         return await super().update(db=db, row_id=row_id, data_changes=data_changes)
 
+    def _get_by_username(self, db: Session, username: str):
+        return self.parse(db.query(self.db_model).filter(models.User.username == username).first())
+
     async def get_by_username(self, db: Session, username: str):
-        return await self.parse(db.query(self.db_model).filter(models.User.username == username).first())
+        return await run_sync(db, self._get_by_username, username)
 
     async def get_user_password(self, db: Session, row_id: int):
         data = await self.get_by_id(db, row_id)
         return data.password
 
+    def _get_super_user(self, db: Session):
+        return self.parse(db.query(self.db_model).filter(models.User.isSuperUser == True).first())
+
     async def get_super_user(self, db: Session):
-        return await self.parse(db.query(self.db_model).filter(models.User.isSuperUser == True).first())
+        return await run_sync(db, self._get_super_user)
 
 
-UserLogic = UserCRUD(db_model=models.User, model=User, filter_model=schemas.user.UserFilter)
+UserLogic = UserCRUD(db_model=models.User, model=User, filter_model=schemas.user.UserFilter, cache=True,
+                     load_options={"roles": selectinload(models.User.roles)})
@@ -5,7 +5,11 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from utils.config import get_settings
 from utils.logs import initialize_logs_service, get_logger
-from db.init_db import init_db
+from db.init_db import init_db, maintain_order_partitions_forever
+from db.dependencies import open_session
+from logic.order_log import order_log_writer
+from logic.idempotency import DatabaseIdempotencyStore, idempotency
+from utils.enums import IdempotencyStores
 from contextlib import asynccontextmanager
 import asyncio
 from fastapi.openapi.utils import get_openapi
@@ -28,7 +32,14 @@ async def lifespan(app_: FastAPI):
         if await init_db():
             break
     logger.info(f'Everything\'s fine starting server')
+    partitions_task = asyncio.create_task(maintain_order_partitions_forever())
+    order_log_writer.start(open_session)
+    if settings.idempotency.store == IdempotencyStores.DATABASE:
+        idempotency.store = DatabaseIdempotencyStore(open_session, settings.idempotency.ttl,
+                                                     settings.idempotency.claim_timeout)
     yield
+    partitions_task.cancel()
+    await order_log_writer.stop()
     logger.info('Shutting down VIAKABLE BACKEND Server.')
 
 
@@ -55,6 +66,8 @@ app.include_router(routes.admins.router)
 app.include_router(routes.forklifts.router)
 app.include_router(routes.materials.router)
 app.include_router(routes.orders.router)
+app.include_router(routes.monitoring.router)
+app.include_router(routes.analytics.router)
 
 
 def custom_openapi():
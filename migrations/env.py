@@ -59,6 +59,12 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    # A connection passed by the caller (e.g. the tests) is used instead of the settings URL
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        run_migrations_on(connection)
+        return
+
     alembic_config = config.get_section(config.config_ini_section)
     alembic_config['sqlalchemy.url'] = SQLALCHEMY_DATABASE_URL
     connectable = engine_from_config(
@@ -68,12 +74,16 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+        run_migrations_on(connection)
+
 
-        with context.begin_transaction():
-            context.run_migrations()
+def run_migrations_on(connection) -> None:
+    context.configure(
+        connection=connection, target_metadata=target_metadata
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
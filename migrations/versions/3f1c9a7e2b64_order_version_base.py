@@ -0,0 +1,28 @@
+"""order version base
+
+Revision ID: 3f1c9a7e2b64
+Revises: 9b932d1d768d
+Create Date: 2026-10-18 18:05:37.214906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7e2b64'
+down_revision: Union[str, None] = '9b932d1d768d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Versions become the writing transaction id plus base, the first ones taken continue after the counter
+    op.alter_column('order_versions', 'version', new_column_name='base')
+    op.execute("UPDATE order_versions SET base = GREATEST(base - pg_current_xact_id()::text::bigint + 1, 0)")
+
+
+def downgrade() -> None:
+    op.alter_column('order_versions', 'base', new_column_name='version')
+    op.execute("UPDATE order_versions SET version = (SELECT COALESCE(MAX(version), 0) FROM orders)")
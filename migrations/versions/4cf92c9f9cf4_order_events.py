@@ -0,0 +1,36 @@
+"""order events
+
+Revision ID: 4cf92c9f9cf4
+Revises: 86b88caac284
+Create Date: 2026-10-18 14:02:51.372604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4cf92c9f9cf4'
+down_revision: Union[str, None] = '86b88caac284'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('order_events',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('id_order', sa.Integer(), nullable=False),
+    sa.Column('from_state', sa.String(length=60), nullable=True),
+    sa.Column('to_state', sa.String(length=60), nullable=False),
+    sa.Column('id_actor', sa.Integer(), nullable=True),
+    sa.Column('ts', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_order_events_id_order_ts', 'order_events', ['id_order', 'ts'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_events_id_order_ts', table_name='order_events')
+    op.drop_table('order_events')
@@ -0,0 +1,28 @@
+"""order line key index
+
+Revision ID: 5d7a3e91c0b8
+Revises: c52e8d0a9f17
+Create Date: 2026-10-18 20:47:51.338260
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d7a3e91c0b8'
+down_revision: Union[str, None] = 'c52e8d0a9f17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Lines are loaded by the whole key of their order, (id, creation_datetime), see db.models.MaterialByOrder
+    op.drop_index('ix_material_by_order_id_order', table_name='material_by_order')
+    op.create_index('ix_material_by_order_id_order', 'material_by_order', ['id_order', 'creation_datetime'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_material_by_order_id_order', table_name='material_by_order')
+    op.create_index('ix_material_by_order_id_order', 'material_by_order', ['id_order'])
@@ -0,0 +1,46 @@
+"""material usage
+
+Revision ID: 7bfadc78bf7e
+Revises: 7cdfa23d66d2
+Create Date: 2026-10-18 12:31:05.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7bfadc78bf7e'
+down_revision: Union[str, None] = '7cdfa23d66d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('material_usage',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('id_material', sa.Integer(), nullable=False),
+    sa.Column('area', sa.String(), nullable=False),
+    sa.Column('id_forklift', sa.Integer(), nullable=False),
+    sa.Column('state', sa.String(length=60), nullable=False),
+    sa.Column('quantity', sa.BigInteger(), nullable=False),
+    sa.Column('lines', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'id_material', 'area', 'id_forklift', 'state')
+    )
+    # Same rows as logic.analytics.select_usage over every order
+    op.execute("""
+        INSERT INTO material_usage (day, id_material, area, id_forklift, state, quantity, lines)
+        SELECT date(orders.creation_datetime), material_by_order.id_material, COALESCE(operators.area, ''),
+               orders.id_forklift, orders.state, SUM(material_by_order.quantity), COUNT(*)
+        FROM orders
+        JOIN material_by_order ON material_by_order.id_order = orders.id
+        LEFT OUTER JOIN role_by_user ON role_by_user.id_user = orders.id_operator AND role_by_user.id_role = 'operador'
+        LEFT OUTER JOIN operators ON operators.id = role_by_user.id
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('material_usage')
@@ -0,0 +1,46 @@
+"""order and role indexes
+
+Revision ID: 7cdfa23d66d2
+Revises: e8236ef7b59c
+Create Date: 2026-10-18 11:02:17.284630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7cdfa23d66d2'
+down_revision: Union[str, None] = 'e8236ef7b59c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NEWEST_FIRST = ['creation_datetime DESC', 'id']
+
+
+def upgrade() -> None:
+    # Built CONCURRENTLY so writes go on during the build, which can't run inside a transaction.
+    # A failed build leaves an INVALID index behind: drop it before running the migration again.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_orders_id_forklift_creation_datetime', 'orders',
+                        ['id_forklift', *map(sa.text, NEWEST_FIRST)], postgresql_concurrently=True)
+        op.create_index('ix_orders_id_operator_creation_datetime', 'orders',
+                        ['id_operator', *map(sa.text, NEWEST_FIRST)], postgresql_concurrently=True)
+        op.create_index('ix_orders_pending_id_forklift', 'orders',
+                        ['id_forklift', *map(sa.text, NEWEST_FIRST)], postgresql_concurrently=True,
+                        postgresql_where=sa.text("state = 'pendiente'"))
+        op.create_index('ix_role_by_user_id_user_id_role', 'role_by_user', ['id_user', 'id_role'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_material_by_order_id_order', 'material_by_order', ['id_order'],
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_material_by_order_id_order', table_name='material_by_order', postgresql_concurrently=True)
+        op.drop_index('ix_role_by_user_id_user_id_role', table_name='role_by_user', postgresql_concurrently=True)
+        op.drop_index('ix_orders_pending_id_forklift', table_name='orders', postgresql_concurrently=True)
+        op.drop_index('ix_orders_id_operator_creation_datetime', table_name='orders', postgresql_concurrently=True)
+        op.drop_index('ix_orders_id_forklift_creation_datetime', table_name='orders', postgresql_concurrently=True)
@@ -0,0 +1,127 @@
+"""partition orders
+
+Revision ID: 86b88caac284
+Revises: 7bfadc78bf7e
+Create Date: 2026-10-18 13:20:44.906127
+
+"""
+from datetime import date, datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '86b88caac284'
+down_revision: Union[str, None] = '7bfadc78bf7e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Default of settings.partitions.months_ahead, the server creates the later months, see logic.partitions
+MONTHS_AHEAD = 3
+
+ORDER_COLUMNS = 'id, id_operator, id_forklift, creation_datetime, estimate_datetime, order_datetime, state, ' \
+                'canceled, version'
+
+NEWEST_FIRST = ['creation_datetime DESC', 'id']
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_tables(suffix: str, partitioned: bool) -> None:
+    # Bare tables, the keys and indexes are added once the rows are copied, see add_constraints
+    partition_by = {'postgresql_partition_by': 'RANGE (creation_datetime)'} if partitioned else {}
+    op.create_table(f'orders{suffix}',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('orders_id_seq')"), nullable=False),
+    sa.Column('id_operator', sa.Integer(), nullable=False),
+    sa.Column('id_forklift', sa.Integer(), nullable=False),
+    sa.Column('creation_datetime', sa.DateTime(), nullable=False),
+    sa.Column('estimate_datetime', sa.DateTime(), nullable=False),
+    sa.Column('order_datetime', sa.DateTime(), nullable=True),
+    sa.Column('state', sa.String(length=60), nullable=False),
+    sa.Column('canceled', sa.Boolean(), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default='0', nullable=False),
+    **partition_by
+    )
+    op.create_table(f'material_by_order{suffix}',
+    sa.Column('id_material', sa.Integer(), nullable=False),
+    sa.Column('id_order', sa.Integer(), nullable=False),
+    *([sa.Column('creation_datetime', sa.DateTime(), nullable=False)] if partitioned else []),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    **partition_by
+    )
+
+
+def replace_tables(suffix: str) -> None:
+    op.drop_table('material_by_order')
+    op.drop_table('orders')
+    op.rename_table(f'orders{suffix}', 'orders')
+    op.rename_table(f'material_by_order{suffix}', 'material_by_order')
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+
+
+def add_constraints(partitioned: bool) -> None:
+    # Keys of partitioned tables include the partition key
+    key = ['creation_datetime'] if partitioned else []
+    op.create_primary_key('orders_pkey', 'orders', ['id', *key])
+    op.create_foreign_key('orders_id_operator_fkey', 'orders', 'users', ['id_operator'], ['id'])
+    op.create_foreign_key('orders_id_forklift_fkey', 'orders', 'users', ['id_forklift'], ['id'])
+    op.create_primary_key('material_by_order_pkey', 'material_by_order', ['id_material', 'id_order', *key])
+    op.create_foreign_key('material_by_order_id_material_fkey', 'material_by_order', 'materials',
+                          ['id_material'], ['id'])
+    op.create_foreign_key('material_by_order_id_order_fkey', 'material_by_order', 'orders',
+                          ['id_order', *key], ['id', *key])
+    op.create_index(op.f('ix_orders_version'), 'orders', ['version'], unique=False)
+    op.create_index('ix_orders_id_forklift_creation_datetime', 'orders',
+                    ['id_forklift', *map(sa.text, NEWEST_FIRST)])
+    op.create_index('ix_orders_id_operator_creation_datetime', 'orders',
+                    ['id_operator', *map(sa.text, NEWEST_FIRST)])
+    op.create_index('ix_orders_pending_id_forklift', 'orders', ['id_forklift', *map(sa.text, NEWEST_FIRST)],
+                    postgresql_where=sa.text("state = 'pendiente'"))
+    op.create_index('ix_material_by_order_id_order', 'material_by_order', ['id_order'])
+
+
+def upgrade() -> None:
+    # Rewrites both tables under exclusive locks, run it while the API is stopped.
+    # The sequence of the order ids outlives the table it belongs to
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY NONE")
+    create_tables('_partitioned', partitioned=True)
+
+    # A partition for every month with orders, up to MONTHS_AHEAD months from now
+    bind = op.get_bind()
+    first, last = bind.execute(sa.text("SELECT CAST(date_trunc('month', MIN(creation_datetime)) AS date), "
+                                       "CAST(date_trunc('month', MAX(creation_datetime)) AS date) FROM orders")).one()
+    this_month = datetime.now(timezone.utc).date().replace(day=1)
+    start, last = min(first or this_month, this_month), max(last or this_month, add_months(this_month, MONTHS_AHEAD))
+    while start <= last:
+        for table in ('orders', 'material_by_order'):
+            op.execute(f"CREATE TABLE {table}_{start:%Y_%m} PARTITION OF {table}_partitioned "
+                       f"FOR VALUES FROM ('{start}') TO ('{add_months(start, 1)}')")
+        start = add_months(start, 1)
+
+    op.execute(f"INSERT INTO orders_partitioned ({ORDER_COLUMNS}) SELECT {ORDER_COLUMNS} FROM orders")
+    # Lines get the creation_datetime of their order, their partition key
+    op.execute("""
+        INSERT INTO material_by_order_partitioned (id_material, id_order, creation_datetime, quantity)
+        SELECT material_by_order.id_material, material_by_order.id_order, orders.creation_datetime,
+               material_by_order.quantity
+        FROM material_by_order
+        JOIN orders ON orders.id = material_by_order.id_order
+    """)
+    replace_tables('_partitioned')
+    add_constraints(partitioned=True)
+
+
+def downgrade() -> None:
+    # Only the attached partitions are copied back, the archived ones stay in their schema
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY NONE")
+    create_tables('_unpartitioned', partitioned=False)
+    op.execute(f"INSERT INTO orders_unpartitioned ({ORDER_COLUMNS}) SELECT {ORDER_COLUMNS} FROM orders")
+    op.execute("INSERT INTO material_by_order_unpartitioned (id_material, id_order, quantity) "
+               "SELECT id_material, id_order, quantity FROM material_by_order")
+    replace_tables('_unpartitioned')
+    add_constraints(partitioned=False)
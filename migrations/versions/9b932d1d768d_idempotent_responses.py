@@ -0,0 +1,34 @@
+"""idempotent responses
+
+Revision ID: 9b932d1d768d
+Revises: 4cf92c9f9cf4
+Create Date: 2026-10-18 16:40:12.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b932d1d768d'
+down_revision: Union[str, None] = '4cf92c9f9cf4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('idempotent_responses',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('content', sa.JSON(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_idempotent_responses_expires_at'), 'idempotent_responses', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_idempotent_responses_expires_at'), table_name='idempotent_responses')
+    op.drop_table('idempotent_responses')
@@ -0,0 +1,32 @@
+"""order keys
+
+Revision ID: a83f5e0c6d21
+Revises: e41b7c2d9a56
+Create Date: 2026-10-18 22:41:09.153072
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a83f5e0c6d21'
+down_revision: Union[str, None] = 'e41b7c2d9a56'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('order_keys',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('creation_datetime', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # The orders of the attached partitions, archived ones are left out
+    op.execute("INSERT INTO order_keys (id, creation_datetime) SELECT id, creation_datetime FROM orders")
+
+
+def downgrade() -> None:
+    op.drop_table('order_keys')
@@ -0,0 +1,34 @@
+"""order area
+
+Revision ID: c52e8d0a9f17
+Revises: 3f1c9a7e2b64
+Create Date: 2026-10-18 19:22:08.650131
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52e8d0a9f17'
+down_revision: Union[str, None] = '3f1c9a7e2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('orders', sa.Column('area', sa.String(), server_default='', nullable=False))
+    # The areas material_usage was built with, those of the operators now
+    op.execute("""
+        UPDATE orders SET area = operators.area
+        FROM role_by_user
+        JOIN operators ON operators.id = role_by_user.id
+        WHERE role_by_user.id_user = orders.id_operator AND role_by_user.id_role = 'operador'
+          AND operators.area IS NOT NULL
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'area')
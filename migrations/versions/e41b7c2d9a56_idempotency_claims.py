@@ -0,0 +1,28 @@
+"""idempotency claims
+
+Revision ID: e41b7c2d9a56
+Revises: 5d7a3e91c0b8
+Create Date: 2026-10-18 22:05:37.904113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41b7c2d9a56'
+down_revision: Union[str, None] = '5d7a3e91c0b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Claimed keys have no content until their request completes
+    op.alter_column('idempotent_responses', 'content', existing_type=sa.JSON(), nullable=True)
+
+
+def downgrade() -> None:
+    op.execute('DELETE FROM idempotent_responses WHERE content IS NULL')
+    op.alter_column('idempotent_responses', 'content', existing_type=sa.JSON(), nullable=False)
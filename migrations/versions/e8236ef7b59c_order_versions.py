@@ -0,0 +1,37 @@
+"""order versions
+
+Revision ID: e8236ef7b59c
+Revises: 6046fcfd31a8
+Create Date: 2026-10-18 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8236ef7b59c'
+down_revision: Union[str, None] = '6046fcfd31a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('order_versions',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.add_column('orders', sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+    # Existing orders get distinct versions in creation order, the counter continues after them
+    op.execute("UPDATE orders SET version = id")
+    op.execute("INSERT INTO order_versions (id, version) SELECT 1, COALESCE(MAX(version), 0) FROM orders")
+    op.create_index(op.f('ix_orders_version'), 'orders', ['version'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_orders_version'), table_name='orders')
+    op.drop_column('orders', 'version')
+    op.drop_table('order_versions')
@@ -6,4 +6,7 @@ from . import forklift
 from . import operator
 from . import token
 from . import user
-from . import order
\ No newline at end of file
+from . import order
+from . import monitoring
+from . import bulk
+from . import analytics
\ No newline at end of file
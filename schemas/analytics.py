@@ -0,0 +1,66 @@
+from datetime import date
+
+from pydantic import BaseModel, ConfigDict
+from fastapi_filter.contrib.sqlalchemy import Filter
+from db import models as db_models
+from utils.enums import OrderStates
+
+
+class MaterialUsage(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    # Dimensions not grouped by are left out
+    day: date | None = None
+    id_material: int | None = None
+    area: str | None = None
+    id_forklift: int | None = None
+    state: OrderStates | None = None
+
+    quantity: int
+    lines: int
+
+
+class LatencyStats(BaseModel):
+    # Orders that went through both states
+    orders: int
+    average_seconds: float | None = None
+    minimum_seconds: float | None = None
+    maximum_seconds: float | None = None
+    # Only computed by PostgreSQL
+    p50_seconds: float | None = None
+    p95_seconds: float | None = None
+
+
+class OrderLatency(BaseModel):
+    # pending -> delivered
+    delivery: LatencyStats
+    # delivered -> confirmed
+    confirmation: LatencyStats
+    # pending -> confirmed
+    total: LatencyStats
+
+
+# -----------------
+# FILTER
+# -----------------
+class MaterialUsageFilter(Filter):
+    # day
+    day__gte: date | None = None
+    day__lte: date | None = None
+
+    # id_material
+    id_material: int | None = None
+    id_material__in: list[int] | None = None
+
+    # area
+    area: str | None = None
+
+    # id_forklift
+    id_forklift: int | None = None
+
+    # state
+    state: OrderStates | None = None
+    state__in: list[OrderStates] | None = None
+
+    class Constants(Filter.Constants):
+        model = db_models.MaterialUsage
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class BulkError(BaseModel):
+    # Position of the row in the request, 0 based, CSV header excluded
+    row: int
+    detail: str
+
+
+class BulkResult(BaseModel):
+    processed: int
+    ids: list[int]
+    errors: list[BulkError] = []
@@ -21,6 +21,10 @@ class MaterialCreate(MaterialBase):
     pass
 
 
+class MaterialBulkPartialIn(MaterialPartialIn):
+    id: int
+
+
 class PublicMaterial(MaterialBase):
     model_config = ConfigDict(from_attributes=True)
 
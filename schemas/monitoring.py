@@ -0,0 +1,31 @@
+from pydantic import BaseModel
+
+
+class PoolStatus(BaseModel):
+    name: str
+    size: int
+    checked_out: int
+    idle: int
+    overflow: int
+    connections: int
+    invalidations: int
+    checkouts: int
+    checkins: int
+    timeouts: int
+    wait_total_seconds: float
+    wait_max_seconds: float
+    wait_avg_seconds: float
+
+
+class CacheStatus(BaseModel):
+    name: str
+    size: int
+    max_size: int
+    ttl_seconds: float
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    expirations: int
+    invalidations: int
+    rejected: int
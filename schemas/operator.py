@@ -18,6 +18,10 @@ class OperatorPartialIn(user.ModifyUserByAdmin):
     area: str | None = None
 
 
+class OperatorBulkPartialIn(OperatorPartialIn):
+    user_id: int
+
+
 class PublicOperator(user.PublicUser, OperatorBase):
     model_config = ConfigDict(from_attributes=True)
 
@@ -29,6 +29,8 @@ class OrderByMaterial(BaseModel):
 
 
 class OrderCreate(OrderBase):
+    # Assigned by the dispatcher when missing, see settings.dispatch
+    id_forklift: int | None = None
     materials_order: list[OrderByMaterial]
 
 
@@ -37,6 +39,7 @@ class PublicOrder(OrderBase):
 
     id: int
     canceled: bool = False
+    version: int = 0
     operator: PublicUser | None = None
     forklift: PublicUser | None = None
     materials_order: list[OrderByMaterial] | None = None
@@ -46,6 +49,31 @@ class Order(PublicOrder):
     pass
 
 
+class OrderChanges(BaseModel):
+    # Send it as `since` on the next call
+    version: int
+    # More changes are waiting, call again right away
+    has_more: bool = False
+    orders: list[PublicOrder]
+
+
+class OrderTransition(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id_order: int
+    # None when the order was created
+    from_state: OrderStates | None = None
+    to_state: OrderStates
+    id_actor: int | None = None
+    ts: AwareDatetime
+
+
+class OrderEvent(BaseModel):
+    # order_created or order_state_changed
+    event: str
+    order: PublicOrder
+
+
 # -----------------
 # FILTER
 # -----------------
@@ -59,6 +87,9 @@ class OrderFilter(Filter):
     # id_operator
     id_operator: int | None = None
 
+    # state
+    state: OrderStates | None = None
+
     # creation_datetime
     creation_datetime: AwareDatetime | None = None
     creation_datetime__gt: AwareDatetime | None = None
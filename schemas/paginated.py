@@ -12,4 +12,5 @@ class GenericField(GenericModel, Generic[T]):
 class Paginated(GenericField[T], Generic[T]):
     page: int
     size: int
-    total: int
+    total: int | None = None
+    next_cursor: str | None = None
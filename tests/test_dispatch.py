@@ -0,0 +1,27 @@
+"""Forklift loads kept by the dispatcher."""
+from logic.dispatch import ForkliftDispatcher
+
+
+def test_reservation_survives_a_refresh():
+    dispatcher = ForkliftDispatcher(consolidate_below=3, refresh_seconds=60)
+    dispatcher.reset([1, 2], {10: 'a'}, [])
+
+    with dispatcher.reserve(10) as forklift:
+        assert dispatcher.loads[forklift] == 1
+        # Reloaded while the order is being created, with an open order of the area on the forklift
+        dispatcher.reset([1, 2], {10: 'a'}, [(100, forklift, 10)])
+        assert dispatcher.loads[forklift] == 2
+        assert dispatcher.area_loads['a'] == {forklift: 2}
+
+    assert dispatcher.loads == {forklift: 1, 3 - forklift: 0}
+    assert dispatcher.area_loads['a'] == {forklift: 1}
+    assert not dispatcher.reserved
+
+
+def test_reservations_spread_orders():
+    dispatcher = ForkliftDispatcher(consolidate_below=1, refresh_seconds=60)
+    dispatcher.reset([1, 2], {10: 'a', 20: 'b'}, [])
+
+    with dispatcher.reserve(10) as first, dispatcher.reserve(20) as second:
+        assert first != second
+    assert dispatcher.loads == {1: 0, 2: 0}
@@ -0,0 +1,72 @@
+"""Idempotency keys run once, across the workers sharing the table store."""
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from benchmarks.common import build_session_local
+from logic.idempotency import DatabaseIdempotencyStore, IdempotentRunner, MemoryIdempotencyStore
+
+
+class FailingStore(MemoryIdempotencyStore):
+    async def set(self, key, response):
+        raise ConnectionError('store unreachable')
+
+
+def same(value):
+    return value
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two runners, as two worker processes, over one database."""
+    path = tmp_path / 'idempotency.db'
+    build_session_local(f'sqlite:///{path}')[0].dispose()
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}', poolclass=NullPool)
+    session_local = sessionmaker(engine, class_=AsyncSession, autocommit=False, autoflush=False,
+                                 expire_on_commit=False)
+    yield [IdempotentRunner(DatabaseIdempotencyStore(session_local, ttl=3600, claim_timeout=30)) for _ in range(2)]
+    asyncio.run(engine.dispose())
+
+
+def test_result_returned_when_the_store_fails():
+    runner = IdempotentRunner(FailingStore(max_size=10, ttl=60))
+
+    async def execute():
+        return {"id": 1}
+
+    assert asyncio.run(runner.run('key', 'body', execute, same, same)) == ({"id": 1}, False)
+    assert runner.executions == 1
+
+
+def test_duplicates_in_other_workers_wait_for_the_claim(workers):
+    executed = []
+
+    async def execute():
+        executed.append(1)
+        await asyncio.sleep(0.2)
+        return {"id": len(executed)}
+
+    async def main():
+        return await asyncio.gather(*(runner.run('key', 'body', execute, same, same) for runner in workers))
+
+    results = asyncio.run(main())
+    assert len(executed) == 1
+    assert sorted(results, key=lambda result: result[1]) == [({"id": 1}, False), ({"id": 1}, True)]
+
+
+def test_failed_request_releases_its_claim(workers):
+    async def fail():
+        raise ValueError()
+
+    async def execute():
+        return {"id": 2}
+
+    async def main():
+        with pytest.raises(ValueError):
+            await workers[0].run('key', 'body', fail, same, same)
+        return await asyncio.wait_for(workers[1].run('key', 'body', execute, same, same), 1)
+
+    assert asyncio.run(main()) == ({"id": 2}, False)
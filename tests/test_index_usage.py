@@ -0,0 +1,71 @@
+"""
+Postgres plans of the hot list queries and role checks, each must use its index from db.models: the DESC composite
+indexes serving the newest first pages, and the partial one of pending orders.
+
+They run against the database of TEST_DATABASE_URL and are skipped without it, see conftest.postgres. Sequential
+scans are disabled: the seed is too small for the planner to prefer an index on its own, the point is that the query
+can be answered by it.
+"""
+import pytest
+from sqlalchemy import select, text, update
+
+from benchmarks.index_usage import capture_statements
+from db import models
+from logic import OperatorLogic
+from logic.order import OrderLogic
+from logic.order_log import OrderTransitionLogic
+from schemas.order import OrderFilter
+from utils.enums import OrderStates, UserRoles
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture(scope='module')
+def planned(postgres):
+    """Sessions and the statements they sent."""
+    engine, session_local = postgres
+    with session_local() as db:
+        # Most orders are done in a running plant, only a few are pending
+        db.execute(update(models.Order).where(models.Order.id % 10 != 0).values(state=OrderStates.DELIVERED))
+        db.commit()
+    with engine.connect() as connection:
+        connection.execute(text('ANALYZE'))
+        connection.commit()
+    return session_local, capture_statements(engine)
+
+
+def get_user_id(db, role: UserRoles) -> int:
+    return db.scalar(select(models.RoleByUser.id_user).where(models.RoleByUser.id_role == role))
+
+
+CASES = {
+    'forklift orders': ('ix_orders_id_forklift_creation_datetime',
+                        lambda db: OrderLogic._filter_page_by_query(
+                            db, OrderFilter(id_forklift=get_user_id(db, UserRoles.FORKLIFT)), limit=20)),
+    'operator orders': ('ix_orders_id_operator_creation_datetime',
+                        lambda db: OrderLogic._filter_page_by_query(
+                            db, OrderFilter(id_operator=get_user_id(db, UserRoles.OPERATOR)), limit=20)),
+    'pending forklift orders': ('ix_orders_pending_id_forklift',
+                                lambda db: OrderLogic._filter_page_by_query(
+                                    db, OrderFilter(id_forklift=get_user_id(db, UserRoles.FORKLIFT),
+                                                    state=OrderStates.PENDING), limit=20)),
+    'order lines': ('ix_material_by_order_id_order',
+                    lambda db: OrderLogic._filter_page_by_query(
+                        db, OrderFilter(id_operator=get_user_id(db, UserRoles.OPERATOR)), limit=20)),
+    'role check': ('ix_role_by_user_id_user_id_role',
+                   lambda db: OperatorLogic._get_by_user_id(db, get_user_id(db, UserRoles.OPERATOR))),
+    'order timeline': ('ix_order_events_id_order_ts', lambda db: OrderTransitionLogic._get_timeline(db, 1, {})),
+}
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_index_used(planned, name):
+    session_local, statements = planned
+    index, fn = CASES[name]
+    with session_local() as db:
+        db.execute(text('SET LOCAL enable_seqscan = off'))
+        statements.clear()
+        fn(db)
+        plans = ['\n'.join(row[0] for row in db.connection().exec_driver_sql(f'EXPLAIN {statement}', parameters))
+                 for statement, parameters in list(statements)]
+    assert any(index in plan for plan in plans), '\n\n'.join(plans)
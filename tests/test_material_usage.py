@@ -0,0 +1,77 @@
+"""The MaterialUsage rollup kept by the order writes must always match the one recomputed from the orders."""
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import select, true
+
+from db import models
+from logic import OperatorLogic
+from logic.analytics import MaterialUsageLogic, select_usage
+from logic.order import OrderLogic
+from utils.enums import OrderStates, UserRoles
+
+
+def rollup_rows(db) -> set:
+    return {(str(row.day), row.id_material, row.area, row.id_forklift, row.state, row.quantity, row.lines)
+            for row in db.scalars(select(models.MaterialUsage).where(models.MaterialUsage.lines != 0))}
+
+
+def recomputed_rows(db) -> set:
+    return {(str(row[0]), *row[1:]) for row in db.execute(select_usage(true())).all()}
+
+
+# SQLite, and PostgreSQL where the state is checked and changed by one statement
+DATABASES = pytest.mark.parametrize('database_name', ['database', pytest.param('postgres', marks=pytest.mark.postgres)])
+
+
+def create_order(db, operator_id: int) -> models.Order:
+    forklift_id = db.scalar(select(models.RoleByUser.id_user).where(models.RoleByUser.id_role == UserRoles.FORKLIFT))
+    material_id = db.scalar(select(models.Material.id))
+    now = datetime.now(timezone.utc)
+    return OrderLogic._create(db, {"id_operator": operator_id, "id_forklift": forklift_id, "creation_datetime": now,
+                                   "estimate_datetime": now, "order_datetime": None, "state": OrderStates.PENDING,
+                                   "materials_order": [{"id_material": material_id, "quantity": 7}]})
+
+
+@DATABASES
+def test_operator_changing_area(request, database_name):
+    _, session_local = request.getfixturevalue(database_name)
+    with session_local() as db:
+        MaterialUsageLogic._rebuild(db)
+        operator_id = db.scalar(select(models.RoleByUser.id_user)
+                                .join(models.Operator, models.Operator.id == models.RoleByUser.id)
+                                .where(models.Operator.area == 'area0')
+                                .order_by(models.RoleByUser.id_user))
+        created = create_order(db, operator_id)
+
+        OperatorLogic._update_by_user_id(db, operator_id, {"area": "NEW"})
+        delivered, left = OrderLogic._change_state(db, created.id, OrderStates.DELIVERED, {})
+        assert left == OrderStates.PENDING and delivered.state == OrderStates.DELIVERED
+        OrderLogic._update(db, created.id, {"estimate_datetime": datetime.now(timezone.utc)})
+
+        # The order stays in the area it was created in, its pending row is back to nothing
+        usage = db.scalars(select(models.MaterialUsage)
+                           .where(models.MaterialUsage.day == created.creation_datetime.date(),
+                                  models.MaterialUsage.id_forklift == created.id_forklift)).all()
+        assert {(row.area, row.state) for row in usage if row.lines} >= {('area0', OrderStates.DELIVERED.value)}
+        assert not any(row.area == 'NEW' for row in usage)
+        assert rollup_rows(db) == recomputed_rows(db)
+
+        # Orders created after the change are in the new area
+        create_order(db, operator_id)
+        assert ('NEW', OrderStates.PENDING.value) in {(row[2], row[4]) for row in rollup_rows(db)}
+        assert rollup_rows(db) == recomputed_rows(db)
+
+
+@DATABASES
+def test_transitions_move_the_rollup(request, database_name):
+    _, session_local = request.getfixturevalue(database_name)
+    with session_local() as db:
+        MaterialUsageLogic._rebuild(db)
+        order_ids = db.scalars(select(models.Order.id).order_by(models.Order.id).limit(30)).all()
+        targets = (OrderStates.DELIVERED, OrderStates.CONFIRMED, OrderStates.CANCELED_BY_OPERATOR)
+        for i, order_id in enumerate(order_ids):
+            OrderLogic._change_state(db, order_id, targets[i % len(targets)], {})
+        # Refused: canceled orders are not delivered
+        OrderLogic._change_state(db, order_ids[2], OrderStates.DELIVERED, {})
+        assert rollup_rows(db) == recomputed_rows(db)
@@ -0,0 +1,89 @@
+"""Versions taken by the order writes and the changes read since one of them."""
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import func, select, text, update
+
+from benchmarks.index_usage import capture_statements
+from db import models
+from logic.order import OrderLogic
+from utils.enums import OrderStates
+
+
+def walk_changes(db, limit: int) -> list[list]:
+    """Pages of changes read from version 0 until none is left."""
+    pages, since, has_more = [], 0, True
+    while has_more:
+        orders, has_more = OrderLogic._get_changes(db, since, {}, limit=limit)
+        pages.append(orders)
+        since = orders[-1].version if orders else since
+    return pages
+
+
+def test_writes_take_increasing_versions(session_local):
+    with session_local() as db:
+        last = db.scalar(select(func.max(models.Order.version)))
+        order_id = db.scalar(select(models.Order.id).order_by(models.Order.id))
+        operator_id, forklift_id = db.execute(select(models.Order.id_operator, models.Order.id_forklift)
+                                              .where(models.Order.id == order_id)).one()
+
+        created = OrderLogic._create(db, {"id_operator": operator_id, "id_forklift": forklift_id,
+                                          "creation_datetime": datetime.now(timezone.utc),
+                                          "estimate_datetime": datetime.now(timezone.utc),
+                                          "state": OrderStates.PENDING, "materials_order": []})
+        changed, _ = OrderLogic._change_state(db, order_id, OrderStates.DELIVERED, {})
+        updated = OrderLogic._update(db, order_id, {"estimate_datetime": datetime.now(timezone.utc)})
+        assert last < created.version < changed.version < updated.version
+
+
+def test_refused_transition_writes_nothing(database):
+    engine, session_local = database
+    with session_local() as db:
+        order_id = db.scalar(select(models.Order.id).order_by(models.Order.id))
+        OrderLogic._change_state(db, order_id, OrderStates.CANCELED_BY_OPERATOR, {})
+        statements = capture_statements(engine)
+        changed, current = OrderLogic._change_state(db, order_id, OrderStates.DELIVERED, {})
+        assert changed is None and current == OrderStates.CANCELED_BY_OPERATOR
+        # The state read, nothing written
+        assert all(statement.startswith('SELECT') for statement, _ in statements)
+
+
+def test_changes_pages_keep_a_version_whole(session_local):
+    with session_local() as db:
+        # Orders written three by transaction, and 15 of them by a single one
+        db.execute(update(models.Order).values(version=(models.Order.id - models.Order.id % 3) / 3 + 10))
+        db.execute(update(models.Order).where(models.Order.id <= 15).values(version=1))
+        db.commit()
+        total = db.scalar(select(func.count()).select_from(models.Order))
+
+        pages = walk_changes(db, limit=10)
+        ids = [order.id for page in pages for order in page]
+        assert sorted(ids) == list(range(1, total + 1))
+        assert len(pages[0]) == 15
+        for page, next_page in zip(pages, pages[1:]):
+            if next_page:
+                assert page[-1].version < next_page[0].version
+
+
+@pytest.mark.postgres
+def test_concurrent_writes_and_visible_changes(postgres):
+    engine, session_local = postgres
+    with session_local() as first, session_local() as second, session_local() as reader:
+        since = reader.scalar(select(func.max(models.Order.version)))
+        first_id, second_id = reader.scalars(select(models.Order.id).order_by(models.Order.id).limit(2)).all()
+        reader.rollback()
+
+        first.execute(update(models.Order).where(models.Order.id == first_id)
+                      .values(version=OrderLogic._next_version(first)))
+        # Another order is written while the first transaction is open, without waiting for it
+        second.execute(text("SET LOCAL lock_timeout = '1s'"))
+        second.execute(update(models.Order).where(models.Order.id == second_id)
+                       .values(version=OrderLogic._next_version(second)))
+        second.commit()
+
+        # Held back until the first one, which took a lower version, is over
+        assert OrderLogic._get_changes(reader, since, {}) == ([], False)
+        reader.rollback()
+        first.commit()
+        orders, _ = OrderLogic._get_changes(reader, since, {})
+        assert [order.id for order in orders] == [first_id, second_id]
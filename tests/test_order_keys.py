@@ -0,0 +1,59 @@
+"""
+Orders are keyed by (id, creation_datetime), the partition key on PostgreSQL: every statement on an order carries its
+creation_datetime, read from order_keys when only its id is known, so each reads the partition of its month only.
+"""
+import re
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import select
+
+from benchmarks.index_usage import capture_statements
+from db import models
+from logic.order import OrderLogic
+from utils.enums import OrderStates
+
+
+def by_id_alone(statements: list) -> list[str]:
+    return [statement for statement, _ in statements
+            if re.search(r'\borders\.id = \?', statement)
+            and not re.search(r'orders\.creation_datetime = (\?|\(SELECT order_keys\.creation_datetime)', statement)]
+
+
+def create(db):
+    order = db.scalars(select(models.Order).order_by(models.Order.id)).first()
+    now = datetime.now(timezone.utc)
+    return OrderLogic._create(db, {"id_operator": order.id_operator, "id_forklift": order.id_forklift,
+                                   "creation_datetime": now, "estimate_datetime": now, "state": OrderStates.PENDING,
+                                   "materials_order": [{"id_material": line.id_material, "quantity": 1}
+                                                       for line in order.materials_order]})
+
+
+@pytest.mark.parametrize('access', [
+    create,
+    lambda db: OrderLogic._get_by_id(db, 1),
+    lambda db: OrderLogic._change_state(db, 1, OrderStates.DELIVERED, {})[0],
+    lambda db: OrderLogic._update(db, 1, {"estimate_datetime": datetime.now(timezone.utc)}),
+])
+def test_order_statements_carry_the_partition_key(database, access):
+    engine, session_local = database
+    with session_local() as db:
+        db.scalars(select(models.Order)).first()
+        statements = capture_statements(engine)
+        order = access(db)
+        assert order is not None and order.materials_order
+        assert statements and not by_id_alone(statements)
+
+
+def test_created_orders_are_found_by_id(session_local):
+    with session_local() as db:
+        created = create(db)
+        assert OrderLogic._get_by_id(db, created.id).id == created.id
+
+
+def test_lines_belong_to_the_order_key(session_local):
+    with session_local() as db:
+        order = db.scalars(select(models.Order).order_by(models.Order.id)).first()
+        assert db.get(models.Order, (order.id, order.creation_datetime)) is order
+        assert {(line.id_order, line.creation_datetime) for line in order.materials_order} == \
+               {(order.id, order.creation_datetime)}
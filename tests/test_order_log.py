@@ -0,0 +1,36 @@
+"""Order transitions written in batches by BatchWriter."""
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+
+from db import models
+from logic.order_log import BatchWriter
+
+
+def get_writer() -> BatchWriter:
+    return BatchWriter(models.OrderTransition, batch_size=10, flush_seconds=0.01, maximum_pending=100)
+
+
+def get_row(id_order: int) -> dict:
+    return {"id_order": id_order, "from_state": None, "to_state": "pendiente", "id_actor": None,
+            "ts": datetime.now(timezone.utc)}
+
+
+def test_rows_appended_before_start_warn_and_are_written_on_start(session_local, caplog):
+    writer = get_writer()
+    with caplog.at_level(logging.WARNING):
+        for id_order in (1, 2, 3):
+            writer.append(get_row(id_order))
+    warnings = [record for record in caplog.records if 'not started' in record.getMessage()]
+    assert len(warnings) == 1
+
+    async def run():
+        writer.start(session_local)
+        await writer.stop()
+
+    asyncio.run(run())
+    assert writer.written == 3 and not writer.rows
+    with session_local() as db:
+        assert db.scalar(select(func.count()).select_from(models.OrderTransition)) == 3
@@ -0,0 +1,122 @@
+"""
+Orders partitioned by the migrations on a database that already has orders, then maintained: months are created ahead
+and the closed old ones archived, while the orders left keep being read and written.
+"""
+import asyncio
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import select, text
+
+from benchmarks.common import seed
+from db import models
+from db.base import Base
+from logic.order import OrderLogic
+from logic.partitions import OrderPartitionLogic, add_months
+from utils.enums import OrderStates
+
+# Revision of the tables the API had before the order migrations, the database is seeded there
+FIRST_REVISION = '6046fcfd31a8'
+
+THIS_MONTH = datetime.now(timezone.utc).date().replace(day=1)
+# Months of the seeded orders: all closed in the first one, one still pending in the second
+CLOSED_MONTH = add_months(THIS_MONTH, -16)
+PENDING_MONTH = add_months(THIS_MONTH, -15)
+
+
+def in_month(month: date) -> datetime:
+    return datetime.combine(month, time()) + timedelta(days=3)
+
+
+def drop_everything(engine):
+    Base.metadata.drop_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {OrderPartitionLogic.archive_schema} CASCADE"))
+        connection.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+
+def migrate(engine, revision: str):
+    config = Config('alembic.ini')
+    with engine.connect() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, revision)
+        connection.commit()
+
+
+def seed_first_revision(engine):
+    orders = [(1, CLOSED_MONTH, OrderStates.CONFIRMED), (2, CLOSED_MONTH, OrderStates.CANCELED_BY_OPERATOR),
+              (3, PENDING_MONTH, OrderStates.PENDING), (4, THIS_MONTH, OrderStates.PENDING)]
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO roles (id) VALUES ('operador'), ('montacarga')"))
+        connection.execute(text('INSERT INTO users (id, username, password, "isActive", "isSuperUser") '
+                                "VALUES (1, 'operator', '', true, false), (2, 'forklift', '', true, false)"))
+        connection.execute(text("INSERT INTO role_by_user (id, id_role, id_user) "
+                                "VALUES (1, 'operador', 1), (2, 'montacarga', 2)"))
+        connection.execute(text("INSERT INTO operators (id, machine, area) VALUES (1, 'm1', 'a')"))
+        connection.execute(text("INSERT INTO forklifts (id, name) VALUES (2, 'f1')"))
+        connection.execute(text("INSERT INTO materials (id, name, unit) VALUES (1, 'material', 'kg')"))
+        for order_id, month, state in orders:
+            connection.execute(text("INSERT INTO orders (id, id_operator, id_forklift, creation_datetime, "
+                                    "estimate_datetime, state, canceled) "
+                                    "VALUES (:id, 1, 2, :created, :created, :state, false)"),
+                               {"id": order_id, "created": in_month(month), "state": state.value})
+            connection.execute(text("INSERT INTO material_by_order (id_material, id_order, quantity) "
+                                    "VALUES (1, :id, 2)"), {"id": order_id})
+        connection.execute(text("SELECT setval('orders_id_seq', :last)"), {"last": len(orders)})
+
+
+@pytest.fixture
+def migrated(postgres):
+    """The database of `postgres` migrated from its first revision with orders in it, rebuilt for the next tests."""
+    engine, session_local = postgres
+    drop_everything(engine)
+    try:
+        migrate(engine, FIRST_REVISION)
+        seed_first_revision(engine)
+        migrate(engine, 'head')
+        yield engine, session_local
+    finally:
+        drop_everything(engine)
+        Base.metadata.create_all(engine)
+        with session_local() as db:
+            seed(db)
+
+
+@pytest.mark.postgres
+def test_migrated_orders_are_maintained(migrated, monkeypatch):
+    engine, session_local = migrated
+    monkeypatch.setattr(OrderPartitionLogic, 'archive_after_months', 12)
+    today = add_months(THIS_MONTH, 2)
+    with session_local() as db:
+        assert OrderLogic._get_by_id(db, 1).materials_order
+
+        created, archived = asyncio.run(OrderPartitionLogic.maintain(db, today=today))
+
+        # The migration made the partitions up to 3 months from now
+        assert created == [add_months(THIS_MONTH, 4), add_months(THIS_MONTH, 5)]
+        # Every month that ended 12 months before `today`, but the one with a pending order
+        horizon = add_months(today, -12)
+        old_months = [add_months(CLOSED_MONTH, i) for i in range(16) if add_months(CLOSED_MONTH, i + 1) <= horizon]
+        assert archived == [month for month in old_months if month != PENDING_MONTH]
+        for table in ('orders', 'material_by_order'):
+            partition = OrderPartitionLogic.get_partition_name(table, CLOSED_MONTH)
+            assert db.scalar(text("SELECT to_regclass(:name)"), {"name": partition}) is None
+            assert db.scalar(text("SELECT to_regclass(:name)"),
+                             {"name": f"{OrderPartitionLogic.archive_schema}.{partition}"}) is not None
+
+        # Archived orders are gone with their keys, the others are read and written as before
+        assert OrderLogic._get_by_id(db, 1) is None
+        assert db.scalar(select(models.OrderKey.id).where(models.OrderKey.id == 1)) is None
+        changed, left = OrderLogic._change_state(db, 3, OrderStates.DELIVERED, {})
+        assert left == OrderStates.PENDING and changed.state == OrderStates.DELIVERED
+        updated = OrderLogic._update(db, 4, {"estimate_datetime": in_month(THIS_MONTH) + timedelta(days=1)})
+        assert updated.materials_order and updated.version > changed.version
+
+        now = datetime.now(timezone.utc)
+        order = OrderLogic._create(db, {"id_operator": 1, "id_forklift": 2, "creation_datetime": now,
+                                        "estimate_datetime": now, "state": OrderStates.PENDING,
+                                        "materials_order": [{"id_material": 1, "quantity": 1}]})
+        assert order.id == 5
+        assert OrderLogic._get_by_id(db, order.id).materials_order[0].quantity == 1
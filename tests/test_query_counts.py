@@ -0,0 +1,45 @@
+"""Statements issued to fetch and parse one list page must not depend on the page size."""
+import pytest
+
+from logic import ForkliftLogic, OperatorLogic, UserLogic
+from logic.order import OrderLogic
+from schemas.forklift import ForkliftFilter
+from schemas.operator import OperatorFilter
+from schemas.order import OrderFilter
+from schemas.user import UserFilter
+
+PAGE_SIZES = (10, 100)
+CRUDS = [(OrderLogic, OrderFilter), (OperatorLogic, OperatorFilter), (ForkliftLogic, ForkliftFilter),
+         (UserLogic, UserFilter)]
+
+
+def page_statements(session_local, statements, fetch) -> list[int]:
+    """Statements of `fetch(db, size)` at each of PAGE_SIZES, a fresh session each."""
+    counts = []
+    for size in PAGE_SIZES:
+        with session_local() as db:
+            statements[0] = 0
+            data, _ = fetch(db, size)
+            assert len(data) == size
+            counts.append(statements[0])
+    return counts
+
+
+@pytest.mark.parametrize("crud, filter_model", CRUDS, ids=[crud.db_model.__name__ for crud, _ in CRUDS])
+def test_offset_page(session_local, statements, crud, filter_model):
+    counts = page_statements(session_local, statements,
+                             lambda db, size: crud._filter_page_by_query(db, filter_model(), limit=size))
+    assert counts[0] == counts[1]
+
+
+def test_orders_page_with_materials(session_local, statements):
+    # The orders, then one statement each for the lines, the roles of the operators and those of the forklifts
+    counts = page_statements(session_local, statements,
+                             lambda db, size: OrderLogic._filter_page_by_query(db, OrderFilter(), limit=size))
+    assert counts == [4, 4]
+
+
+def test_orders_cursor_page(session_local, statements):
+    counts = page_statements(session_local, statements,
+                             lambda db, size: OrderLogic._filter_by_query_cursor(db, OrderFilter(), limit=size))
+    assert counts[0] == counts[1]
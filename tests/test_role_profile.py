@@ -0,0 +1,58 @@
+from sqlalchemy import select
+
+from db import models
+from logic import AdminLogic, ForkliftLogic, OperatorLogic
+from utils.enums import UserRoles
+
+import pytest
+
+
+def get_user_id(db, role: UserRoles) -> int:
+    return db.scalar(select(models.RoleByUser.id_user).where(models.RoleByUser.id_role == role)
+                     .order_by(models.RoleByUser.id_user))
+
+
+@pytest.mark.parametrize("crud, role", [(OperatorLogic, UserRoles.OPERATOR), (ForkliftLogic, UserRoles.FORKLIFT)])
+def test_get_by_user_id_is_one_statement(session_local, statements, crud, role):
+    with session_local() as db:
+        user_id = get_user_id(db, role)
+        statements[0] = 0
+        profile = crud._get_by_user_id(db, user_id)
+        assert statements[0] == 1
+        # Everything the schema unpacks was loaded by that statement
+        assert profile.id == user_id and profile.username and [r.id for r in profile.roles] == [role]
+        assert statements[0] == 1
+
+
+def test_get_by_user_id_of_another_role(session_local, statements):
+    with session_local() as db:
+        user_id = get_user_id(db, UserRoles.FORKLIFT)
+        statements[0] = 0
+        assert OperatorLogic._get_by_user_id(db, user_id) is None
+        assert AdminLogic._get_by_user_id(db, user_id) is None
+        assert statements[0] == 2
+
+
+def test_update_by_user_id(session_local, statements):
+    with session_local() as db:
+        user_id = get_user_id(db, UserRoles.OPERATOR)
+        statements[0] = 0
+        # The lookup, then one UPDATE per table changed
+        updated = OperatorLogic._update_by_user_id(db, user_id, {"area": "new area"})
+        assert statements[0] == 2
+        assert updated.area == "new area"
+
+        statements[0] = 0
+        updated = OperatorLogic._update_by_user_id(db, user_id, {"machine": "new machine", "username": "renamed"})
+        assert statements[0] == 3
+        assert (updated.machine, updated.username) == ("new machine", "renamed")
+
+
+def test_delete_user_by_user_id(session_local, statements):
+    with session_local() as db:
+        user_id = get_user_id(db, UserRoles.FORKLIFT)
+        statements[0] = 0
+        # The lookup and the DELETE of the user, its role and profile go with it (ON DELETE CASCADE)
+        assert ForkliftLogic._delete_user_by_user_id(db, user_id)
+        assert statements[0] == 2
+        assert db.get(models.User, user_id) is None
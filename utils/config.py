@@ -2,6 +2,8 @@ from functools import lru_cache
 from pydantic import BaseModel, Json, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from utils.enums import IdempotencyStores
+
 
 class DeploySettings(BaseModel):
     host: str = '0.0.0.0'
@@ -24,6 +26,19 @@ class DatabaseSettings(BaseModel):
     port: str = 5432
     user: str = 'postgres'
     password: str = 'postgres'
+    use_async: bool = False
+
+    pool_size: int = Field(default=5, ge=1)
+    pool_max_overflow: int = Field(default=10, ge=-1)
+    pool_timeout: float = Field(default=30, gt=0)
+    pool_recycle: int = -1
+    pool_pre_ping: bool = False
+    pool_use_lifo: bool = False
+
+    # Optional read replica, shares name and credentials with the primary
+    replica_host: str | None = None
+    replica_port: int | None = None
+    replica_sticky_seconds: float = Field(default=5, ge=0)
 
 
 class JWTSettings(BaseModel):
@@ -33,10 +48,59 @@ class JWTSettings(BaseModel):
     expiration_refresh_token: int = Field(default=86400, ge=0, le=2592000)
 
 
+class CacheSettings(BaseModel):
+    # Entity cache of the CRUDs built with cache=True, per worker process
+    enabled: bool = False
+    max_size: int = Field(default=1000, ge=0)
+    ttl: float = Field(default=30, ge=0)
+    # Overrides by table name, e.g. {"users": 5000}
+    sizes: Json[dict[str, int]] = {}
+    ttls: Json[dict[str, float]] = {}
+
+
+class DispatchSettings(BaseModel):
+    # Orders created without id_forklift get one from the dispatcher, per worker process
+    enabled: bool = False
+    # A forklift with open orders in the area of a new order takes it while it has fewer open orders than this
+    consolidate_below: int = Field(default=5, ge=0)
+    # Reload from the pending orders, to see forklifts added and orders written by other workers
+    refresh_seconds: float = Field(default=60, gt=0)
+
+
+class PartitionSettings(BaseModel):
+    # Monthly partitions of orders and their lines, PostgreSQL only: created this many months ahead
+    months_ahead: int = Field(default=3, ge=1)
+    # Partitions that ended this many months ago are archived once all their orders are closed, None keeps them
+    archive_after_months: int | None = Field(default=None, ge=1)
+    # Schema the archived partitions are moved to, out of the queries on orders
+    archive_schema: str = 'archive'
+    interval_seconds: float = Field(default=3600, gt=0)
+
+
+class OrderLogSettings(BaseModel):
+    # State changes are written to order_events in batches of this many rows...
+    batch_size: int = Field(default=500, ge=1)
+    # ...or this long after the first row of the batch, whichever comes first
+    flush_milliseconds: float = Field(default=200, gt=0)
+    # Rows kept while the database can't be written, newer ones are dropped
+    maximum_pending: int = Field(default=100000, ge=1)
+
+
+class IdempotencySettings(BaseModel):
+    # Responses kept for replays of requests with an Idempotency-Key: in memory per worker process (max_size of
+    # them), or in the idempotent_responses table shared by the workers
+    store: IdempotencyStores = IdempotencyStores.MEMORY
+    max_size: int = Field(default=10000, ge=1)
+    ttl: float = Field(default=86400, gt=0)
+    # Seconds a request holds its key in the table store, duplicates in other workers wait for it meanwhile
+    claim_timeout: float = Field(default=30, gt=0)
+
+
 class AppSettings(BaseModel):
     super_user_username: str = 'SuperAdmin1'
     super_user_password: str = 'password'
     maximum_page_size: int = 100
+    maximum_bulk_size: int = 50000
 
 
 class Settings(BaseSettings):
@@ -45,6 +109,11 @@ class Settings(BaseSettings):
     jwt: JWTSettings = JWTSettings()
     deploy: DeploySettings = DeploySettings()
     db: DatabaseSettings = DatabaseSettings()
+    cache: CacheSettings = CacheSettings()
+    dispatch: DispatchSettings = DispatchSettings()
+    partitions: PartitionSettings = PartitionSettings()
+    order_log: OrderLogSettings = OrderLogSettings()
+    idempotency: IdempotencySettings = IdempotencySettings()
 
     model_config = SettingsConfigDict(
         env_file='.env',
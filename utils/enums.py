@@ -16,6 +16,30 @@ class OrderStates(str, Enum):
     CANCELED_NO_MATERIAL = "no_hay_material"
 
 
+class UsageDimensions(str, Enum):
+    DAY = "day"
+    MATERIAL = "id_material"
+    AREA = "area"
+    FORKLIFT = "id_forklift"
+    STATE = "state"
+
+
+class ExportFormats(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+class IdempotencyStores(str, Enum):
+    MEMORY = "memory"
+    DATABASE = "database"
+
+
+class TotalModes(str, Enum):
+    EXACT = "exact"
+    APPROXIMATE = "approximate"
+    NONE = "none"
+
+
 def has_role(role: str, roles: list[Any]):
     for r in roles:
         if role == getattr(r, "id", "unknown"):
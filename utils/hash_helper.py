@@ -1,10 +1,21 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.hash import bcrypt
 
 
+# bcrypt releases the GIL while hashing, so batches spread over every core
+_hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+
 def get_hash_password(password):
     hashed_password = bcrypt.hash(password)
     return hashed_password
 
 
+def get_hash_passwords(passwords: list[str]) -> list[str]:
+    return list(_hash_executor.map(get_hash_password, passwords))
+
+
 def verify_password(plain_password, hashed_password):
     return bcrypt.verify(plain_password, hashed_password)